@@ -0,0 +1,276 @@
+# coding=utf-8
+"""
+On-disk archive of many layups
+Single file with
+    header | index of (design id, number of curves, angle sequence, per-curve offsets, layer start indices) | float block
+The index has a fixed capacity, set when the archive is created, and the points of all the curves of all the designs
+are appended to the contiguous float block at the end of the file. Both are opened through np.memmap, so loading one
+design, or one layer across all designs, only touches the pages holding it.
+Appends lock the file, hence several processes can write to the same archive.
+Run from  root '/' directory
+"""
+import os
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from model import Curve, CurvesBunch, Array2D
+
+MAGIC = b'OHTLAYUP'
+VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('capacity', '<u4'), ('max_curves', '<u4'),
+                         ('n_designs', '<u4'), ('data_offset', '<u8')])
+HEADER_SIZE = 64  # bytes reserved for the header
+POINT_DTYPE = np.dtype('<f8')  # points are stored as (x, y) pairs
+ID_LENGTH = 32
+
+
+def index_dtype(max_curves: int) -> np.dtype:
+    return np.dtype([('design_id', f'S{ID_LENGTH}'),
+                     ('n_curves', '<u4'),
+                     ('angles', '<f8', (max_curves,)),  # nan for the liner
+                     ('offsets', '<u8', (max_curves + 1,)),  # rows of the float block, curve k is offsets[k]:offsets[k+1]
+                     ('layer_start', '<i4', (max_curves,))])  # -1 for None
+
+
+if os.name == 'nt':
+    import msvcrt
+
+    @contextmanager
+    def _locked(file):
+        # LK_LOCK gives up after 10 attempts, one second apart: wait as long as flock does
+        while True:
+            file.seek(0)
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, HEADER_SIZE)
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, HEADER_SIZE)
+else:
+    import fcntl
+
+    @contextmanager
+    def _locked(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class LayupArchive:
+    def __init__(self, path: str):
+        """
+        Opens an existing archive. See create
+        """
+        self.path = path
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError(f"{path} is not a layup archive of version {VERSION}")
+        self.capacity = int(header['capacity'])
+        self.max_curves = int(header['max_curves'])
+        self.data_offset = int(header['data_offset'])
+        self.dtype = index_dtype(self.max_curves)
+        self._index = np.memmap(path, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(self.capacity,))
+        self._n = 0
+        self._data = np.empty((0, 2))
+        self.refresh()
+
+    @classmethod
+    def create(cls, path: str, capacity: int = 10000, max_curves: int = 64) -> "LayupArchive":
+        """
+        :param capacity: maximum number of designs
+        :param max_curves: maximum number of curves per design, liner included
+        """
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'], header['version'] = MAGIC, VERSION
+        header['capacity'], header['max_curves'] = capacity, max_curves
+        header['data_offset'] = HEADER_SIZE + capacity * index_dtype(max_curves).itemsize
+        with open(path, 'xb') as file:
+            file.write(header.tobytes().ljust(HEADER_SIZE, b'\0'))
+            file.truncate(int(header['data_offset'][0]))  # sparse, zero-filled index
+        return cls(path)
+
+    # ----- Reading -----
+    def refresh(self) -> None:
+        """
+        Maps the designs appended since the archive was opened, possibly by other processes
+        """
+        n = int(np.fromfile(self.path, dtype=HEADER_DTYPE, count=1)[0]['n_designs'])
+        if n == self._n and self._data.size:
+            return
+        self._n = n
+        rows = (os.path.getsize(self.path) - self.data_offset) // (2 * POINT_DTYPE.itemsize)
+        if rows > 0:
+            self._data = np.memmap(self.path, dtype=POINT_DTYPE, mode='r', offset=self.data_offset, shape=(rows, 2))
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def index(self) -> np.ndarray:
+        """ read-only view of the index records of the stored designs """
+        return self._index[:self._n]
+
+    @property
+    def design_ids(self) -> List[str]:
+        return [design_id.decode() for design_id in self.index['design_id']]
+
+    def find(self, design_id: str) -> int:
+        matches = np.flatnonzero(self.index['design_id'] == design_id.encode())
+        if matches.size == 0:
+            raise KeyError(design_id)
+        return int(matches[-1])
+
+    def angles(self, i: int) -> np.ndarray:
+        record = self._index[i]
+        return record['angles'][1:record['n_curves']]
+
+    def curve_points(self, i: int, k: int) -> Array2D:
+        """
+        :return: memory-mapped, read-only points of curve :k: of design :i:
+        """
+        offsets = self._index[i]['offsets']
+        return self._data[offsets[k]:offsets[k + 1]]
+
+    def load(self, i: int, copy: bool = False) -> CurvesBunch:
+        """
+        :param copy: copy the points into memory. Otherwise the curves are views of the archive
+        """
+        record = self._index[i]
+        curves = None
+        for k in range(int(record['n_curves'])):
+            points = self.curve_points(i, k)
+            curve = Curve(np.array(points) if copy else points)
+            if k == 0:
+                curves = CurvesBunch(curve)
+                continue
+            curve.winding_angle = float(record['angles'][k])
+            start = int(record['layer_start'][k])
+            curve.layer_start_index = None if start < 0 else start
+            curves.add_curve(curve)
+        return curves
+
+    def layer(self, k: int) -> List[Optional[Array2D]]:
+        """
+        :return: points of curve :k: of every design. None for designs with fewer curves
+        """
+        index = self.index
+        present = index['n_curves'] > k
+        starts, stops = index['offsets'][:, k], index['offsets'][:, k + 1]
+        return [self._data[start:stop] if ok else None for ok, start, stop in zip(present, starts, stops)]
+
+    def __iter__(self) -> Iterator[CurvesBunch]:
+        return (self.load(i) for i in range(len(self)))
+
+    # ----- Writing -----
+    def append(self, design_id: str, curves: CurvesBunch) -> int:
+        """
+        Appends one design. Safe to be called from several processes at the same time.
+        :return: index of the new design
+        """
+        return self.extend([(design_id, curves), ])[0]
+
+    def extend(self, designs: List[tuple]) -> List[int]:
+        """
+        Appends several (design id, CurvesBunch) pairs holding the lock only once
+        :return: indices of the new designs
+        """
+        if not designs:
+            return []
+        records = np.zeros(len(designs), dtype=self.dtype)
+        blocks = []
+        rows = 0
+        for record, (design_id, curves) in zip(records, designs):
+            n_curves = len(curves.curves)
+            if n_curves > self.max_curves:
+                raise ValueError(f"{design_id} has {n_curves} curves, the archive allows {self.max_curves}")
+            if len(design_id.encode()) > ID_LENGTH:
+                raise ValueError(f"design id {design_id} is longer than {ID_LENGTH} bytes")
+            lengths = [len(curve.points) for curve in curves.curves]
+            record['design_id'] = design_id.encode()
+            record['n_curves'] = n_curves
+            record['angles'][:] = np.nan
+            record['angles'][1:n_curves] = [curve.winding_angle for curve in curves.curves[1:]]
+            record['offsets'][:n_curves + 1] = rows + np.insert(np.cumsum(lengths), 0, 0)
+            record['offsets'][n_curves + 1:] = record['offsets'][n_curves]
+            record['layer_start'][:] = -1
+            record['layer_start'][:n_curves] = [-1 if curve.layer_start_index is None else curve.layer_start_index
+                                                for curve in curves.curves]
+            blocks.extend(curve.points for curve in curves.curves)
+            rows += sum(lengths)
+        data = np.concatenate(blocks, axis=0).astype(POINT_DTYPE, copy=False)
+
+        with open(self.path, 'r+b') as file, _locked(file):
+            header = np.frombuffer(file.read(HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE)[0].copy()
+            n = int(header['n_designs'])
+            if n + len(designs) > self.capacity:
+                raise ValueError(f"archive is full ({self.capacity} designs)")
+            # data first, then the index, and last the counter: readers never see incomplete designs
+            end = file.seek(0, os.SEEK_END)
+            first_row = (end - self.data_offset) // (2 * POINT_DTYPE.itemsize)
+            file.write(data.tobytes())
+            records['offsets'] += np.uint64(first_row)
+            file.seek(HEADER_SIZE + n * self.dtype.itemsize)
+            file.write(records.tobytes())
+            file.flush()
+            header['n_designs'] = n + len(designs)
+            file.seek(0)
+            file.write(header.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.refresh()
+        return list(range(n, n + len(designs)))
+
+
+def _append_worker(args) -> int:
+    path, design_id, curves = args
+    return LayupArchive(path).append(design_id, curves)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from src.thickness import main as calculate_layup
+
+    # Throughput benchmark: python ./src/archive.py [number of designs] [archive path]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join('.', 'temp', 'benchmark.layups')
+    layup = calculate_layup()
+    megabytes = sum(curve.points.nbytes for curve in layup.curves) * n / 2 ** 20
+    if os.path.exists(path):
+        os.remove(path)
+    archive = LayupArchive.create(path, capacity=2 * n, max_curves=len(layup.curves))
+
+    start = time.perf_counter()
+    for chunk in range(0, n, 100):
+        archive.extend([(f"design_{i:06d}", layup) for i in range(chunk, min(chunk + 100, n))])
+    elapsed = time.perf_counter() - start
+    print(f"write: {n / elapsed:.0f} designs/s, {megabytes / elapsed:.1f} MB/s")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(_append_worker, ((path, f"concurrent_{i:06d}", layup) for i in range(n // 10)), chunksize=8))
+    elapsed = time.perf_counter() - start
+    archive.refresh()
+    print(f"concurrent append: {n // 10 / elapsed:.0f} designs/s, {len(archive)} designs stored")
+
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    for i in rng.integers(0, len(archive), 1000):
+        archive.load(int(i), copy=True)
+    elapsed = time.perf_counter() - start
+    print(f"random design read: {1000 / elapsed:.0f} designs/s")
+
+    start = time.perf_counter()
+    layers = [np.array(points) for points in archive.layer(len(layup.curves) // 2)]
+    elapsed = time.perf_counter() - start
+    print(f"one layer across {len(layers)} designs: {elapsed * 1e3:.1f} ms")
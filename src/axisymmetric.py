@@ -0,0 +1,422 @@
+# coding=utf-8
+"""
+Axisymmetric finite elements with twist
+Linear static analysis of the layup without Abaqus, on the model of trivial.py: internal pressure on the liner side of
+the layup below routine_geometry.pressure_end_point, symmetry at y = 0 and, as BC-2, no twist unless fix_twist=False.
+The mesh is structured. Stations along the liner are projected curve by curve onto the next one, giving one element
+per layer through the thickness. Where a layer has not started, its corners coincide with the previous curve: those
+quadrilaterals collapse into triangles or are dropped. Elements are straight-sided 8 node quadrilaterals and 6 node
+triangles, as CGAX8 and CGAX6, with the displacements u_r, u_z, u_theta independent of theta.
+The ply axes follow the meridian of every element, with the winding angle of Clairaut's relation.
+Element matrices are computed in vectorized chunks and assembled with scipy.sparse.
+Run from  root '/' directory
+"""
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+from numpy import pi
+from scipy.sparse import coo_matrix
+from scipy.sparse.linalg import splu
+
+import src.routines.routine_constants as rc
+from model import CurvesBunch
+from src.routines.routine_geometry import pressure_end_point
+from src.cylinder import CYLINDRICAL, cylindrical_stiffness
+from src.sublaminates import bond_matrices, rotation_bond_matrices
+
+MERGE_TOLERANCE = 1e-3  # mm. Projected corners closer than this to the previous curve are the same node
+DOFS = ('u_r', 'u_z', 'u_theta')
+COMPONENTS = ('r', 'theta', 'z', 'theta_z', 'r_z', 'r_theta')  # cylindrical Voigt order, see src/cylinder.py
+
+
+# ----- Elements -----
+
+def _quad8(xi: np.ndarray, eta: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: shape functions (points, 8) and their derivatives (points, 8, 2). Corners first, counterclockwise, then
+    the midside nodes of the edges 1-2, 2-3, 3-4, 4-1
+    """
+    xi_i = np.array([-1., 1., 1., -1., 0., 1., 0., -1.])
+    eta_i = np.array([-1., -1., 1., 1., -1., 0., 1., 0.])
+    x, e = xi[:, None] * xi_i, eta[:, None] * eta_i
+    corner = np.arange(8) < 4
+    N = np.where(corner, (1 + x) * (1 + e) * (x + e - 1) / 4,
+                 np.where(xi_i == 0, (1 - xi[:, None] ** 2) * (1 + e) / 2, (1 + x) * (1 - eta[:, None] ** 2) / 2))
+    dxi = np.where(corner, xi_i * (1 + e) * (2 * x + e) / 4,
+                   np.where(xi_i == 0, -xi[:, None] * (1 + e), xi_i * (1 - eta[:, None] ** 2) / 2))
+    deta = np.where(corner, eta_i * (1 + x) * (x + 2 * e) / 4,
+                    np.where(xi_i == 0, eta_i * (1 - xi[:, None] ** 2) / 2, -eta[:, None] * (1 + x)))
+    return N, np.stack((dxi, deta), axis=-1)
+
+
+def _tri6(xi: np.ndarray, eta: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: shape functions (points, 6) and their derivatives (points, 6, 2). Corners first, counterclockwise, then
+    the midside nodes of the edges 1-2, 2-3, 3-1
+    """
+    L = np.stack((1 - xi - eta, xi, eta), axis=-1)
+    dL = np.array([[-1., -1.], [1., 0.], [0., 1.]])
+    pairs = np.array([[0, 1], [1, 2], [2, 0]])
+    N = np.concatenate((L * (2 * L - 1), 4 * L[:, pairs[:, 0]] * L[:, pairs[:, 1]]), axis=1)
+    dN = np.concatenate(((4 * L - 1)[..., None] * dL,
+                         4 * (L[:, pairs[:, 0], None] * dL[pairs[:, 1]] + L[:, pairs[:, 1], None] * dL[pairs[:, 0]])),
+                        axis=1)
+    return N, dN
+
+
+@dataclass(frozen=True)
+class _Element:
+    corners: int
+    shape_functions: Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]
+    gauss_points: np.ndarray  # natural coordinates (points, 2)
+    weights: np.ndarray
+    centroid: Tuple[float, float]  # natural coordinates
+
+
+_GAUSS_3 = np.array([-np.sqrt(3 / 5), 0., np.sqrt(3 / 5)]), np.array([5 / 9, 8 / 9, 5 / 9])
+ELEMENTS = {
+    'quad8': _Element(4, _quad8, np.stack(np.meshgrid(_GAUSS_3[0], _GAUSS_3[0]), axis=-1).reshape(-1, 2),
+                      np.outer(_GAUSS_3[1], _GAUSS_3[1]).ravel(), (0., 0.)),
+    'tri6': _Element(3, _tri6, np.array([[1 / 6, 1 / 6], [2 / 3, 1 / 6], [1 / 6, 2 / 3]]), np.full(3, 1 / 6),
+                     (1 / 3, 1 / 3)),
+}
+
+
+# ----- Mesh -----
+
+@dataclass
+class AxisymmetricMesh:
+    nodes: np.ndarray  # (nodes, 2) r, z
+    elements: Dict[str, np.ndarray]  # element type -> connectivity (elements, nodes per element), see ELEMENTS
+    layers: np.ndarray  # (elements,) layer of every element, in the order of the element types
+    meridians: np.ndarray  # (elements, 2) unit tangent of the meridian, pointing to the pole on the cylinder
+    angles: np.ndarray  # (elements,) local winding angle in degrees
+    pressure_edges: np.ndarray  # (edges, 3) corner, midside, corner nodes on the liner, counterclockwise
+    symmetry_nodes: np.ndarray  # nodes at y = 0
+
+    @property
+    def n_elements(self) -> int:
+        return len(self.layers)
+
+    def centroids(self) -> np.ndarray:
+        return np.concatenate([self.nodes[connectivity[:, :ELEMENTS[kind].corners]].mean(axis=1)
+                               for kind, connectivity in self.elements.items()])
+
+
+def _at_arclength(points: np.ndarray, s_points: np.ndarray, s: np.ndarray) -> np.ndarray:
+    return np.column_stack((np.interp(s, s_points, points[:, 0]), np.interp(s, s_points, points[:, 1])))
+
+
+def _project(points: np.ndarray, curve: np.ndarray, s_curve: np.ndarray) -> np.ndarray:
+    """
+    :param s_curve: arclength of the points of :curve:
+    :return: arclength along :curve: of the closest point to every point
+    """
+    start, direction = curve[:-1], np.diff(curve, axis=0)
+    length_2 = (direction ** 2).sum(axis=1)
+    t = ((points[:, None] - start) * direction).sum(axis=-1) / np.where(length_2 > 0, length_2, 1.)
+    t = np.clip(t, 0., 1.)
+    distance = np.linalg.norm(points[:, None] - start - t[..., None] * direction, axis=-1)
+    segment = np.argmin(distance, axis=1)
+    return s_curve[segment] + t[np.arange(len(points)), segment] * np.sqrt(length_2[segment])
+
+
+def generate_mesh(curves: CurvesBunch, element_length: float = rc.LAYUP_MESH_SIZE) -> AxisymmetricMesh:
+    """
+    :param element_length: spacing of the stations along the liner, in mm
+    """
+    liner = curves.curves[0].points
+    s_liner = curves.curves[0].arclength
+    n = max(int(np.ceil(s_liner[-1] / element_length)), 1)
+    stations = _at_arclength(liner, s_liner, np.linspace(0., s_liner[-1], n + 1))
+    coordinates, ids = [stations], [np.arange(n + 1)]
+    n_nodes = n + 1
+
+    # ----- corners: stations projected onto every curve, merged with the previous curve where it is not a layer -----
+    # Several stations may be projected onto the same corner of a curve, e.g. at the neck: those are one node as well
+    for curve in curves.curves[1:]:
+        s_curve = curve.arclength
+        s = np.maximum.accumulate(_project(stations, curve.points, s_curve))
+        s[-1] = s_curve[-1]  # y = 0
+        projected = _at_arclength(curve.points, s_curve, s)
+        merged = np.linalg.norm(projected - stations, axis=1) < MERGE_TOLERANCE
+        repeated = np.concatenate(([False], np.linalg.norm(np.diff(projected, axis=0), axis=1) < MERGE_TOLERANCE))
+        new = ~merged & ~repeated
+        candidates = np.where(merged, ids[-1], n_nodes + np.cumsum(new) - 1)
+        ids.append(candidates[np.maximum.accumulate(np.where(repeated, 0, np.arange(len(s))))])
+        coordinates.append(projected[new])
+        n_nodes += np.count_nonzero(new)
+        stations = np.where(merged[:, None], stations, projected)
+    nodes = np.concatenate(coordinates)
+    ids = np.array(ids)
+
+    # ----- elements between consecutive curves and stations, counterclockwise -----
+    corners = np.stack((ids[:-1, :-1], ids[:-1, 1:], ids[1:, 1:], ids[1:, :-1]), axis=-1).reshape(-1, 4)
+    layers = np.repeat(np.arange(1, len(ids)), n)
+    repeated = corners == np.roll(corners, -1, axis=1)
+    collapsed = repeated.sum(axis=1)
+    is_quad, is_tri = collapsed == 0, collapsed == 1
+    connectivity = {'quad8': corners[is_quad], 'tri6': corners[is_tri][~repeated[is_tri]].reshape(-1, 3)}
+    layers = np.concatenate((layers[is_quad], layers[is_tri]))
+
+    # meridian from the uncollapsed corners: upper station minus lower station
+    points = nodes[corners]
+    meridians = np.concatenate([(points[..., 0, :] + points[..., 3, :] - points[..., 1, :] - points[..., 2, :])[mask]
+                                for mask in (is_quad, is_tri)])
+    meridians /= np.linalg.norm(meridians, axis=1)[:, None]
+
+    # ----- midside nodes of the straight edges, shared by the neighbouring elements -----
+    edges = [np.stack((connectivity[kind], np.roll(connectivity[kind], -1, axis=1)), axis=-1) for kind in ELEMENTS]
+    keys = np.sort(np.concatenate([edge.reshape(-1, 2) for edge in edges]), axis=1)
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    midsides = n_nodes + inverse.ravel()
+    nodes = np.concatenate((nodes, nodes[unique].mean(axis=1)))
+    offset = 0
+    for kind, edge in zip(ELEMENTS, edges):
+        count = edge.shape[0] * edge.shape[1]
+        midside = midsides[offset:offset + count].reshape(edge.shape[:2])
+        connectivity[kind] = np.concatenate((connectivity[kind], midside), axis=1)
+        offset += count
+
+    # ----- pressure on the liner side: edges between two liner stations, counterclockwise in their element -----
+    directed = np.concatenate([np.stack((edge[..., 0], connectivity[kind][:, ELEMENTS[kind].corners:],
+                                         edge[..., 1]), axis=-1).reshape(-1, 3) for kind, edge in zip(ELEMENTS, edges)])
+    on_liner = (directed[:, 0] <= n) & (directed[:, 2] <= n)
+    on_liner &= nodes[directed[:, 1], 1] < pressure_end_point(curves.to_abaqus_format())
+
+    # ----- drop the nodes without elements, e.g. the stations above the start of every layer -----
+    used = np.unique(np.concatenate([connectivity[kind].ravel() for kind in ELEMENTS]))
+    numbering = np.full(len(nodes), -1)
+    numbering[used] = np.arange(len(used))
+    connectivity = {kind: numbering[connectivity[kind]] for kind in ELEMENTS}
+    symmetry_nodes = numbering[used[np.abs(nodes[used, 1]) < MERGE_TOLERANCE]]
+    mesh = AxisymmetricMesh(nodes[used], connectivity, layers, meridians, np.zeros(len(layers)),
+                            numbering[directed[on_liner]], symmetry_nodes)
+    mesh.angles = winding_angles(curves, layers, mesh.centroids()[:, 0])
+    return mesh
+
+
+def winding_angles(curves: CurvesBunch, layers: np.ndarray, r: np.ndarray) -> np.ndarray:
+    """
+    Winding angle along the meridian, Clairaut: r sin(alpha) = R sin(alpha_0), R at the cylinder
+    :param layers: layer of every point, 1 being the first layer above the liner
+    :param r: radius of every point
+    :return: local winding angle in degrees
+    """
+    winding = np.array([curve.winding_angle for curve in curves.curves[1:]], dtype=float)
+    cylinder_radii = np.array([curve.points[-1, 0] for curve in curves.curves])
+    R = (cylinder_radii[:-1] + cylinder_radii[1:]) / 2
+    clairaut = R[layers - 1] * np.sin(np.radians(winding[layers - 1])) / r
+    return np.where(clairaut < 1., np.degrees(np.arcsin(np.minimum(clairaut, 1.))), 90.)
+
+
+# ----- Assembly -----
+
+def element_stiffness(mesh: AxisymmetricMesh, properties=rc.LAYUP_MATERIAL_PROPS) -> np.ndarray:
+    """
+    :param properties: engineering constants of the ply, or a list of them for every layer, e.g. of sublaminates
+    :return: (elements, 6, 6) stiffness of every element in the cylindrical Voigt order
+    """
+    t_r, t_z = mesh.meridians.T
+    a = np.zeros((mesh.n_elements, 3, 3))  # local n, theta, m -> r, theta, z
+    a[:, 0, 0], a[:, 0, 2], a[:, 1, 1], a[:, 2, 0], a[:, 2, 2] = t_z, t_r, 1., -t_r, t_z
+    M = rotation_bond_matrices(a)
+    if np.ndim(properties) == 2:
+        C = np.zeros((mesh.n_elements, 6, 6))
+        for layer, constants in enumerate(properties, 1):
+            C[mesh.layers == layer] = cylindrical_stiffness(mesh.angles[mesh.layers == layer], constants)
+    else:
+        C = cylindrical_stiffness(mesh.angles, properties)
+    return M @ C @ np.swapaxes(M, -1, -2)
+
+
+def _strain_operator(element: _Element, X: np.ndarray, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param X: (elements, nodes, 2) nodal coordinates
+    :param points: (points, 2) natural coordinates
+    :return: B (elements, points, 6, 3 nodes) and the volume factor 2 pi r det(J)
+    """
+    N, dN = element.shape_functions(points[:, 0], points[:, 1])
+    J = np.einsum('gna,enb->egab', dN, X)
+    det = J[..., 0, 0] * J[..., 1, 1] - J[..., 0, 1] * J[..., 1, 0]
+    if (det <= 0).any():
+        raise ValueError(f"{np.count_nonzero((det <= 0).any(axis=1))} distorted elements. Change element_length")
+    dx = np.einsum('egab,gnb->egna', np.linalg.inv(J), dN)
+    r = np.einsum('gn,en->eg', N, X[..., 0])
+    N_r = N / r[..., None]
+
+    B = np.zeros(dx.shape[:2] + (6, N.shape[1], 3))
+    B[..., 0, :, 0] = dx[..., 0]
+    B[..., 1, :, 0] = N_r
+    B[..., 2, :, 1] = dx[..., 1]
+    B[..., 3, :, 2] = dx[..., 1]
+    B[..., 4, :, 0], B[..., 4, :, 1] = dx[..., 1], dx[..., 0]
+    B[..., 5, :, 2] = dx[..., 0] - N_r
+    return B.reshape(B.shape[:3] + (-1,)), 2 * pi * r * det
+
+
+def _element_dofs(connectivity: np.ndarray) -> np.ndarray:
+    return (3 * connectivity[..., None] + np.arange(3)).reshape(len(connectivity), -1)
+
+
+def assemble(mesh: AxisymmetricMesh, C: np.ndarray, chunk_size: int = 4096) -> coo_matrix:
+    """
+    :param C: (elements, 6, 6) stiffness of every element, see element_stiffness
+    """
+    rows, columns, values = [], [], []
+    first = 0
+    for kind, connectivity in mesh.elements.items():
+        element = ELEMENTS[kind]
+        for start in range(0, len(connectivity), chunk_size):
+            chunk = connectivity[start:start + chunk_size]
+            B, volume = _strain_operator(element, mesh.nodes[chunk], element.gauss_points)
+            CB = (C[first + start:first + start + len(chunk), None] @ B).reshape(len(chunk), -1, B.shape[-1])
+            weighted = (B * (volume * element.weights)[..., None, None]).reshape(CB.shape)
+            K = np.swapaxes(weighted, 1, 2) @ CB
+            dofs = _element_dofs(chunk)
+            rows.append(np.repeat(dofs, dofs.shape[1], axis=1).ravel())
+            columns.append(np.tile(dofs, dofs.shape[1]).ravel())
+            values.append(K.ravel())
+        first += len(connectivity)
+    size = 3 * len(mesh.nodes)
+    return coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))), shape=(size, size))
+
+
+def pressure_load(mesh: AxisymmetricMesh, pressure: float = rc.LOAD_MAG) -> np.ndarray:
+    """
+    :return: consistent nodal forces of the pressure on the liner side, (3 nodes,)
+    """
+    xi, weights = _GAUSS_3
+    N = np.stack((xi * (xi - 1) / 2, 1 - xi ** 2, xi * (xi + 1) / 2), axis=-1)
+    dN = np.stack((xi - 0.5, -2 * xi, xi + 0.5), axis=-1)
+    X = mesh.nodes[mesh.pressure_edges]
+    r = np.einsum('gn,en->eg', N, X[..., 0])
+    tangent = np.einsum('gn,enb->egb', dN, X)
+    # the element is on the left of its counterclockwise edges: the pressure pushes to the left
+    traction = pressure * np.stack((-tangent[..., 1], tangent[..., 0]), axis=-1) * (2 * pi * r * weights)[..., None]
+    forces = np.einsum('gn,egb->enb', N, traction)
+    f = np.zeros(3 * len(mesh.nodes))
+    np.add.at(f, 3 * mesh.pressure_edges[..., None] + np.arange(2), forces)
+    return f
+
+
+# ----- Solution -----
+
+@dataclass
+class AxisymmetricSolution:
+    mesh: AxisymmetricMesh
+    displacements: np.ndarray  # (nodes, 3) u_r, u_z, u_theta
+    stresses: np.ndarray  # (elements, 6) at the centroids, in the cylindrical Voigt order
+    strains: np.ndarray  # (elements, 6) engineering strains at the centroids, in the cylindrical Voigt order
+
+    def _ply_axes(self, angles: Optional[np.ndarray]) -> np.ndarray:
+        """
+        :return: (elements, 6, 6) transformation of the stresses from the cylindrical Voigt order to the ply axes
+        """
+        t_r, t_z = self.mesh.meridians.T
+        a = np.zeros((self.mesh.n_elements, 3, 3))  # r, theta, z -> local n, theta, m
+        a[:, 0, 0], a[:, 0, 2], a[:, 1, 1], a[:, 2, 0], a[:, 2, 2] = t_z, -t_r, 1., t_r, t_z
+        angles = self.mesh.angles if angles is None else angles
+        return bond_matrices(np.radians(angles)) @ rotation_bond_matrices(a)[:, CYLINDRICAL]
+
+    def material_stresses(self, angles: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        :param angles: (elements,) winding angles of the ply axes in degrees, by default those of the mesh
+        :return: (elements, 6) stresses in the ply axes: fiber, transverse, radial (11, 22, 33, 23, 13, 12)
+        """
+        return np.einsum('eij,ej->ei', self._ply_axes(angles), self.stresses)
+
+    def material_strains(self, angles: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        :return: (elements, 6) engineering strains in the ply axes, see material_stresses
+        """
+        return np.einsum('eji,ej->ei', np.linalg.inv(self._ply_axes(angles)), self.strains)
+
+
+def solve_loads(mesh: AxisymmetricMesh, loads: Dict[str, np.ndarray], properties=rc.LAYUP_MATERIAL_PROPS,
+                fix_twist: bool = True) -> Dict[str, AxisymmetricSolution]:
+    """
+    Solves several load cases with one factorization of the stiffness matrix
+    :param loads: name -> nodal forces (3 nodes,), e.g. of pressure_load
+    :param fix_twist: u_theta = 0 everywhere, as BC-2 of trivial.py. Otherwise only at the symmetry plane
+    """
+    C = element_stiffness(mesh, properties)
+    K = assemble(mesh, C).tocsr()
+    f = np.column_stack(list(loads.values()))
+
+    fixed = np.zeros((len(mesh.nodes), 3), dtype=bool)
+    fixed[mesh.symmetry_nodes, 1] = True
+    fixed[mesh.symmetry_nodes if not fix_twist else slice(None), 2] = True
+    free = ~fixed.ravel()
+    u = np.zeros(f.shape)
+    # symmetric fill-reducing ordering, several times faster than the default one on these meshes
+    u[free] = splu(K[free][:, free].tocsc(), permc_spec='MMD_AT_PLUS_A').solve(f[free])
+
+    solutions = {}
+    for name, u_load in zip(loads, u.T):
+        u_load = u_load.reshape(-1, 3)
+        # stresses at the centroids
+        stresses, strains, first = [], [], 0
+        for kind, connectivity in mesh.elements.items():
+            element = ELEMENTS[kind]
+            B, _ = _strain_operator(element, mesh.nodes[connectivity], np.array([element.centroid]))
+            strains.append(np.einsum('eim,em->ei', B[:, 0], u_load[connectivity].reshape(len(connectivity), -1)))
+            stresses.append(np.einsum('eij,ej->ei', C[first:first + len(connectivity)], strains[-1]))
+            first += len(connectivity)
+        solutions[name] = AxisymmetricSolution(mesh, u_load, np.concatenate(stresses), np.concatenate(strains))
+    return solutions
+
+
+def solve(mesh: AxisymmetricMesh, pressure: float = rc.LOAD_MAG, properties=rc.LAYUP_MATERIAL_PROPS,
+          fix_twist: bool = True) -> AxisymmetricSolution:
+    """
+    :param fix_twist: u_theta = 0 everywhere, as BC-2 of trivial.py. Otherwise only at the symmetry plane
+    """
+    return solve_loads(mesh, {'pressure': pressure_load(mesh, pressure)}, properties, fix_twist)['pressure']
+
+
+def solve_layup(curves: CurvesBunch, element_length: float = rc.LAYUP_MESH_SIZE, **kwargs) -> AxisymmetricSolution:
+    """
+    :param kwargs: see solve
+    """
+    return solve(generate_mesh(curves, element_length), **kwargs)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from src.cylinder import cylinder_stack, solve as solve_cylinder
+    from src.thickness import main as calculate_layup
+
+    # python ./src/axisymmetric.py [element length]
+    element_length = float(sys.argv[1]) if len(sys.argv) > 1 else rc.LAYUP_MESH_SIZE
+    layup = calculate_layup()
+
+    start = time.perf_counter()
+    mesh = generate_mesh(layup, element_length)
+    meshed = time.perf_counter()
+    solution = solve(mesh, fix_twist=False)
+    end = time.perf_counter()
+    print(f"{len(mesh.elements['quad8'])} quad8 and {len(mesh.elements['tri6'])} tri6 elements, "
+          f"{3 * len(mesh.nodes)} dofs: meshed in {meshed - start:.2f} s, solved in {end - meshed:.2f} s")
+
+    # validation against the closed form of the cylinder, away from the dome. The domes are not loaded above
+    # routine_geometry.pressure_end_point: the axial force is that of the closed ends less the unloaded opening
+    radii, angles = cylinder_stack(layup)
+    closed, open_ended = solve_cylinder(radii, angles), solve_cylinder(radii, angles, closed_end=False)
+    opening = mesh.nodes[mesh.pressure_edges, 0].min()
+    centroids = mesh.centroids()
+    near = centroids[:, 1] < 4 * element_length
+    r = np.broadcast_to(centroids[near, 0], (1, len(angles), near.sum()))
+    at = (0, mesh.layers[near] - 1, np.arange(near.sum()))
+    closed_form = open_ended.stresses(r)[at] + (1 - (opening / radii[0]) ** 2) * (closed.stresses(r)[at]
+                                                                                 - open_ended.stresses(r)[at])
+    scale = np.abs(closed_form).max(axis=0)
+    error = np.abs(solution.stresses[near, :4] - closed_form).max(axis=0) / scale
+    print("max difference to the closed form at the cylinder, relative to the peak of each component: " + ", ".join(
+        f"{name} {100 * value:.4f} %" for name, value in zip(COMPONENTS, error)))
+
+    solution = solve(mesh)
+    print(f"with the twist fixed as in trivial.py: max u_r {solution.displacements[:, 0].max():.3f} mm, "
+          f"peak fiber stress {solution.material_stresses()[:, 0].max():.0f} MPa")
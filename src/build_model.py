@@ -1,21 +1,292 @@
+import os
 import sys
+import threading
+import time
+import traceback
 
 sys.path.append('../src')
 
+INTERCHANGE_FILE = "../resources/intermediate_file.txt"
+JOB_NAME = 'Job-1'
+
+# ----- Worker mode -----
+# Intermediate files dropped in the queue directory as <job name>.txt are claimed by renaming them to .working,
+# and renamed to .done or .failed once processed. Creating a file named STOP in the queue shuts the worker down.
+# With --update, the worker keeps the model of the previous design and rebuilds only the layers that changed.
+# A worker touches its claim every HEARTBEAT seconds. Claims of workers that died, untouched for LEASE seconds, are put
+# back in the queue by the other workers, and failed once MAX_ATTEMPTS workers died on them (see <job name>.recovered).
+# The lease is well above the heartbeat: a long CAE command may hold the interpreter, and the heartbeat thread with it.
+# The workers run on the host of the queue: the modification times are compared with its clock.
+# See src/worker_harness.py to run a worker on CPython, with stand-ins for the model database and the routines.
+QUEUE_EXTENSION = '.txt'
+CLAIM_EXTENSION = '.working'
+STOP_FILE = 'STOP'
+POLL_INTERVAL = 0.5  # s
+HEARTBEAT = 10.  # s
+LEASE = 300.  # s
+MAX_ATTEMPTS = 3
+
+
+def read_interchange(filename):
+    with open(filename, "r") as file:
+        return eval(file.read())
+
+
+def parse_arguments(argv):
+    """
+    Arguments passed after '--' in the abaqus command, e.g.,
+    abaqus cae noGUI=../src/build_model.py -- ../temp/design.txt design --no-submit
+    abaqus cae noGUI=../src/build_model.py -- --worker queue --no-submit --update
+    :return: intermediate file name (queue directory in worker mode), job name, whether to submit the job, worker mode,
+    update mode
+    """
+    args = argv[argv.index('--') + 1:] if '--' in argv else []
+    flags = [arg for arg in args if arg.startswith('--')]
+    args = [arg for arg in args if not arg.startswith('--')]
+    filename = args[0] if len(args) > 0 else INTERCHANGE_FILE
+    job_name = args[1] if len(args) > 1 else JOB_NAME
+    return filename, job_name, '--no-submit' not in flags, '--worker' in flags, '--update' in flags
+
+
+def unpack_interchange(data):
+    """
+    The intermediate file holds either the list of curves, or a dict with the curves under 'lines' and, optionally,
+    the winding angle ('angles') and the engineering constants ('materials') of every layer, e.g. for sublaminates
+    :return: lines, angles, materials. None when not given
+    """
+    if isinstance(data, dict):
+        return data['lines'], data.get('angles'), data.get('materials')
+    return data, None, None
+
+
+def first_changed(previous, data):
+    """
+    :param previous, data: contents of two intermediate files
+    :return: index of the first line whose curve, winding angle or material differs, 0 is the liner.
+    None if both describe the same model
+    """
+    from src.layup_diff import first_changed_line, first_difference
+
+    old_lines, old_angles, old_materials = unpack_interchange(previous)
+    lines, angles, materials = unpack_interchange(data)
+    changed = [first_changed_line(old_lines, lines)]
+    for old, new in ((old_angles, angles), (old_materials, materials)):  # given per layer, from line 1 on
+        if old is None or new is None:
+            changed.append(None if old is new else 1)
+        else:
+            index = first_difference(old, new)
+            changed.append(None if index is None else index + 1)
+    changed = [index for index in changed if index is not None]
+    return min(changed) if changed else None
+
+
+def build(routines, data, job_name, submit, separate=False):
+    """
+    Runs the routine sequence on the current model database
+    :param routines: namespace with the routine modules
+    :param data: content of the intermediate file. See unpack_interchange
+    :param separate: one partition per line, so that the model can be updated. See update
+    """
+    lines, angles, materials = unpack_interchange(data)
+    routines.create_part.main(lines)
+    routines.cut_face.main(lines, separate)
+    routines.assemble_parts.main()
+    routines.create_sets_surfs.main(lines)
+    routines.mesher.main()
+    routines.orient_elements.main(lines, angles)
+    routines.assign_property.main(materials)
+    routines.trivial.main(job_name, submit)
+
+
+def update(routines, data, previous, first, job_name, submit):
+    """
+    Rebuilds the layers from :first: on, in the model of :previous: built with build(..., separate=True).
+    The partitions, sets and mesh of the layers below are kept. Step, loads and BCs are defined on sets and surfaces,
+    which are recreated, hence the job is written right away.
+    :param first: see first_changed. At least 1, the liner is never updated. None if nothing changed
+    """
+    lines, angles, materials = unpack_interchange(data)
+    if first is not None:
+        routines.cut_face.update(lines, first, len(unpack_interchange(previous)[0]))
+        routines.create_sets_surfs.main(lines, first)
+        routines.mesher.main(update=True)
+        routines.orient_elements.main(lines, angles, first)
+        routines.assign_property.main(materials, first)
+    routines.trivial.write_job(job_name, submit)
+
+
+def reset_model(modules, new_mdb):
+    """
+    Starts from an empty model database. The routines hold their own reference to mdb,
+    obtained through 'from abaqus import *', hence it is rebound in every module.
+    :param modules: routine modules
+    :param new_mdb: callable returning a new model database, i.e., abaqus.Mdb
+    """
+    database = new_mdb()
+    for module in modules:
+        module.mdb = database
+    return database
+
+
+def claim_next(queue_dir):
+    """
+    :return: path of the claimed file and its job name, or None if the queue is empty
+    """
+    for name in sorted(os.listdir(queue_dir)):
+        if not name.endswith(QUEUE_EXTENSION):
+            continue
+        path = os.path.join(queue_dir, name)
+        try:
+            os.rename(path, path + CLAIM_EXTENSION)  # atomic: only one worker succeeds
+        except OSError:
+            continue  # claimed by another worker
+        os.utime(path + CLAIM_EXTENSION, None)  # the rename keeps the time the file was dropped
+        return path + CLAIM_EXTENSION, name[:-len(QUEUE_EXTENSION)]
+    return None
+
+
+def recover(queue_dir, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+    """
+    Puts the claims not touched for :lease: seconds back in the queue, or fails them after :max_attempts:
+    :return: job names of the recovered claims
+    """
+    recovered = []
+    now = time.time()
+    for name in sorted(os.listdir(queue_dir)):
+        if not name.endswith(QUEUE_EXTENSION + CLAIM_EXTENSION):
+            continue
+        path = os.path.join(queue_dir, name)
+        pending = path[:-len(CLAIM_EXTENSION)]
+        job_name = name[:-len(QUEUE_EXTENSION + CLAIM_EXTENSION)]
+        try:
+            if now - os.stat(path).st_mtime < lease:
+                continue
+            # take the claim over first: of several recovering workers, one succeeds
+            os.rename(path, pending + '.recovering')
+        except OSError:
+            continue
+        with open(os.path.join(queue_dir, job_name + '.recovered'), 'a') as file:
+            file.write('{:.0f}\n'.format(now))
+        with open(os.path.join(queue_dir, job_name + '.recovered')) as file:
+            attempts = len(file.read().split())
+        if attempts >= max_attempts:
+            with open(os.path.join(queue_dir, job_name + '.err'), 'w') as file:
+                file.write('{} workers died building it: see {}.recovered\n'.format(attempts, job_name))
+            os.rename(pending + '.recovering', pending + '.failed')
+        else:
+            os.rename(pending + '.recovering', pending)
+        recovered.append(job_name)
+    return recovered
+
+
+class Heartbeat(object):
+    """
+    Touches a claimed file every :interval: seconds while the design is built, see recover
+    """
+
+    def __init__(self, path, interval=HEARTBEAT):
+        self.path, self.interval = path, interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                os.utime(self.path, None)
+            except OSError:  # recovered by another worker
+                self.lost = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def serve(queue_dir, handle, poll_interval=POLL_INTERVAL, max_designs=None, heartbeat=HEARTBEAT, lease=LEASE):
+    """
+    Processes the intermediate files dropped in the queue directory until a STOP file appears
+    :param handle: callable(content of the intermediate file, job_name) that builds one model, see make_handler
+    :param max_designs: stop after this many designs. Unlimited if None
+    :param heartbeat, lease: see recover
+    :return: number of designs processed
+    """
+    count = 0
+    while max_designs is None or count < max_designs:
+        if os.path.exists(os.path.join(queue_dir, STOP_FILE)):
+            break
+        for job_name in recover(queue_dir, lease):
+            print('{} recovered from a dead worker'.format(job_name))
+        claimed = claim_next(queue_dir)
+        if claimed is None:
+            time.sleep(poll_interval)
+            continue
+        path, job_name = claimed
+        start_time = time.time()
+        with Heartbeat(path, heartbeat) as beat:
+            try:
+                handle(read_interchange(path), job_name)
+            except Exception:
+                with open(os.path.join(queue_dir, job_name + '.err'), 'w') as file:
+                    file.write(traceback.format_exc())
+                status = 'failed'
+            else:
+                status = 'done'
+        if not beat.lost:
+            try:
+                os.rename(path, path[:-len(CLAIM_EXTENSION)] + '.' + status)
+            except OSError:
+                beat.lost = True
+        if beat.lost:  # recovered by another worker, which builds the design again
+            status = 'lost'
+        count += 1
+        print('{} {} in {:.1f} s ({} designs in this session)'.format(job_name, status, time.time() - start_time, count))
+    return count
+
+
+def make_handler(routines, modules, new_mdb, submit, update_mode):
+    """
+    :param routines: namespace with the routine modules
+    :param modules: routine modules, see reset_model
+    :param new_mdb: callable returning a new model database, i.e., abaqus.Mdb
+    :return: handle for serve. With :update_mode:, the model of the previous design is updated instead of rebuilt
+    """
+    last = {'data': None, 'full_build': None}  # model currently in the session and duration of a full build
+
+    def handle(data, job_name):
+        start_time = time.time()
+        previous, last['data'] = last['data'], None  # a failed build leaves the model inconsistent
+        first = first_changed(previous, data) if update_mode and previous is not None else 0
+        if first == 0:
+            reset_model(modules, new_mdb)
+            build(routines, data, job_name, submit, separate=update_mode)
+            last['full_build'] = time.time() - start_time
+        else:
+            update(routines, data, previous, first, job_name, submit)
+            print('{} updated from line {} in {:.1f} s, full build {:.1f} s'.format(
+                job_name, first, time.time() - start_time, last['full_build']))
+        last['data'] = data
+
+    return handle
+
 
 if __name__ == '__main__':
     from src.routines import create_part, cut_face, assemble_parts, create_sets_surfs, assign_property, orient_elements, trivial, mesher
+    import src.routines as routines
+
+    filename, job_name, submit, worker, update_mode = parse_arguments(sys.argv)
+
+    if worker:
+        from abaqus import Mdb
 
-    with open("../resources/intermediate_file.txt", "r") as file:
-        lines = eval(file.read())
-
-    create_part.main()
-    cut_face.main(lines)
-    assemble_parts.main()
-    create_sets_surfs.main(lines)
-    mesher.main()
-    orient_elements.main(lines)
-    assign_property.main()
-    trivial.main()
+        modules = (create_part, cut_face, assemble_parts, create_sets_surfs, assign_property, orient_elements,
+                   trivial, mesher)
+        serve(filename, make_handler(routines, modules, Mdb, submit, update_mode))
+    else:
+        build(routines, read_interchange(filename), job_name, submit)
 
     print(" -- done -- ")
@@ -1,6 +1,71 @@
+import time
+from typing import Dict, List
+
 from model import CurvesBunch
 from view import GUI
 
+import src.thickness as th
+from src.layup_diff import first_difference
+
+# Design constants that can be edited. They are module globals of thickness, imported from design_variables
+EDITABLE_CONSTANTS = ('b', 't_R', 't_P', 'max_y_hoop', 't_hoop')
+
+
 class Controller:
+    """
+    Connects the editor to the thickness routine. Only the layers from the first edited index upward are stacked
+    again; a change of a design constant affects every layer.
+    """
+
     def __init__(self, model: CurvesBunch, view: GUI):
-        pass
\ No newline at end of file
+        self.model = model
+        self.view = view
+        self.angles: List[float] = [curve.winding_angle for curve in model.curves[1:]]
+        self.constants: Dict[str, float] = {name: getattr(th, name) for name in EDITABLE_CONSTANTS}
+
+        view.set_angles(self.angles)
+        view.bind_apply(self.apply)
+
+    def apply(self) -> None:
+        try:
+            angles = [float(angle) for angle in self.view.get_angles_text().replace(',', ' ').split()]
+            constants = {name: float(value) for name, value in self.view.get_constants_text().items()}
+        except ValueError as error:
+            self.view.show_status(f"Invalid input: {error}")
+            return
+
+        start = time.perf_counter()
+        first = self.update(angles, constants)
+        if first is None:
+            return
+        computed = time.perf_counter()
+        self.view.set_layers(self.model, first)
+        self.view.redraw()
+        end = time.perf_counter()
+        self.view.show_status(f"{len(angles) - first} of {len(angles)} layers recalculated\n"
+                              f"compute {1e3 * (computed - start):.1f} ms, draw {1e3 * (end - computed):.1f} ms")
+
+    def update(self, angles: List[float], constants: Dict[str, float]):
+        """
+        :return: index of the first recalculated layer, None if nothing changed
+        """
+        changed_constants = {name: value for name, value in constants.items() if value != self.constants[name]}
+        # the same first changed layer as the CAE update path, see build_model.py
+        first = 0 if changed_constants else first_difference(self.angles, angles)
+        if first is None:
+            return None
+
+        for name, value in changed_constants.items():
+            setattr(th, name, value)
+        self.constants.update(changed_constants)
+
+        self.model = th.recalculate_layup(self.model, angles, first)
+        self.angles = angles
+        return first
+
+
+if __name__ == "__main__":
+    layup = th.main()
+    gui = GUI(layup, {name: getattr(th, name) for name in EDITABLE_CONSTANTS})
+    controller = Controller(layup, gui)
+    gui.mainloop()
@@ -0,0 +1,302 @@
+# coding=utf-8
+"""
+Layered thick-walled cylinder
+Closed-form stresses in the cylindrical section, for screening. Every layer is a cylindrically anisotropic tube, the
+fibers lying in the theta-z plane at the winding angle from the axis. Generalized plane strain with twist:
+    u_r = u(r),  u_theta = gamma r z,  u_z = eps_0 z
+Radial equilibrium gives, per layer (Lekhnitskii),
+    u = A r^k + B r^-k + a eps_0 r + c gamma r^2,    k = sqrt(C_thth / C_rr)
+The constants A, B of every layer and the global eps_0, gamma follow from the internal pressure, the free outer
+surface, the continuity of u and sigma_r at the interfaces, the axial force of the closed ends and zero torque.
+All the designs of a batch are solved at once.
+Run from  root '/' directory
+"""
+from dataclasses import dataclass
+from typing import Sequence, Tuple
+
+import numpy as np
+from numpy import pi
+
+import src.routines.routine_constants as rc
+from model import CurvesBunch
+from src.sublaminates import bond_matrices, stiffness
+
+# Voigt order of the cylindrical stiffness: r, theta, z, theta-z, r-z, r-theta. The rotated ply stiffness is in
+# (axial, hoop, radial, hoop-radial, axial-radial, axial-hoop), this permutation maps one into the other
+CYLINDRICAL = [2, 1, 0, 5, 4, 3]
+COMPONENTS = ('r', 'theta', 'z', 'theta_z')  # non-zero stress and strain components
+DEGENERATE = 1e-6  # k = 1 and k = 2 make the particular solutions singular. Those stiffnesses are perturbed
+
+
+def cylinder_stack(curves: CurvesBunch) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: radii of the interfaces at the cylinder, y = 0, from the liner outwards (layers + 1), and winding angles
+    """
+    radii = np.array([curve.points[-1, 0] for curve in curves.curves])
+    angles = np.array([curve.winding_angle for curve in curves.curves[1:]], dtype=float)
+    return radii, angles
+
+
+def pad_stacks(stacks: Sequence[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Brings stacks with different numbers of layers to the same one, by splitting the outermost layer of the shorter
+    ones in equal parts. The solution does not change.
+    :return: radii (designs, layers + 1) and angles (designs, layers)
+    """
+    n = max(len(angles) for _, angles in stacks)
+    radii = np.empty((len(stacks), n + 1))
+    padded = np.empty((len(stacks), n))
+    for i, (r, angles) in enumerate(stacks):
+        m = len(angles)
+        radii[i, :m] = r[:m]
+        radii[i, m:] = np.linspace(r[m - 1], r[m], n - m + 2)[1:]
+        padded[i, :m] = angles
+        padded[i, m:] = angles[-1]
+    return radii, padded
+
+
+def cylindrical_stiffness(angles: np.ndarray, properties=rc.LAYUP_MATERIAL_PROPS) -> np.ndarray:
+    """
+    :param angles: winding angles in degrees, any shape
+    :return: (..., 6, 6) stiffness in the cylindrical Voigt order
+    """
+    M = bond_matrices(-np.radians(angles))
+    C = M @ stiffness(properties) @ np.swapaxes(M, -1, -2)
+    return C[..., CYLINDRICAL, :][..., CYLINDRICAL]
+
+
+def _power_integral(r_1, r_2, s):
+    """
+    :return: integral of r^(s - 1) from r_1 to r_2
+    """
+    return (r_2 ** s - r_1 ** s) / s
+
+
+@dataclass
+class CylinderSolution:
+    radii: np.ndarray  # (designs, layers + 1)
+    angles: np.ndarray  # (designs, layers)
+    C: np.ndarray  # (designs, layers, 6, 6) cylindrical stiffness
+    k: np.ndarray  # (designs, layers)
+    a: np.ndarray  # particular solution of eps_0
+    c: np.ndarray  # particular solution of gamma
+    A: np.ndarray
+    B: np.ndarray
+    eps_0: np.ndarray  # (designs,) axial strain
+    gamma: np.ndarray  # (designs,) twist per unit length, rad/mm
+
+    def displacement(self, r: np.ndarray) -> np.ndarray:
+        """
+        :param r: (designs, layers, points) radii inside every layer
+        """
+        k, A, B, a, c = (value[..., None] for value in (self.k, self.A, self.B, self.a, self.c))
+        return A * r ** k + B * r ** -k + a * self.eps_0[:, None, None] * r + c * self.gamma[:, None, None] * r ** 2
+
+    def strains(self, r: np.ndarray) -> np.ndarray:
+        """
+        :return: (designs, layers, points, 4) strains eps_r, eps_theta, eps_z, gamma_theta_z
+        """
+        k, A, B, a, c = (value[..., None] for value in (self.k, self.A, self.B, self.a, self.c))
+        eps_0, gamma = self.eps_0[:, None, None], self.gamma[:, None, None]
+        du = k * A * r ** (k - 1) - k * B * r ** (-k - 1) + a * eps_0 + 2 * c * gamma * r
+        u_r = A * r ** (k - 1) + B * r ** (-k - 1) + a * eps_0 + c * gamma * r
+        return np.stack((du, u_r, np.broadcast_to(eps_0, r.shape), gamma * r), axis=-1)
+
+    def stresses(self, r: np.ndarray) -> np.ndarray:
+        """
+        :return: (designs, layers, points, 4) stresses sigma_r, sigma_theta, sigma_z, tau_theta_z
+        """
+        return np.einsum('dnij,dnpj->dnpi', self.C[..., :4, :4], self.strains(r))
+
+    def material_stresses(self, r: np.ndarray) -> np.ndarray:
+        """
+        :return: (designs, layers, points, 6) stresses in the ply axes: fiber, transverse, radial (11, 22, 33, 23, 13, 12)
+        """
+        cylindrical = self.stresses(r)
+        stress = np.zeros(cylindrical.shape[:-1] + (6,))
+        stress[..., :4] = cylindrical
+        M = bond_matrices(np.radians(self.angles))
+        return np.einsum('dnij,dnpj->dnpi', M, stress[..., CYLINDRICAL])
+
+    def profiles(self, points: int = 10) -> np.ndarray:
+        """
+        :return: (designs, layers, points) radii evenly spaced through every layer
+        """
+        t = np.linspace(0., 1., points)
+        return self.radii[..., :-1, None] + (self.radii[..., 1:, None] - self.radii[..., :-1, None]) * t
+
+
+def solve(radii: np.ndarray, angles: np.ndarray, pressure: float = rc.LOAD_MAG, properties=rc.LAYUP_MATERIAL_PROPS,
+          closed_end: bool = True) -> CylinderSolution:
+    """
+    :param radii: (designs, layers + 1) or (layers + 1,) radii of the interfaces. See cylinder_stack and pad_stacks
+    :param angles: (designs, layers) or (layers,) winding angles in degrees
+    :param pressure: internal pressure in MPa
+    :param closed_end: axial force of the pressure on the domes. Open ends otherwise
+    """
+    radii, angles = np.atleast_2d(radii).astype(float), np.atleast_2d(angles).astype(float)
+    d, n = angles.shape
+    C = cylindrical_stiffness(angles, properties)
+    C11, C12, C22 = C[..., 0, 0], C[..., 0, 1], C[..., 1, 1]
+    k = np.sqrt(C22 / C11)
+    for degenerate in (1., 2.):
+        k = np.where(np.abs(k - degenerate) < DEGENERATE, degenerate + DEGENERATE, k)
+    C = C.copy()
+    C[..., 1, 1] = C22 = k ** 2 * C11
+    a = (C[..., 1, 2] - C[..., 0, 2]) / (C11 - C22)
+    c = (C[..., 1, 3] - 2 * C[..., 0, 3]) / (4 * C11 - C22)
+
+    def coefficients(j, r):
+        """
+        Coefficients of A, B, eps_0 and gamma in stress component j at radius r
+        """
+        C1j, C2j, C3j, C4j = (C[..., i, j] for i in range(4))
+        return (C1j * k + C2j) * r ** (k - 1), (C2j - C1j * k) * r ** (-k - 1), (C1j + C2j) * a + C3j, \
+            ((2 * C1j + C2j) * c + C4j) * r
+
+    size = 2 * n + 2
+    K = np.zeros((d, size, size))
+    f = np.zeros((d, size))
+    layers = np.arange(n)
+    A_col, B_col, eps_col, gamma_col = 2 * layers, 2 * layers + 1, 2 * n, 2 * n + 1
+
+    # sigma_r at the inner and outer surfaces
+    r_in, r_out = radii[:, :1], radii[:, 1:]
+    inner = coefficients(0, r_in)
+    for col, value in zip((A_col[0], B_col[0]), inner[:2]):
+        K[:, 0, col] = value[:, 0]
+    K[:, 0, eps_col] += inner[2][:, 0]
+    K[:, 0, gamma_col] += inner[3][:, 0]
+    f[:, 0] = -pressure
+    outer = coefficients(0, r_out)
+    K[:, 1, A_col[-1]], K[:, 1, B_col[-1]] = outer[0][:, -1], outer[1][:, -1]
+    K[:, 1, eps_col], K[:, 1, gamma_col] = outer[2][:, -1], outer[3][:, -1]
+
+    # continuity of u and sigma_r at the interfaces: layer i below minus layer i + 1 above
+    if n > 1:
+        r = radii[:, 1:-1]
+        below, above = layers[:-1], layers[1:]
+        rows_u, rows_s = 2 + 2 * below, 3 + 2 * below
+        kb, ka = k[:, :-1], k[:, 1:]
+        K[:, rows_u, A_col[below]], K[:, rows_u, B_col[below]] = r ** kb, r ** -kb
+        K[:, rows_u, A_col[above]], K[:, rows_u, B_col[above]] = -r ** ka, -r ** -ka
+        K[:, rows_u, eps_col] = (a[:, :-1] - a[:, 1:]) * r
+        K[:, rows_u, gamma_col] = (c[:, :-1] - c[:, 1:]) * r ** 2
+        s_r = coefficients(0, radii[:, 1:])  # at the top of every layer
+        K[:, rows_s, A_col[below]], K[:, rows_s, B_col[below]] = s_r[0][:, :-1], s_r[1][:, :-1]
+        # same radius, coefficients of the layer above
+        C_above = [C[:, 1:, i, 0] for i in range(4)]
+        K[:, rows_s, A_col[above]] = -(C_above[0] * ka + C_above[1]) * r ** (ka - 1)
+        K[:, rows_s, B_col[above]] = -(C_above[1] - C_above[0] * ka) * r ** (-ka - 1)
+        K[:, rows_s, eps_col] = s_r[2][:, :-1] - ((C_above[0] + C_above[1]) * a[:, 1:] + C_above[2])
+        K[:, rows_s, gamma_col] = s_r[3][:, :-1] - ((2 * C_above[0] + C_above[1]) * c[:, 1:] + C_above[3]) * r
+
+    # axial force and torque: integrals of sigma_z 2 pi r dr and tau_theta_z 2 pi r^2 dr over every layer
+    r_1, r_2 = radii[:, :-1], radii[:, 1:]
+    for row, j, extra in ((size - 2, 2, 1), (size - 1, 3, 2)):
+        C1j, C2j, C3j, C4j = (C[..., i, j] for i in range(4))
+        K[:, row, A_col] = 2 * pi * (C1j * k + C2j) * _power_integral(r_1, r_2, k + extra)
+        K[:, row, B_col] = 2 * pi * (C2j - C1j * k) * _power_integral(r_1, r_2, extra - k)
+        K[:, row, eps_col] = np.sum(2 * pi * ((C1j + C2j) * a + C3j) * _power_integral(r_1, r_2, 1 + extra), axis=1)
+        K[:, row, gamma_col] = np.sum(2 * pi * ((2 * C1j + C2j) * c + C4j) * _power_integral(r_1, r_2, 2 + extra),
+                                      axis=1)
+    if closed_end:
+        f[:, size - 2] = pressure * pi * radii[:, 0] ** 2
+
+    x = np.linalg.solve(K, f[..., None])[..., 0]
+    return CylinderSolution(radii, angles, C, k, a, c, x[:, A_col], x[:, B_col], x[:, eps_col], x[:, gamma_col])
+
+
+def solve_layups(bunches: Sequence[CurvesBunch], **kwargs) -> CylinderSolution:
+    """
+    Solves the cylindrical section of many layups at once. See solve
+    """
+    radii, angles = pad_stacks([cylinder_stack(curves) for curves in bunches])
+    return solve(radii, angles, **kwargs)
+
+
+def radial_fe(radii: np.ndarray, angles: np.ndarray, pressure: float = rc.LOAD_MAG,
+              properties=rc.LAYUP_MATERIAL_PROPS, closed_end: bool = True,
+              elements_per_layer: int = 20) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, float, float]:
+    """
+    Finite element reference of the same problem for a single design: quadratic elements along the radius, with the
+    nodal u_r and the global eps_0 and gamma as unknowns
+    :return: radii, u_r, stresses (points, 4) and layer of the nodes of every element, eps_0, gamma
+    """
+    gauss, weights = np.polynomial.legendre.leggauss(3)
+    n_layers = len(angles)
+    n_elements = n_layers * elements_per_layer
+    n_nodes = 2 * n_elements + 1
+    size = n_nodes + 2
+    K = np.zeros((size, size))
+    C = cylindrical_stiffness(np.asarray(angles, dtype=float), properties)[:, :4, :4]
+
+    edges = np.concatenate([np.linspace(radii[i], radii[i + 1], elements_per_layer + 1)[:-1]
+                            for i in range(n_layers)] + [radii[-1:]])
+    layer_of = np.repeat(np.arange(n_layers), elements_per_layer)
+
+    def shape(xi):
+        return np.array([xi * (xi - 1) / 2, 1 - xi ** 2, xi * (xi + 1) / 2]), np.array([xi - 0.5, -2 * xi, xi + 0.5])
+
+    for e in range(n_elements):
+        r_a, r_b = edges[e], edges[e + 1]
+        dofs = np.array([2 * e, 2 * e + 1, 2 * e + 2, n_nodes, n_nodes + 1])
+        jacobian = (r_b - r_a) / 2
+        for xi, w in zip(gauss, weights):
+            N, dN = shape(xi)
+            r = (r_a + r_b) / 2 + xi * jacobian
+            Bm = np.zeros((4, 5))
+            Bm[0, :3], Bm[1, :3] = dN / jacobian, N / r
+            Bm[2, 3], Bm[3, 4] = 1., r
+            K[np.ix_(dofs, dofs)] += Bm.T @ C[layer_of[e]] @ Bm * 2 * pi * r * w * jacobian
+
+    f = np.zeros(size)
+    f[0] = pressure * 2 * pi * radii[0]
+    if closed_end:
+        f[n_nodes] = pressure * pi * radii[0] ** 2
+    x = np.linalg.solve(K, f)
+    u, eps_0, gamma = x[:n_nodes], x[n_nodes], x[n_nodes + 1]
+
+    # stresses at the nodes of every element, from its own shape functions
+    r_nodes, u_nodes, stresses = [], [], []
+    for e in range(n_elements):
+        r_a, r_b = edges[e], edges[e + 1]
+        jacobian = (r_b - r_a) / 2
+        for xi in (-1., 0., 1.):
+            N, dN = shape(xi)
+            r = (r_a + r_b) / 2 + xi * jacobian
+            ue = u[2 * e:2 * e + 3]
+            strain = np.array([dN @ ue / jacobian, N @ ue / r, eps_0, gamma * r])
+            r_nodes.append(r), u_nodes.append(N @ ue), stresses.append(C[layer_of[e]] @ strain)
+    return np.array(r_nodes), np.array(u_nodes), np.array(stresses), np.repeat(layer_of, 3), eps_0, gamma
+
+
+if __name__ == "__main__":
+    import time
+    from src.thickness import main as calculate_layup
+
+    layup = calculate_layup()
+    radii, angles = cylinder_stack(layup)
+
+    # validation against the finite element reference
+    solution = solve(radii, angles)
+    r_fe, u_fe, stress_fe, layer, eps_0_fe, gamma_fe = radial_fe(radii, angles)
+    # evaluate the closed form at the FE nodes, in the layer of their element
+    r_eval = np.broadcast_to(r_fe, (1, len(angles), len(r_fe)))
+    closed_form = solution.stresses(r_eval)[0, layer, np.arange(len(r_fe))]
+    scale = np.abs(stress_fe).max(axis=0)
+    print("max difference to FE, relative to the peak of each component: " + ", ".join(
+        f"{name} {100 * error:.3f} %" for name, error in zip(COMPONENTS, np.abs(closed_form - stress_fe).max(axis=0)
+                                                             / scale)))
+    print(f"eps_0 {solution.eps_0[0]:.6e} (FE {eps_0_fe:.6e}), gamma {solution.gamma[0]:.3e} (FE {gamma_fe:.3e})")
+
+    # throughput
+    n = 10000
+    rng = np.random.default_rng(0)
+    batch_radii = radii + np.cumsum(np.insert(rng.normal(0., 0.01, (n, len(angles))), 0, 0., axis=1), axis=1)
+    start = time.perf_counter()
+    batch = solve(batch_radii, np.repeat(angles[None], n, axis=0))
+    profile = batch.material_stresses(batch.profiles())
+    elapsed = time.perf_counter() - start
+    print(f"{n} designs of {len(angles)} layers in {1e3 * elapsed:.0f} ms ({1e6 * elapsed / n:.0f} us per design)")
+    print(f"peak fiber stress of the first design: {profile[0, ..., 0].max():.0f} MPa")
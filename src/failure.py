@@ -0,0 +1,288 @@
+# coding=utf-8
+"""
+Failure indices of the plies
+Maximum stress, Tsai-Wu, Hashin and Puck on stresses in the material frame, see src/frames.py, for all the elements at
+once. Every criterion gives a reserve factor: the factor on the load at which the criterion reaches 1. Under linear
+elasticity the stresses scale with the pressure, hence the pressure at which a ply fails is LOAD_MAG times its reserve
+factor, without solving again. The failure index is the inverse of the reserve factor.
+Criteria that are not homogeneous in the stresses, Tsai-Wu and the matrix compression mode of Hashin, are solved for the
+factor: q f^2 + l f = 1 for their quadratic and linear parts q and l.
+Puck is evaluated for plane stress, on sigma_2 and tau_21, with the closed-form modes A, B and C of VDI 2014.
+Run from  root '/' directory
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import src.routines.routine_constants as rc
+from src.frames import ABAQUS, CHUNK
+
+CRITERIA = ('max_stress', 'tsai_wu', 'hashin', 'puck')
+# Failure modes of every criterion, by index. Fiber failure modes come first
+MODES = {
+    'max_stress': ('fiber tension', 'fiber compression', 'transverse tension', 'transverse compression',
+                   'normal tension', 'normal compression', 'shear 12', 'shear 13', 'shear 23'),
+    'tsai_wu': ('interactive',),
+    'hashin': ('fiber tension', 'fiber compression', 'matrix tension', 'matrix compression'),
+    'puck': ('fiber tension', 'fiber compression', 'inter fiber A', 'inter fiber B', 'inter fiber C'),
+}
+NO_FAILURE = np.inf  # reserve factor of unloaded points
+
+
+@dataclass
+class Strengths:
+    x_t: float
+    x_c: float
+    y_t: float
+    y_c: float
+    s_12: float
+    s_23: float
+    p_tension: float = rc.LAYUP_PUCK_INCLINATIONS[0]
+    p_compression: float = rc.LAYUP_PUCK_INCLINATIONS[1]
+    interaction: float = rc.LAYUP_TSAI_WU_INTERACTION
+
+    @classmethod
+    def from_constants(cls, strengths=rc.LAYUP_STRENGTHS) -> "Strengths":
+        return cls(*strengths)
+
+
+def _components(stresses: np.ndarray, components: Tuple[Tuple[int, int], ...]) -> Tuple[np.ndarray, ...]:
+    """
+    :return: s_1, s_2, s_3, t_12, t_13, t_23 of (N, 6) stresses in the order :components:
+    """
+    order = [components.index(pair) for pair in ABAQUS]
+    return tuple(stresses[:, k] for k in order)
+
+
+def _factor(quadratic: np.ndarray, linear: np.ndarray) -> np.ndarray:
+    """
+    :return: positive root f of quadratic f^2 + linear f = 1
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 2 / (l + sqrt(l^2 + 4 q)) avoids the cancellation of (-l + sqrt(l^2 + 4 q)) / (2 q) for small q
+        factor = 2. / (linear + np.sqrt(linear ** 2 + 4. * quadratic))
+    return np.where(factor > 0., factor, NO_FAILURE)
+
+
+def _pair(stress: np.ndarray, tension: float, compression: float, mode: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: failure index of a stress against its tension and compression strengths, and the mode: :mode: in tension,
+    :mode: + 1 in compression
+    """
+    return np.maximum(stress / tension, stress / -compression), mode + (stress < 0.)
+
+
+def _select(indices: List[Tuple[np.ndarray, object]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param indices: failure index of every mode, with the mode: an integer, or an array of them, see _pair
+    :return: reserve factor and governing mode
+    """
+    index, mode = indices[0][0], np.broadcast_to(indices[0][1], len(indices[0][0])).astype(int)
+    for candidate, candidate_mode in indices[1:]:
+        larger = candidate > index
+        index = np.where(larger, candidate, index)
+        mode = np.where(larger, candidate_mode, mode)
+    with np.errstate(divide='ignore'):
+        return np.where(index > 0., 1. / index, NO_FAILURE), mode
+
+
+def max_stress(s_1, s_2, s_3, t_12, t_13, t_23, m: Strengths) -> Tuple[np.ndarray, np.ndarray]:
+    indices = [_pair(s_1, m.x_t, m.x_c, 0), _pair(s_2, m.y_t, m.y_c, 2), _pair(s_3, m.y_t, m.y_c, 4),
+               (np.abs(t_12) / m.s_12, 6), (np.abs(t_13) / m.s_12, 7), (np.abs(t_23) / m.s_23, 8)]
+    return _select(indices)
+
+
+def tsai_wu(s_1, s_2, s_3, t_12, t_13, t_23, m: Strengths) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Transversely isotropic, F_23 = F_22 - F_44 / 2
+    """
+    f_1, f_2 = 1. / m.x_t - 1. / m.x_c, 1. / m.y_t - 1. / m.y_c
+    f_11, f_22, f_44, f_66 = 1. / (m.x_t * m.x_c), 1. / (m.y_t * m.y_c), 1. / m.s_23 ** 2, 1. / m.s_12 ** 2
+    f_12, f_23 = m.interaction * np.sqrt(f_11 * f_22), f_22 - f_44 / 2.
+    quadratic = (f_11 * s_1 ** 2 + f_22 * (s_2 ** 2 + s_3 ** 2) + 2. * f_12 * s_1 * (s_2 + s_3)
+                 + 2. * f_23 * s_2 * s_3 + f_44 * t_23 ** 2 + f_66 * (t_12 ** 2 + t_13 ** 2))
+    linear = f_1 * s_1 + f_2 * (s_2 + s_3)
+    return _factor(quadratic, linear), np.zeros(len(s_1), dtype=int)
+
+
+def hashin(s_1, s_2, s_3, t_12, t_13, t_23, m: Strengths) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hashin (1980), three-dimensional
+    """
+    shear = (t_12 ** 2 + t_13 ** 2) / m.s_12 ** 2
+    transverse = s_2 + s_3
+    matrix = (t_23 ** 2 - s_2 * s_3) / m.s_23 ** 2 + shear
+    tension = transverse >= 0.
+    fiber = fiber_hashin(s_1, s_2, s_3, t_12, t_13, t_23, m)
+    matrix = np.where(tension, _factor((transverse / m.y_t) ** 2 + matrix, 0.),
+                      _factor(transverse ** 2 / (4. * m.s_23 ** 2) + matrix,
+                              ((m.y_c / (2. * m.s_23)) ** 2 - 1.) * transverse / m.y_c))
+    matrix_governs = matrix < fiber
+    return (np.where(matrix_governs, matrix, fiber),
+            np.where(matrix_governs, np.where(tension, 2, 3), (s_1 < 0.).astype(int)))
+
+
+def puck(s_1, s_2, s_3, t_12, t_13, t_23, m: Strengths) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Puck for plane stress: fiber fracture by maximum stress, inter fiber fracture in modes A, B and C
+    """
+    r_a = m.s_12 / (2. * m.p_compression) * (np.sqrt(1. + 2. * m.p_compression * m.y_c / m.s_12) - 1.)
+    p_perp = m.p_compression * r_a / m.s_12
+    t_c = m.s_12 * np.sqrt(1. + 2. * p_perp)
+    tau = np.abs(t_12)
+
+    mode_a = np.sqrt((tau / m.s_12) ** 2 + ((1. - m.p_tension * m.y_t / m.s_12) * s_2 / m.y_t) ** 2) \
+        + m.p_tension * s_2 / m.s_12
+    mode_b = (np.sqrt(tau ** 2 + (m.p_compression * s_2) ** 2) + m.p_compression * s_2) / m.s_12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mode_c = ((tau / (2. * (1. + p_perp) * m.s_12)) ** 2 + (s_2 / m.y_c) ** 2) * m.y_c / -s_2
+        in_b = np.abs(s_2) <= r_a * tau / t_c  # |s_2 / t_21| <= R_A / |t_21c|
+    inter_fiber = np.where(s_2 >= 0., mode_a, np.where(in_b, mode_b, mode_c))
+    inter_fiber_mode = np.where(s_2 >= 0., 2, np.where(in_b, 3, 4))
+    return _select([_pair(s_1, m.x_t, m.x_c, 0), (inter_fiber, inter_fiber_mode)])
+
+
+def fiber_max_stress(s_1, s_2, s_3, t_12, t_13, t_23, m: Strengths) -> np.ndarray:
+    """
+    :return: reserve factor of the fibers, by maximum stress. Fiber fracture of Puck as well
+    """
+    return _select([_pair(s_1, m.x_t, m.x_c, 0)])[0]
+
+
+def fiber_hashin(s_1, s_2, s_3, t_12, t_13, t_23, m: Strengths) -> np.ndarray:
+    """
+    :return: reserve factor of the fiber modes of Hashin, fiber tension interacting with the shear
+    """
+    shear = (t_12 ** 2 + t_13 ** 2) / m.s_12 ** 2
+    with np.errstate(divide='ignore'):
+        return np.where(s_1 >= 0., _factor((s_1 / m.x_t) ** 2 + shear, 0.), -m.x_c / s_1)
+
+
+FUNCTIONS = {'max_stress': max_stress, 'tsai_wu': tsai_wu, 'hashin': hashin, 'puck': puck}
+FIBER_FUNCTIONS = {'max_stress': fiber_max_stress, 'hashin': fiber_hashin, 'puck': fiber_max_stress}
+
+
+def group_minimum(values: np.ndarray, groups: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param groups: (N,) label of every value, e.g. layer number or winding angle
+    :return: labels and index of the minimum value of each label
+    """
+    labels, inverse = np.unique(groups, return_inverse=True)
+    minima = np.full(len(labels), np.inf)
+    np.minimum.at(minima, inverse, values)
+    candidates = np.flatnonzero(values == minima[inverse])
+    _, first = np.unique(inverse[candidates], return_index=True)  # first element of each label at its minimum
+    return labels, candidates[first]
+
+
+@dataclass
+class Critical:
+    group: object  # layer number, winding angle... None for the whole model
+    element: int
+    reserve_factor: float
+    mode: str
+    pressure: float  # at which the element fails, MPa
+
+    def __str__(self) -> str:
+        group = "" if self.group is None else f"{self.group}: "
+        return (f"{group}element {self.element}, reserve factor {self.reserve_factor:.3f} ({self.mode}), "
+                f"{self.pressure:.1f} MPa")
+
+
+@dataclass
+class FailureResult:
+    reserve_factors: Dict[str, np.ndarray]  # criterion -> (N,)
+    modes: Dict[str, np.ndarray]  # criterion -> (N,) index into MODES[criterion]
+    pressure: float = rc.LOAD_MAG  # of the stresses
+    # criterion -> (N,) reserve factor of the fiber modes alone. Criteria that have them
+    fiber_reserve_factors: Dict[str, np.ndarray] = field(default_factory=dict)
+
+    def failure_indices(self, criterion: str) -> np.ndarray:
+        with np.errstate(divide='ignore'):
+            return 1. / self.reserve_factors[criterion]
+
+    def critical(self, criterion: str, groups: Optional[np.ndarray] = None) -> List[Critical]:
+        """
+        :param groups: (N,) label of every element, e.g. its layer or winding angle. The whole model if None
+        :return: the lowest reserve factor, per group if given
+        """
+        factors, modes = self.reserve_factors[criterion], self.modes[criterion]
+        if groups is None:
+            labels, elements = [None], [int(factors.argmin())]
+        else:
+            labels, elements = group_minimum(factors, groups)
+        return [Critical(label if label is None else label.item(), int(element), float(factors[element]),
+                         MODES[criterion][modes[element]], self.pressure * float(factors[element]))
+                for label, element in zip(labels, elements)]
+
+    def first_ply_failure(self, criterion: str) -> float:
+        """ pressure at which the first element fails in any mode """
+        return self.pressure * float(self.reserve_factors[criterion].min())
+
+    def burst_pressure(self, criterion: str = 'puck') -> float:
+        """
+        Pressure at which the fibers of the first element fail, recomputed from the fiber modes only: the matrix may
+        crack before without burst
+        """
+        if criterion not in self.fiber_reserve_factors:
+            raise ValueError(f"{criterion} has no fiber failure mode")
+        return self.pressure * float(self.fiber_reserve_factors[criterion].min())
+
+
+def evaluate(stresses: np.ndarray, criteria=CRITERIA, strengths: Optional[Strengths] = None,
+             components: Tuple[Tuple[int, int], ...] = ABAQUS, pressure: float = rc.LOAD_MAG) -> FailureResult:
+    """
+    :param stresses: (N, 6) stresses in the material frame, 1: fiber, 2: transverse, 3: normal
+    :param components: order of the components of :stresses:, ABAQUS as in src/frames.py
+    :param pressure: pressure of the stresses
+    """
+    strengths = Strengths.from_constants() if strengths is None else strengths
+    stresses = np.asarray(stresses, dtype=float)
+    n = len(stresses)
+    result = FailureResult({criterion: np.empty(n) for criterion in criteria},
+                           {criterion: np.empty(n, dtype=int) for criterion in criteria}, pressure,
+                           {criterion: np.empty(n) for criterion in criteria if criterion in FIBER_FUNCTIONS})
+    # in chunks: the temporary arrays of the criteria stay in the cache
+    for start in range(0, n, CHUNK):
+        rows = slice(start, min(start + CHUNK, n))
+        s = _components(stresses[rows], components)
+        for criterion in criteria:
+            result.reserve_factors[criterion][rows], result.modes[criterion][rows] = \
+                FUNCTIONS[criterion](*s, strengths)
+            if criterion in FIBER_FUNCTIONS:
+                result.fiber_reserve_factors[criterion][rows] = FIBER_FUNCTIONS[criterion](*s, strengths)
+    return result
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from src.axisymmetric import solve_layup
+    from src.sublaminates import VOIGT
+    from src.thickness import main as calculate_layup
+
+    # python ./src/failure.py [million elements]
+    layup = calculate_layup()
+    solution = solve_layup(layup)
+    result = evaluate(solution.material_stresses(), components=VOIGT)
+    layers = solution.mesh.layers
+    winding = np.array([curve.winding_angle for curve in layup.curves[1:]])[layers - 1]
+    for criterion in CRITERIA:
+        print(f"{criterion}: first ply failure at {result.first_ply_failure(criterion):.1f} MPa, "
+              + (f"fiber failure at {result.burst_pressure(criterion):.1f} MPa. "
+                 if criterion in FIBER_FUNCTIONS else "")
+              + f"critical {result.critical(criterion)[0]}")
+    print("lowest reserve factor of Puck per winding angle:")
+    for critical in result.critical('puck', winding):
+        print(f"    {critical}")
+
+    n = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else 2_000_000
+    stresses = np.random.default_rng(0).normal(0., 300., (n, 6))
+    start = time.perf_counter()
+    result = evaluate(stresses)
+    evaluated = time.perf_counter()
+    result.critical('puck', np.arange(n) % 40)
+    end = time.perf_counter()
+    print(f"{n / 1e6:.0f} million elements: 4 criteria in {evaluated - start:.2f} s, "
+          f"critical element of 40 layers in {end - evaluated:.2f} s")
@@ -0,0 +1,436 @@
+# coding=utf-8
+"""
+Flat CAE build scripts
+build_model.py runs the routines inside CAE, where the embedded interpreter locates the faces of the layers and the
+edges of the surfaces from landmarks at runtime, and computes the orientation of every element one by one.
+Everything that only depends on the curves is computed here instead, with NumPy:
+    - the points of the splines and the straight segments of every partition line
+    - one pick point inside every layer, for its set, checked with layers.LayerClassifier
+    - one pick point on every edge of the pressure surface and of the symmetry BC, between the vertices where the
+      lines meet the liner and the bottom
+    - per layer, the tangent angle of the line against the height and the Clairaut constant of the winding angle
+The generated script replays the calls of the routines with these values as literals, in a single straight sequence.
+Only the orientation needs the mesh: the elements of every layer set are oriented at once from the tables.
+The script times its stages and writes them next to the job, see read_timings.
+Run from  root '/' directory
+"""
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import src.routines.routine_constants as rc
+from src.geometry import tangent_angles, tangents
+from src.layers import LayerClassifier, curves_from_abaqus_format
+from src.routines.routine_geometry import part_outline, pressure_end_point
+
+JOB_NAME = 'Job-1'
+EXCESS_MATERIAL_POINT = (0.1, 0.1, 0.0)  # inside the liner, see cut_face.remove_excess_material
+FAULTY_FACE_SIZE = 10  # faces smaller than this are removed, see cut_face.remove_faulty_faces
+CLAIRAUT_RADIUS = 160.  # mm, radius of the winding angle of every layer, as in orient_elements.get_alpha
+TIMINGS_EXTENSION = '.cae_times.json'
+POINTS_PER_LINE = 4  # per line of the literals of the script
+VALUES_PER_LINE = 6
+
+type Point = Tuple[float, float]
+
+
+@dataclass
+class BuildData:
+    lines: List[np.ndarray]  # points of every partition line, the liner first
+    outline: List[Point]  # of the part, see create_part.main
+    layer_points: List[Point]  # inside every layer, from layer 1 on
+    pressure_points: List[Point]  # on the edges of the liner below routine_geometry.pressure_end_point, exactly
+    pressure_closest: List[Point]  # near the edges of the liner without a point of its spline in between
+    symmetry_points: List[Point]  # on the edges of the layup at y = 0
+    heights: List[np.ndarray]  # per layer, midpoints between the sorted heights of its line
+    gammas: List[np.ndarray]  # per layer, tangent angle of its line at the sorted heights, in radians
+    clairaut: np.ndarray  # per layer, CLAIRAUT_RADIUS sin(alpha_0)
+
+
+def _pressure_points(liner: np.ndarray, lines: List[np.ndarray]) -> Tuple[List[Point], List[Point]]:
+    """
+    The liner is split where the other lines start on it and where its spline ends in a straight segment
+    """
+    end_point = pressure_end_point(lines)
+    vertices = {0, len(liner) - 2, len(liner) - 1}
+    for line in lines[1:]:
+        matches = np.flatnonzero((liner == line[0]).all(axis=1))
+        vertices.update(matches[:1].tolist())
+    vertices = sorted(vertices)
+    exact, closest = [], []
+    for i, j in zip(vertices[:-1], vertices[1:]):
+        # a point of the spline between the vertices is on the edge. So is the middle of the straight segment, not
+        # that of a piece of spline
+        point = liner[(i + j) // 2] if j - i > 1 else (liner[i] + liner[j]) / 2
+        if point[1] < end_point:
+            (exact if j - i > 1 or i == len(liner) - 2 else closest).append(point)
+    return [tuple(point.tolist()) for point in exact], [tuple(point.tolist()) for point in closest]
+
+
+def build_data(lines: Sequence, angles: Sequence[float]) -> BuildData:
+    """
+    :param lines: curves in the abaqus format, see CurvesBunch.to_abaqus_format
+    :param angles: winding angle of every layer, in degrees
+    """
+    lines = [np.asarray(line, dtype=float) for line in lines]
+    if len(angles) != len(lines) - 1:
+        raise ValueError(f"{len(lines) - 1} layers and {len(angles)} winding angles")
+
+    # sets: halfway between the bottoms of the lines of every layer
+    bottoms = np.array([line[-1, 0] for line in lines])
+    layer_points = np.column_stack(((bottoms[:-1] + bottoms[1:]) / 2, np.full(len(lines) - 1, rc.TOL)))
+    classified = LayerClassifier(curves_from_abaqus_format(lines)).classify(layer_points)
+    if (wrong := np.flatnonzero(classified != np.arange(1, len(lines)))).size:
+        raise ValueError(f"the pick points of the layers {', '.join(str(k + 1) for k in wrong)} are outside them. "
+                         f"Layers must be thicker than {2 * rc.TOL} mm at the bottom")
+
+    # symmetry BC: the bottom of the part is split by the lines, from the liner to the outline
+    outline = part_outline(lines)
+    edges = np.unique(np.append(bottoms[bottoms >= bottoms[0]], max(x for x, _ in outline)))
+    symmetry_points = [(float(x), 0.) for x in (edges[:-1] + edges[1:]) / 2]
+
+    heights, gammas = [], []
+    for line in lines[1:]:
+        order = np.argsort(line[:, 1], kind='stable')
+        y = line[order, 1]
+        heights.append((y[:-1] + y[1:]) / 2)
+        gammas.append(tangent_angles(tangents(line))[order])
+    clairaut = CLAIRAUT_RADIUS * np.sin(np.radians(np.asarray(angles, dtype=float)))
+
+    return BuildData(lines, outline, [tuple(point) for point in layer_points.tolist()],
+                     *_pressure_points(lines[0], lines), symmetry_points, heights, gammas, clairaut)
+
+
+# ----- Script -----
+
+def _literal(value) -> str:
+    """ literal of numbers, strings, arrays and nested sequences, as read by Python 2 and 3 """
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        items = [_literal(item) for item in value]
+        return f"({items[0]}, )" if len(items) == 1 else f"({', '.join(items)})"
+    if isinstance(value, (bool, str)) or value is None:
+        return repr(value)
+    if isinstance(value, (int, np.integer)):
+        return repr(int(value))
+    return repr(float(value))
+
+
+def _wrapped(values, indent: str, per_line: int) -> str:
+    """ tuple literal of :values:, :per_line: items per line """
+    items = [_literal(value) for value in np.asarray(values, dtype=float).tolist()]
+    rows = [', '.join(items[i:i + per_line]) for i in range(0, len(items), per_line)]
+    return '(' + (',\n' + indent + ' ').join(rows) + (', )' if len(items) == 1 else ')')
+
+
+def _picks(points) -> str:
+    """ arguments of findAt for a list of points """
+    return ', '.join(f"(({x!r}, {y!r}, 0.0), )" for x, y in points)
+
+
+_HEADER = '''# Build script of {job_name}, generated by src/flat_build.py. Replays the calls of the CAE routines, see
+# build_model.py, with the values computed on the host. Run from /temp: abaqus cae noGUI={script}
+import json
+import time
+
+import numpy as np
+from abaqus import *
+from abaqusConstants import *
+import mesh
+
+times = [('start', time.time())]
+
+
+def mark(stage):
+    times.append((stage, time.time()))
+
+
+def bases(elements, coordinates, heights, gammas, clairaut):
+    """
+    :return: labels and g_1, g_2 of the elements of a layer, as orient_elements.get_basis, for all of them at once
+    """
+    labels = np.array([element.label for element in elements], dtype=int)
+    if not len(labels):
+        return labels, np.empty((0, 6))
+    connectivity = [element.connectivity for element in elements]
+    counts = np.array([len(nodes) for nodes in connectivity])
+    nodes = np.fromiter((node for row in connectivity for node in row), dtype=int, count=int(counts.sum()))
+    centroids = np.add.reduceat(coordinates[nodes], np.cumsum(counts) - counts, axis=0) / counts[:, None]
+    gamma = np.asarray(gammas)[np.searchsorted(np.asarray(heights), centroids[:, 1])]
+    alpha = np.arcsin(np.clip(clairaut / centroids[:, 0], -1., 1.)) + np.pi / 2
+    sa, ca, sg, cg = np.sin(alpha), np.cos(alpha), np.sin(gamma), np.cos(gamma)
+    return labels, np.column_stack((sg * sa, cg * sa, ca, -sg * ca, -cg * ca, sa))
+
+'''
+
+
+def _create_part(data: BuildData) -> List[str]:
+    code = ["# ----- create_part -----",
+            f"model = mdb.Model(name={rc.MODEL!r}, modelType=STANDARD_EXPLICIT)",
+            "s = model.ConstrainedSketch(name='__profile__', sheetSize=10)",
+            "s.ConstructionLine(point1=(0.0, -100.0), point2=(0.0, 100.0))"]
+    code += [f"s.Line(point1={a!r}, point2={b!r})" for a, b in zip(data.outline[:-1], data.outline[1:])]
+    code += [f"p = model.Part(name={rc.LAYUP_PART!r}, dimensionality=AXISYMMETRIC, type=DEFORMABLE_BODY, twist=ON)",
+             "p.BaseShell(sketch=s)",
+             "s.unsetPrimaryObject()",
+             "del model.sketches['__profile__']",
+             f"p.Set(faces=p.faces, name={rc.LAYUP_SET!r})"]
+    if rc.LINER_TOGGLE:
+        code += [f"acis = mdb.openAcis({rc.LINER_PATH!r}, scaleFromFile=OFF)",
+                 f"model.PartFromGeometryFile(name={rc.LINER_PART!r}, geometryFile=acis, combine=False, "
+                 f"dimensionality=AXISYMMETRIC, type=DEFORMABLE_BODY, twist=ON)",
+                 f"liner = model.parts[{rc.LINER_PART!r}]",
+                 f"liner.Set(faces=liner.faces, name={rc.LINER_SET!r})"]
+    return code + ["mark('create_part')"]
+
+
+def _cut_face(data: BuildData) -> List[str]:
+    code = ["# ----- cut_face -----",
+            "s = model.ConstrainedSketch(name='cutting_sketch', sheetSize=1000)",
+            "s.setPrimaryObject(option=SUPERIMPOSE)",
+            "p.projectReferencesOntoSketch(sketch=s, filter=COPLANAR_EDGES)"]
+    for line in data.lines:
+        # spline up to the second-to-last point, straight below from there
+        code += [f"s.Spline(points={_wrapped(line[:-1], ' ' * 16, POINTS_PER_LINE)}, constrainPoints=False)",
+                 f"s.Line(point1={_literal(line[-2])}, point2={_literal(line[-1])})"]
+    code += ["p.PartitionFaceBySketch(faces=p.faces, sketch=s)",
+             "s.unsetPrimaryObject()",
+             f"p.RemoveFaces(faceList=(p.faces.findAt(coordinates={EXCESS_MATERIAL_POINT!r}), ), deleteCells=False)",
+             # sizes of the faces are only known to CAE
+             f"faulty = [face for face in p.faces if face.getSize() < {FAULTY_FACE_SIZE!r}]",
+             "if faulty:",
+             "    p.RemoveFaces(faceList=faulty, deleteCells=False)",
+             f"print('{len(data.lines)} partition lines, {{}} faulty faces removed'.format(len(faulty)))",
+             "mark('cut_face')"]
+    return code
+
+
+def _assemble_parts() -> List[str]:
+    code = ["# ----- assemble_parts -----",
+            "a = model.rootAssembly",
+            "a.DatumCsysByThreePoints(coordSysType=CYLINDRICAL, origin=(0.0, 0.0, 0.0), point1=(1.0, 0.0, 0.0), "
+            "point2=(0.0, 0.0, -1.0))",
+            f"a.Instance(name={rc.LAYUP_INSTANCE!r}, part=p, dependent=ON)"]
+    if rc.LINER_TOGGLE:
+        code += [f"a.Instance(name={rc.LINER_INSTANCE!r}, part=liner, dependent=ON)"]
+    return code + ["mark('assemble_parts')"]
+
+
+def _liner_edges(variable: str, edges: str, point: Tuple[float, ...], direction: float) -> str:
+    # the liner comes from a CAD file: its edges are only known to CAE, and are found as in create_sets_surfs.py
+    offset = rc.TOL * np.array([np.cos(np.radians(direction)), np.sin(np.radians(direction))])
+    location = tuple(np.round(np.asarray(point[:2]) + offset, 9).tolist()) + (0., )
+    return f"{variable} = {edges}.findAt({_literal(location)}).getEdgesByEdgeAngle({rc.GET_EDGES_BY_ANGLE!r})"
+
+
+def _create_sets_surfs(data: BuildData) -> List[str]:
+    code = ["# ----- create_sets_surfs -----"]
+    code += [f"p.Set(faces=(p.faces.findAt((({x!r}, {y!r}, 0.0), (0.0, 0.0, 1.0))), ), "
+             f"name={rc.LAYER_SET + str(index)!r})" for index, (x, y) in enumerate(data.layer_points, start=1)]
+    code += [f"edges = p.edges.findAt({_picks(data.pressure_points)})"]
+    for x, y in data.pressure_closest:
+        code += [f"edge = p.edges.getClosest(coordinates=(({x!r}, {y!r}, 0.0), ))[0][0]",
+                 "edges += p.edges[edge.index:edge.index + 1]"]
+    code += [f"p.Surface(side1Edges=edges, name={rc.LAYUP_INTERACTION_SURF!r})"]
+    if rc.LINER_TOGGLE:
+        code += [_liner_edges('edges', 'liner.edges', rc.ROOT_POINT, 90),
+                 f"liner.Surface(side1Edges=edges, name={rc.LINER_INTERACTION_SURF!r})",
+                 _liner_edges('edges', 'liner.edges', rc.LINER_ROOT_POINT, 90),
+                 f"liner.Surface(side1Edges=edges, name={rc.LOAD_SURF!r})"]
+    code += [f"edges = a.instances[{rc.LAYUP_INSTANCE!r}].edges.findAt({_picks(data.symmetry_points)})"]
+    if rc.LINER_TOGGLE:
+        code += [_liner_edges('liner_edges', f"a.instances[{rc.LINER_INSTANCE!r}].edges", rc.ROOT_POINT, 180),
+                 "edges += liner_edges"]
+    return code + [f"a.Set(edges=edges, name={rc.SYM_BC_SET!r})", "mark('create_sets_surfs')"]
+
+
+def _mesher() -> List[str]:
+    code = ["# ----- mesher -----",
+            "element_types = (mesh.ElemType(elemCode=CGAX8R, elemLibrary=STANDARD), "
+            "mesh.ElemType(elemCode=CGAX6, elemLibrary=STANDARD))"]
+    parts = [('p', rc.LAYUP_SET, rc.LAYUP_MESH_SIZE)]
+    if rc.LINER_TOGGLE:
+        parts += [('liner', rc.LINER_SET, rc.LINER_MESH_SIZE)]
+    for part, region, size in parts:
+        code += [f"{part}.setElementType(regions={part}.sets[{region!r}], elemTypes=element_types)",
+                 f"{part}.setMeshControls(regions={part}.faces, technique=FREE)",
+                 f"{part}.seedPart(size={size!r}, deviationFactor=0.1, minSizeFactor=0.1)",
+                 f"{part}.generateMesh()"]
+    return code + ["print('Layup mesh: {} elements'.format(len(p.elements)))", "mark('mesher')"]
+
+
+def _orient_elements(data: BuildData) -> List[str]:
+    code = ["# ----- orient_elements -----",
+            "coordinates = np.array([node.coordinates[:2] for node in p.nodes])",
+            "oriented = []"]
+    for index, (heights, gammas, clairaut) in enumerate(zip(data.heights, data.gammas, data.clairaut), start=1):
+        indent = ' ' * 22
+        code += [f"oriented.append(bases(p.sets[{rc.LAYER_SET + str(index)!r}].elements, coordinates,\n"
+                 f"{indent}{_wrapped(heights, indent, VALUES_PER_LINE)},\n"
+                 f"{indent}{_wrapped(gammas, indent, VALUES_PER_LINE)},\n"
+                 f"{indent}{float(clairaut)!r}))"]
+    code += ["labels = np.concatenate([layer[0] for layer in oriented])",
+             "orientation = np.concatenate([layer[1] for layer in oriented])",
+             f"model.DiscreteField(name={rc.ORIENTATION!r}, description='', location=ELEMENTS, fieldType=ORIENTATION, "
+             "dataWidth=6, defaultValues=(1.0, 0.0, 0.0, 0.0, 1.0, 0.0),",
+             "                    data=(('', 6, tuple(labels.tolist()), tuple(orientation.ravel().tolist())), ),",
+             "                    orientationType=CARTESIAN, partLevelOrientation=True)",
+             "print('{} of {} elements oriented'.format(len(labels), len(p.elements)))",
+             "mark('orient_elements')"]
+    return code
+
+
+def _section(name: str, material: str, properties, region: str) -> List[str]:
+    return [f"model.Material(name={material!r})",
+            f"model.materials[{material!r}].Elastic(type=ENGINEERING_CONSTANTS, table=({_literal(properties)}, ))",
+            f"model.materials[{material!r}].Density(table=(({rc.LAYUP_DENSITY!r}, ), ))",
+            f"model.HomogeneousSolidSection(name={name!r}, material={material!r}, thickness=None)",
+            f"p.SectionAssignment(region=p.sets[{region!r}], sectionName={name!r}, offset=0.0, "
+            f"offsetType=MIDDLE_SURFACE, offsetField='', thicknessAssignment=FROM_SECTION)"]
+
+
+def _assign_property(materials: Optional[Sequence]) -> List[str]:
+    code = ["# ----- assign_property -----"]
+    if materials is None:
+        code += _section(rc.LAYUP_SECTION, rc.LAYUP_MATERIAL, rc.LAYUP_MATERIAL_PROPS, rc.LAYUP_SET)
+    else:
+        for index, properties in enumerate(materials, start=1):
+            code += _section(f"{rc.LAYUP_SECTION}_{index}", f"{rc.LAYUP_MATERIAL}_{index}", properties,
+                             rc.LAYER_SET + str(index))
+    code += [f"p.MaterialOrientation(region=p.sets[{rc.LAYUP_SET!r}], orientationType=FIELD, axis=AXIS_3, "
+             f"fieldName={rc.ORIENTATION!r}, localCsys=None,",
+             "                      additionalRotationType=ROTATION_NONE, angle=0.0, additionalRotationField='', "
+             "stackDirection=STACK_3)",
+             "print('Layup mass: {} t'.format(p.getMassProperties()['mass']))"]
+    if rc.LINER_TOGGLE:
+        code += [f"model.Material(name={rc.LINER_MATERIAL!r})",
+                 f"model.materials[{rc.LINER_MATERIAL!r}].Elastic(table=({_literal(rc.LINER_MATERIAL_PROPS)}, ))",
+                 f"model.HomogeneousSolidSection(name={rc.LINER_SECTION!r}, material={rc.LINER_MATERIAL!r}, "
+                 f"thickness=None)",
+                 f"liner.SectionAssignment(region=liner.sets[{rc.LINER_SET!r}], sectionName={rc.LINER_SECTION!r}, "
+                 f"offset=0.0, offsetType=MIDDLE_SURFACE, offsetField='', thicknessAssignment=FROM_SECTION)"]
+    return code + ["mark('assign_property')"]
+
+
+def _trivial(job_name: str) -> List[str]:
+    instance, surface = ((rc.LINER_INSTANCE, rc.LOAD_SURF) if rc.LINER_TOGGLE
+                         else (rc.LAYUP_INSTANCE, rc.LAYUP_INTERACTION_SURF))
+    code = ["# ----- trivial -----",
+            f"model.StaticStep(name={rc.STEP!r}, previous='Initial', maxNumInc={rc.MAX_NUM_INC!r}, "
+            f"initialInc={rc.INITIAL_INC!r}, maxInc={rc.MAX_INC!r})",
+            f"model.Pressure(name={rc.LOAD!r}, createStepName={rc.STEP!r}, "
+            f"region=a.instances[{instance!r}].surfaces[{surface!r}], distributionType=UNIFORM, field='',",
+            f"               magnitude={rc.LOAD_MAG!r}, amplitude=UNSET)",
+            f"model.YsymmBC(name={rc.BC!r}, createStepName={rc.STEP!r}, region=a.sets[{rc.SYM_BC_SET!r}], "
+            f"localCsys=None)",
+            f"model.ZsymmBC(name={rc.BC2!r}, createStepName={rc.STEP!r}, "
+            f"region=a.instances[{rc.LAYUP_INSTANCE!r}].sets[{rc.LAYUP_SET!r}], localCsys=None)"]
+    if rc.LINER_TOGGLE:
+        code += ["model.ContactProperty('IntProp-1')",
+                 "model.interactionProperties['IntProp-1'].TangentialBehavior(formulation=FRICTIONLESS)",
+                 "model.interactionProperties['IntProp-1'].NormalBehavior(pressureOverclosure=HARD, "
+                 "allowSeparation=ON, constraintEnforcementMethod=DEFAULT)",
+                 f"model.SurfaceToSurfaceContactStd(name='Int-1', createStepName={rc.STEP!r}, "
+                 f"master=a.instances[{rc.LAYUP_INSTANCE!r}].surfaces[{rc.LAYUP_INTERACTION_SURF!r}],",
+                 f"                                slave=a.instances[{rc.LINER_INSTANCE!r}].surfaces"
+                 f"[{rc.LINER_INTERACTION_SURF!r}], sliding=SMALL, thickness=OFF,",
+                 "                                interactionProperty='IntProp-1', adjustMethod=OVERCLOSED, "
+                 "initialClearance=OMIT, datumAxis=None, clearanceRegion=None, tied=OFF)"]
+    code += ["a.regenerate()",
+             f"mdb.Job(name={job_name!r}, model={rc.MODEL!r}, description='', type=ANALYSIS, atTime=None, "
+             "waitMinutes=0, waitHours=0, queue=None, memory=90,",
+             "        memoryUnits=PERCENTAGE, getMemoryFromAnalysis=True, explicitPrecision=SINGLE, "
+             "nodalOutputPrecision=SINGLE, echoPrint=OFF,",
+             "        modelPrint=OFF, contactPrint=OFF, historyPrint=OFF, userSubroutine='', scratch='', "
+             "resultsFormat=ODB, multiprocessingMode=DEFAULT,",
+             "        numCpus=8, numDomains=8, numGPUs=2)",
+             f"mdb.jobs[{job_name!r}].writeInput(consistencyChecking=OFF)",
+             f"with open({job_name + rc.LAYUP_MASS_EXTENSION!r}, 'w') as file:",
+             "    file.write(repr(p.getMassProperties()['mass']))",
+             "mark('trivial')"]
+    return code
+
+
+def _timings(job_name: str, submit: bool) -> List[str]:
+    code = ["# ----- timings, see flat_build.read_timings -----",
+            "stages = [(name, end - start) for (_, start), (name, end) in zip(times[:-1], times[1:])]",
+            f"with open({job_name + TIMINGS_EXTENSION!r}, 'w') as file:",
+            "    json.dump({'stages': stages, 'total': times[-1][1] - times[0][1]}, file)",
+            "print('CAE Python time: {:.1f} s'.format(times[-1][1] - times[0][1]))"]
+    if submit:
+        code += [f"mdb.jobs[{job_name!r}].submit(consistencyChecking=OFF)"]
+    return code
+
+
+def generate_script(lines: Sequence, angles: Optional[Sequence[float]] = None, materials: Optional[Sequence] = None,
+                    job_name: str = JOB_NAME, submit: bool = True, script: str = 'build.py') -> str:
+    """
+    :param lines: curves in the abaqus format, see CurvesBunch.to_abaqus_format
+    :param angles: winding angle of every layer. Those of design_variables if None
+    :param materials: engineering constants of every layer, e.g. of sublaminates. LAYUP_MATERIAL_PROPS for the whole
+        layup if None, see assign_property.main
+    :param submit: submit the job once the input deck is written
+    :param script: name of the script, for its header
+    :return: content of the build script, for the Python interpreters of Abaqus 2 and 3
+    """
+    if angles is None:
+        from src.design_variables import get_angles
+        angles = get_angles()
+    data = build_data(lines, angles)
+    code = (_create_part(data) + _cut_face(data) + _assemble_parts() + _create_sets_surfs(data) + _mesher() +
+            _orient_elements(data) + _assign_property(materials) + _trivial(job_name) +
+            _timings(job_name, submit))
+    return _HEADER.format(job_name=job_name, script=script) + '\n'.join(code) + '\n'
+
+
+def write_script(path: str, lines: Sequence, angles: Optional[Sequence[float]] = None,
+                 materials: Optional[Sequence] = None, job_name: str = JOB_NAME, submit: bool = True) -> float:
+    """
+    :return: time spent on the host, in s
+    """
+    start = time.perf_counter()
+    content = generate_script(lines, angles, materials, job_name, submit, os.path.basename(path))
+    with open(path, 'w') as file:
+        file.write(content)
+    return time.perf_counter() - start
+
+
+def read_timings(job_name: str = JOB_NAME, directory: str = '.') -> Dict[str, float]:
+    """
+    :param directory: where CAE ran the script
+    :return: stage -> seconds spent in CAE, and 'total'
+    """
+    with open(os.path.join(directory, job_name + TIMINGS_EXTENSION)) as file:
+        content = json.load(file)
+    return {**{stage: seconds for stage, seconds in content['stages']}, 'total': content['total']}
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    stages = ', '.join(f"{stage} {seconds:.1f} s" for stage, seconds in timings.items() if stage != 'total')
+    return f"CAE Python time {timings['total']:.1f} s: {stages}"
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    from src.design_variables import get_angles
+    from src.slivers import merge_slivers
+    from src.thickness import main as calculate_layup
+
+    # python ./src/flat_build.py [path of the script]. Writes the build script of the default layup
+    lines = merge_slivers(calculate_layup()).curves.to_abaqus_format()
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(tempfile.gettempdir(), f"build_{JOB_NAME}.py")
+    elapsed = write_script(path, lines)
+    with open(path) as file:
+        content = file.read()
+    compile(content, path, 'exec')
+    data = build_data(lines, get_angles())
+    print(f"{path}: {len(content) / 1e3:.0f} kB, {content.count(chr(10))} lines, written in {1e3 * elapsed:.0f} ms")
+    print(f"{len(data.layer_points)} layer sets, {len(data.pressure_points) + len(data.pressure_closest)} edges "
+          f"of the pressure surface ({len(data.pressure_closest)} by proximity), {len(data.symmetry_points)} of the "
+          f"symmetry BC")
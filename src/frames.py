@@ -0,0 +1,121 @@
+# coding=utf-8
+"""
+Stresses in the winding material frame
+Results come in the global axes of the axisymmetric model, 1: radial, 2: axial, 3: hoop, while the fibers follow the
+local basis that orient_elements.py assigns to every element: (g_1, g_2), 6 values per element, with g_1 along the
+fibers. Abaqus completes the basis as 3 = 1 x 2 and 2 = 3 x 1.
+The stresses of millions of integration points are rotated in chunks of CHUNK points, so that the temporary arrays
+take a few MB regardless of the size of the results. Within a chunk the components are stored by rows, (3, 3, n),
+and the rotation sigma' = a sigma a^T is two einsum contractions along the short axes, vectorized along the points.
+Run from  root '/' directory
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Order of the 6 stress components of Abaqus: S11, S22, S33, S12, S13, S23
+ABAQUS = ((0, 0), (1, 1), (2, 2), (0, 1), (0, 2), (1, 2))
+# In the material frame, 1: fiber, 2: transverse, 3: normal to the ply
+MATERIAL_COMPONENTS = ('fiber', 'transverse', 'normal', 'in_plane_shear', 'fiber_normal_shear',
+                       'transverse_normal_shear')
+CHUNK = 2 ** 16  # integration points rotated at once
+
+
+def orientations(gamma: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """
+    Basis of orient_elements.get_basis, for many elements at once
+    :param gamma: angle between the tangent of the layer, pointing downwards, and the axis, in radians
+    :param alpha: angle of orient_elements.get_alpha, the winding angle plus pi / 2, in radians
+    :return: (N, 6) g_1 and g_2 in the global axes
+    """
+    sa, ca, sg, cg = np.sin(alpha), np.cos(alpha), np.sin(gamma), np.cos(gamma)
+    return np.column_stack((sg * sa, cg * sa, ca, -sg * ca, -cg * ca, sa))
+
+
+def _cross(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """ cross product of (3, n) arrays, faster than np.cross along the first axis """
+    return np.stack((u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0]))
+
+
+def material_axes(orientation: np.ndarray) -> np.ndarray:
+    """
+    :param orientation: (N, 6) g_1 and g_2, as in the DiscreteField of orient_elements.py
+    :return: (3, 3, N) rotation a, a[i, k] cosine between the material axis i and the global axis k
+    """
+    g_1, g_2 = orientation[:, :3].T, orientation[:, 3:].T
+    e_1 = g_1 / np.sqrt(np.einsum('kn,kn->n', g_1, g_1))
+    e_3 = _cross(e_1, g_2)
+    e_3 /= np.sqrt(np.einsum('kn,kn->n', e_3, e_3))
+    return np.stack((e_1, _cross(e_3, e_1), e_3))
+
+
+def _rotate(stresses: np.ndarray, a: np.ndarray, components: Tuple[Tuple[int, int], ...]) -> np.ndarray:
+    """
+    :param stresses: (n, 6) stresses in the global axes
+    :param a: (3, 3, n) rotations
+    :return: (6, n) stresses in the rotated axes
+    """
+    i, j = np.array(components).T
+    tensor = np.empty((3, 3, len(stresses)))
+    tensor[i, j] = tensor[j, i] = stresses.T
+    rotated = np.einsum('ikn,kln->iln', a, tensor)  # a sigma
+    # all 9 components: cheaper than gathering the rows of the 6 needed ones
+    return np.einsum('iln,jln->ijn', rotated, a)[i, j]
+
+
+def to_material_frame(stresses: np.ndarray, orientation: np.ndarray, rows: Optional[np.ndarray] = None,
+                      components: Tuple[Tuple[int, int], ...] = ABAQUS, chunk: int = CHUNK,
+                      out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    :param stresses: (N, 6) stresses in the global axes, e.g. of every integration point
+    :param orientation: (E, 6) g_1 and g_2 of every element, see orient_elements.py
+    :param rows: (N,) row of :orientation: of every stress, e.g. the element of every integration point.
+        One orientation per stress if None
+    :param components: order of the components, in the input as well as in the output
+    :param out: (N, 6) array the result is written to. May be :stresses:
+    :return: (N, 6) stresses in the material frame: fiber, transverse, normal, see MATERIAL_COMPONENTS
+    """
+    stresses = np.asarray(stresses, dtype=float)
+    if rows is None and len(orientation) != len(stresses):
+        raise ValueError(f"{len(stresses)} stresses and {len(orientation)} orientations. Pass the rows of the "
+                         f"orientation of every stress")
+    out = np.empty_like(stresses) if out is None else out
+    for start in range(0, len(stresses), chunk):
+        stop = min(start + chunk, len(stresses))
+        basis = orientation[start:stop] if rows is None else orientation[rows[start:stop]]
+        out[start:stop] = _rotate(stresses[start:stop], material_axes(basis), components).T
+    return out
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from src.axisymmetric import solve_layup
+    from src.thickness import main as calculate_layup
+
+    # Check against the built-in solver, which rotates its stresses through the winding angle, and throughput
+    # python ./src/frames.py [million integration points]
+    solution = solve_layup(calculate_layup())
+    mesh = solution.mesh
+    # the meridians of the mesh point upwards, the layers of orient_elements.py downwards
+    gamma = np.arccos(-mesh.meridians[:, 1])
+    alpha = np.radians(mesh.angles) + np.pi / 2
+    r, theta, z, theta_z, r_z, r_theta = solution.stresses.T
+    material = to_material_frame(np.column_stack((r, z, theta, r_z, r_theta, theta_z)), orientations(gamma, alpha))
+    reference = solution.material_stresses()  # fiber, transverse, radial
+    scale = np.abs(reference[:, :2]).max(axis=0)
+    error = np.abs(material[:, :2] - reference[:, :2]).max(axis=0) / scale
+    print(f"fiber and transverse stresses against the built-in solver: max difference {100 * error[0]:.2e} % and "
+          f"{100 * error[1]:.2e} % of the peak")
+
+    n = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else 4_000_000
+    rng = np.random.default_rng(0)
+    elements = orientations(rng.uniform(0, np.pi, n // 4), rng.uniform(np.pi / 2, np.pi, n // 4))
+    stresses = rng.normal(0., 500., (n, 6))
+    start = time.perf_counter()
+    material = to_material_frame(stresses, elements, rows=np.repeat(np.arange(n // 4), 4))
+    elapsed = time.perf_counter() - start
+    print(f"{n / 1e6:.0f} million integration points of 4 per element: {elapsed:.2f} s, "
+          f"{n / elapsed / 1e6:.1f} million points/s")
+    invariant = np.abs(material[:, :3].sum(axis=1) - stresses[:, :3].sum(axis=1)).max()
+    print(f"max change of the trace: {invariant:.1e} MPa")
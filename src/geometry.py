@@ -0,0 +1,52 @@
+# coding=utf-8
+"""
+Derived geometry of a curve given by its points: arclength, unit tangents, normals, tangent angle and curvature.
+Derivatives are taken with respect to the point index, by central differences, as the layers are offset in
+thickness.py. model.Curve caches the results per curve. The CAE routines use the same functions on the abaqus format,
+hence this module has to stay compatible with the Python interpreter of Abaqus.
+Run from  root '/' directory
+"""
+import numpy as np
+
+
+def arclength(points):
+    """
+    :param points: Nx2 array
+    :return: cumulative arclength from the first point
+    """
+    distances = np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1))
+    return np.insert(np.cumsum(distances), 0, 0)
+
+
+def tangents(points):
+    """
+    :return: Nx2 unit tangents, in the direction of the points
+    """
+    derivative = np.gradient(np.asarray(points, dtype=float), axis=0)
+    return derivative / np.sqrt(derivative[:, 0] ** 2 + derivative[:, 1] ** 2)[:, None]
+
+
+def normals(unit_tangents):
+    """
+    :return: the tangents rotated by +90 degrees. Outwards for the curves of the layup, which run downwards
+    """
+    return np.column_stack((-unit_tangents[:, 1], unit_tangents[:, 0]))
+
+
+def tangent_angles(unit_tangents):
+    """
+    :return: angle between the tangents and the y axis, in radians [0, pi]. pi where a curve runs straight down
+    """
+    return np.arccos(np.clip(unit_tangents[:, 1], -1., 1.))
+
+
+def curvature(points):
+    """
+    :return: signed curvature in 1/mm, positive where the curve turns counterclockwise
+    """
+    points = np.asarray(points, dtype=float)
+    first = np.gradient(points, axis=0)
+    second = np.gradient(first, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ((first[:, 0] * second[:, 1] - first[:, 1] * second[:, 0])
+                / (first[:, 0] ** 2 + first[:, 1] ** 2) ** 1.5)
@@ -0,0 +1,183 @@
+# coding=utf-8
+"""
+Point-in-layer classification
+Layer k is the region between curve k - 1 and curve k. Every curve is closed through the axis (x = 0), hence the
+regions enclosed by the curves are nested and the layer of a point is the number of curves that do not enclose it:
+    0: inside the liner, k: layer k, -1: outside the layup
+The edges of all the curves are bucketed into slabs between the heights of their vertices and sorted by x inside each
+slab. As the curves do not cross each other, the first edge to the right of a point, found by bisection, gives its layer.
+Works on plain arrays of points, without a CAE session. It is imported by the CAE routines as well, so it has to stay
+compatible with the Python interpreter of Abaqus.
+Run from  root '/' directory
+"""
+import numpy as np
+
+OUTSIDE = -1
+LINER = 0
+
+
+def curves_from_abaqus_format(lines):
+    """
+    Rebuilds the full curves from the layer points only, as passed to the CAE routines.
+    The first point of each layer is a point of the previous curve; the points before it are shared.
+    :param lines: CurvesBunch.to_abaqus_format()
+    :return: list of Nx2 arrays, the first one is the liner
+    """
+    curves = [np.asarray(lines[0], dtype=float)]
+    for line in lines[1:]:
+        tail = np.asarray(line, dtype=float)
+        previous = curves[-1]
+        matches = np.flatnonzero((previous == tail[0]).all(axis=1))
+        start = matches[0] if matches.size else np.argmin(np.linalg.norm(previous - tail[0], axis=1))
+        curves.append(np.concatenate((previous[:start], tail), axis=0))
+    return curves
+
+
+class LayerClassifier:
+    def __init__(self, curves):
+        """
+        :param curves: sequence of Nx2 arrays, from the liner to the topmost layer, running from the top down to y = 0.
+        See from_bunch
+        """
+        self.n_curves = len(curves)
+
+        # ----- edges. Those a curve shares with the previous one are stored once, for a range of curves -----
+        segments, first, shared_ids = [], [], []
+        previous, previous_ids, n_edges = None, np.empty(0, dtype=int), 0
+        for k, points in enumerate(curves):
+            points = np.asarray(points, dtype=float)
+            shared = 0
+            if previous is not None:
+                length = min(len(points), len(previous))
+                differ = np.flatnonzero((points[:length] != previous[:length]).any(axis=1))
+                shared = max((differ[0] if differ.size else length) - 1, 0)
+            new = len(points) - 1 - shared
+            segments.append(np.column_stack((points[shared:-1], points[shared + 1:])))
+            first.append(np.full(new, k))
+            shared_ids.append(previous_ids[:shared])
+            previous_ids = np.concatenate((previous_ids[:shared], n_edges + np.arange(new)))
+            previous, n_edges = points, n_edges + new
+        segments, first = np.concatenate(segments), np.concatenate(first)
+        last = first.copy()
+        for k, ids in enumerate(shared_ids):
+            last[ids] = k
+
+        keep = segments[:, 1] != segments[:, 3]  # horizontal edges are never crossed by a horizontal ray
+        x0, y0, x1, y1 = segments[keep].T
+        self.first, self.last = first[keep], last[keep]
+        # The curves run downwards, enclosing the region on the side of the axis: descending edges are the way out
+        self.outward = y1 < y0
+        self.y_low = np.minimum(y0, y1)
+        self.x_low = np.where(self.outward, x1, x0)
+        self.slope = (x1 - x0) / (y1 - y0)
+
+        # ----- slabs between consecutive heights of the vertices, and the edges crossing each one sorted by x -----
+        # The curves do not cross each other, hence the order of the edges is the same at any height of a slab
+        self.heights = np.unique(np.concatenate((y0, y1)))
+        low = np.searchsorted(self.heights, self.y_low)
+        spans = np.searchsorted(self.heights, np.maximum(y0, y1)) - low
+        edges = np.repeat(np.arange(len(low)), spans)
+        slabs = np.repeat(low, spans) + np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+        middle = (self.heights[slabs] + self.heights[slabs + 1]) / 2
+        order = np.lexsort((self._x_at(edges, middle), slabs))
+        self.slab_edges = edges[order]
+        self.slab_pointer = np.concatenate(([0], np.cumsum(np.bincount(slabs, minlength=len(self.heights) - 1))))
+
+    @classmethod
+    def from_bunch(cls, curves):
+        """
+        :param curves: CurvesBunch
+        """
+        return cls([curve.points for curve in curves.curves])
+
+    @classmethod
+    def from_abaqus_format(cls, lines):
+        return cls(curves_from_abaqus_format(lines))
+
+    def _x_at(self, edges, y):
+        return self.x_low[edges] + (y - self.y_low[edges]) * self.slope[edges]
+
+    def _classify_chunk(self, px, py):
+        slab = np.searchsorted(self.heights, py, side='right') - 1
+        valid = (slab >= 0) & (slab < len(self.heights) - 1)
+        slab[~valid] = 0
+        low = self.slab_pointer[slab]
+        end = np.where(valid, self.slab_pointer[slab + 1], low)
+        high = end.copy()
+
+        # bisection for the first edge of the slab to the right of the point
+        last_entry = len(self.slab_edges) - 1
+        active = low < high
+        while active.any():
+            middle = (low + high) // 2
+            right = self._x_at(self.slab_edges[np.minimum(middle, last_entry)], py) > px
+            high = np.where(active & right, middle, high)
+            low = np.where(active & ~right, middle + 1, low)
+            active = low < high
+
+        # leaving curves first..last: the point is in layer first. Entering them: it is in layer last + 1
+        edge = self.slab_edges[np.minimum(low, last_entry)]
+        layers = np.where(self.outward[edge], self.first[edge], self.last[edge] + 1)
+        layers[(low == end) | (layers == self.n_curves)] = OUTSIDE
+        return layers
+
+    def classify(self, points, chunk_size=1 << 18):
+        """
+        :param points: Nx2 array, e.g. element centroids
+        :return: layer of every point. LINER inside the liner and OUTSIDE outside the layup
+        """
+        points = np.asarray(points, dtype=float)
+        layers = np.empty(len(points), dtype=int)
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            layers[start:start + chunk_size] = self._classify_chunk(chunk[:, 0], chunk[:, 1])
+        return layers
+
+
+def layer_angles(layers, angles):
+    """
+    :param angles: winding angle of every layer, without the liner
+    :return: winding angle at every classified point. nan for the liner and outside the layup
+    """
+    table = np.concatenate(([np.nan], np.asarray(angles, dtype=float), [np.nan]))
+    return table[np.where(layers == OUTSIDE, len(table) - 1, layers)]
+
+
+def layer_statistics(values, layers, n_layers):
+    """
+    Reduces a result field by layer, e.g. the stresses at the element centroids
+    :param n_layers: number of layers, without the liner
+    :return: dict of count, mean, min and max per layer. Index 0 is the liner
+    """
+    values = np.asarray(values, dtype=float)
+    valid = layers != OUTSIDE
+    values, layers = values[valid], layers[valid]
+    size = n_layers + 1
+    count = np.bincount(layers, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(layers, weights=values, minlength=size) / count
+    minimum, maximum = np.full(size, np.inf), np.full(size, -np.inf)
+    np.minimum.at(minimum, layers, values)
+    np.maximum.at(maximum, layers, values)
+    return {'count': count, 'mean': mean, 'min': minimum, 'max': maximum}
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from src.thickness import main as calculate_layup
+
+    # Throughput benchmark: python ./src/layers.py [number of points]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    layup = calculate_layup()
+    start = time.perf_counter()
+    classifier = LayerClassifier.from_bunch(layup)
+    built = time.perf_counter()
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform((0., 0.), (200., 560.), size=(n, 2))
+    layers = classifier.classify(points)
+    end = time.perf_counter()
+    print("buckets built in {:.1f} ms, {} points classified in {:.2f} s ({:.1f} M points/s)".format(
+        1e3 * (built - start), n, end - built, n / (end - built) / 1e6))
+    print("points per layer: {}".format(np.bincount(layers[layers != OUTSIDE], minlength=len(layup.curves))))
@@ -0,0 +1,49 @@
+# coding=utf-8
+"""
+Differences between two layups
+The curves are stacked from the liner outwards, each one on top of the previous ones: once a curve differs, all the
+curves above it have to be rebuilt. Hence the difference between two layups is the index of the first changed curve.
+Works on CurvesBunch as well as on the abaqus format. It is imported by build_model.py, hence it has to stay compatible
+with the Python interpreter of Abaqus.
+Run from  root '/' directory
+"""
+import numpy as np
+
+
+def first_difference(old, new):
+    """
+    :param old, new: sequences of comparable items, e.g. winding angles or engineering constants
+    :return: index of the first item that differs, the length of the shorter one if one continues the other.
+    None if they are equal
+    """
+    for index, (a, b) in enumerate(zip(old, new)):
+        if not np.array_equal(a, b):
+            return index
+    return None if len(old) == len(new) else min(len(old), len(new))
+
+
+def first_changed_line(old, new, tolerance=0.):
+    """
+    :param old, new: curves in the abaqus format, see CurvesBunch.to_abaqus_format, or lists of Nx2 arrays
+    :param tolerance: largest coordinate difference of an unchanged point, in mm
+    :return: index of the first curve that differs, 0 is the liner. None if the curves are the same
+    """
+    for index, (a, b) in enumerate(zip(old, new)):
+        a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+        if a.shape != b.shape or np.abs(a - b).max() > tolerance:
+            return index
+    return None if len(old) == len(new) else min(len(old), len(new))
+
+
+def first_changed_layer(old, new, tolerance=0.):
+    """
+    :param old, new: CurvesBunch
+    :return: index of the first curve whose points or winding angle differ, 0 is the liner.
+    None if the layups are the same
+    """
+    changed = [first_changed_line([curve.points for curve in old.curves], [curve.points for curve in new.curves],
+                                  tolerance),
+               first_difference([curve.winding_angle for curve in old.curves],
+                                [curve.winding_angle for curve in new.curves])]
+    changed = [index for index in changed if index is not None]
+    return min(changed) if changed else None
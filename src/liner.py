@@ -0,0 +1,143 @@
+# coding=utf-8
+"""
+Parametric liner generator
+Replaces the fixed /resources/liner.csv. Builds the outer shape of the liner from the top of the boss neck down to the
+symmetry plane y = 0: vertical neck, dome, cylinder. Two dome families are available:
+    isotensoid: geodesic isotensoid dome from netting theory, sin(alpha) = r_0 / r
+    elliptical: elliptical dome of height dome_ratio * radius, truncated at the polar opening
+The points are returned in memory at a constant arclength spacing, as the csv after
+thickness.interpolate_layer_region_constant_arclength, so that the liner can be swept as a design variable.
+CAE receives the liner as the first line of the intermediate file. export_csv writes a generated liner in place of
+/resources/liner.csv, for the scripts that read it.
+The hoop layers end at the top of the cylinder of a generated liner, see thickness.cylinder_top.
+Run from  root '/' directory
+"""
+import hashlib
+import os
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+
+import numpy as np
+from numpy import pi
+from scipy.integrate import cumulative_trapezoid
+
+from model import Curve, Array2D
+from src.thickness import interpolate_layer_region_constant_arclength
+
+CACHE_DIR = os.path.join('.', 'resources', 'liners')
+DOME_FAMILIES = ('isotensoid', 'elliptical')
+# number of points used to discretize the dome before resampling at constant arclength
+DOME_RESOLUTION = 2000
+
+
+@dataclass(frozen=True)
+class LinerParameters:
+    # Defaults approximate /resources/liner.csv
+    radius: float = 156.  # mm - cylinder radius
+    cylinder_length: float = 365.  # mm - length of the cylinder, from the symmetry plane to the dome
+    polar_opening: float = 30.  # mm - polar opening radius
+    neck_length: float = 64.  # mm - length of the boss neck above the dome
+    dome: str = 'isotensoid'  # one of DOME_FAMILIES
+    dome_ratio: float = 0.79  # dome height / radius. Only for elliptical domes
+
+    def __post_init__(self):
+        if self.dome not in DOME_FAMILIES:
+            raise ValueError(f"dome must be one of {DOME_FAMILIES}, not {self.dome}")
+        if not 0 < self.polar_opening < self.radius:
+            raise ValueError(f"polar opening must be between 0 and the radius. {self.polar_opening} provided")
+
+    @property
+    def key(self) -> str:
+        """ short hash identifying the geometry """
+        return hashlib.sha1(repr(sorted(asdict(self).items())).encode()).hexdigest()[:12]
+
+
+def isotensoid_dome(radius: float, polar_opening: float, n: int = DOME_RESOLUTION) -> Array2D:
+    """
+    Meridian of the geodesic isotensoid dome, from the polar opening to the cylinder.
+    With rho = r / R and u = rho^2, fiber equilibrium gives |dz/ds| = rho^3 sqrt(1 - rho_0^2) / sqrt(rho^2 - rho_0^2).
+    The meridian is axial (|dz/ds| = 1) at the cylinder, u = 1, and at the opening, u = u_s, the other positive root of
+    (1 - rho_0^2) u^3 - u + rho_0^2 = 0. The substitution u = u_s + (1 - u_s) (1 - cos phi) / 2 removes the
+    singularities of dz/du at both ends, leaving dz/dphi = R u / (2 sqrt(u - u_n)), with u_n the negative root.
+    :return: Nx2 array of (r, z) points, z measured from the cylinder-dome junction
+    """
+    rho_0 = polar_opening / radius
+    a = 1 - rho_0 ** 2
+    # roots of a u^2 + a u - rho_0^2 = 0, the remaining factor of the cubic
+    discriminant = np.sqrt(a ** 2 + 4 * a * rho_0 ** 2)
+    u_s, u_n = (-a + discriminant) / (2 * a), (-a - discriminant) / (2 * a)
+
+    phi = np.linspace(0., pi, n)
+    u = u_s + (1 - u_s) * (1 - np.cos(phi)) / 2
+    dz = radius * u / (2 * np.sqrt(u - u_n))
+    z = cumulative_trapezoid(dz, phi, initial=0.)
+    return np.column_stack((radius * np.sqrt(u), z[-1] - z))
+
+
+def elliptical_dome(radius: float, polar_opening: float, dome_ratio: float, n: int = DOME_RESOLUTION) -> Array2D:
+    """
+    :return: Nx2 array of (r, z) points of the ellipse, from the polar opening to the cylinder
+    """
+    theta_0 = np.arccos(polar_opening / radius)
+    theta = np.linspace(theta_0, 0., n)
+    return np.column_stack((radius * np.cos(theta), dome_ratio * radius * np.sin(theta)))
+
+
+def liner_outline(parameters: LinerParameters) -> Array2D:
+    """
+    :return: dense outline from the top of the neck to y = 0, not yet evenly spaced
+    """
+    p = parameters
+    if p.dome == 'isotensoid':
+        dome = isotensoid_dome(p.radius, p.polar_opening)
+    else:
+        dome = elliptical_dome(p.radius, p.polar_opening, p.dome_ratio)
+    dome[:, 1] += p.cylinder_length
+
+    r_neck, y_neck = dome[0]
+    neck = np.array([[r_neck, y_neck + p.neck_length]])
+    cylinder = np.array([[p.radius, 0.]])
+    return np.concatenate((neck, dome, cylinder), axis=0)
+
+
+@lru_cache(maxsize=64)
+def _generate(parameters: LinerParameters, arclength: float) -> Array2D:
+    curve = Curve(liner_outline(parameters))
+    return interpolate_layer_region_constant_arclength(curve, arclength=arclength).points
+
+
+def generate_liner(parameters: LinerParameters = LinerParameters(), arclength: float = 1.) -> Curve:
+    """
+    :param arclength: spacing of the points in mm
+    :return: liner shape in the same layout as /resources/liner.csv after resampling
+    """
+    return Curve(_generate(parameters, arclength).copy())
+
+
+def export_csv(parameters: LinerParameters, arclength: float = 1., directory: str = CACHE_DIR) -> str:
+    """
+    Writes the liner in the format of /resources/liner.csv, e.g. to replace it. The file is only written once per
+    geometry.
+    :return: path of the csv file
+    """
+    path = os.path.join(directory, f"liner_{parameters.key}_{arclength:g}.csv")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        np.savetxt(path + '.tmp', generate_liner(parameters, arclength).points, fmt='%.9g', delimiter=", ")
+        os.replace(path + '.tmp', path)
+    return path
+
+
+if __name__ == "__main__":
+    import time
+
+    for family in DOME_FAMILIES:
+        parameters = LinerParameters(dome=family)
+        start = time.perf_counter()
+        for opening in np.linspace(20., 60., 100):
+            _generate.cache_clear()
+            generate_liner(LinerParameters(polar_opening=opening, dome=family))
+        elapsed = time.perf_counter() - start
+        liner = generate_liner(parameters)
+        print(f"{family}: {len(liner.points)} points, top at y = {liner.y.max():.1f} mm, "
+              f"{elapsed * 10:.2f} ms per liner, csv in {export_csv(parameters)}")
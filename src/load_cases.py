@@ -0,0 +1,157 @@
+# coding=utf-8
+"""
+Load cases by superposition of unit loads
+The model is linear elastic: the response to any combination of loads is the same combination of the responses to the
+unit loads. Each geometry is solved once per unit load, e.g. a pressure of 1 MPa, and the results of the operating,
+test and burst pressures, or of any other combination, are scaled from them when they are extracted. Reserve factors
+of proportional cases are scaled as well, see src/failure.py.
+The unit responses come from the built-in solver, from_native, or from Abaqus: write the deck of the unit pressure with
+variants.patch_deck(base, output, LOAD_MAG=UNIT_PRESSURE) and pass the extracted fields to LoadCases.
+Run from  root '/' directory
+"""
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+import src.routines.routine_constants as rc
+from model import CurvesBunch
+
+UNIT_PRESSURE = 1.  # MPa
+PRESSURE = 'pressure'  # name of the internal pressure among the unit loads
+# Pressure cases in multiples of the nominal working pressure LOAD_MAG, as in the regulations of type IV vessels
+PRESSURE_CASES = {'operating': 1., 'test': 1.5, 'burst': 2.25}
+
+type Case = Dict[str, float]  # unit load -> factor. For the pressure the factor is the pressure in MPa
+
+
+class LoadCases:
+    def __init__(self, units: Dict[str, Dict[str, np.ndarray]], components=None):
+        """
+        :param units: unit load -> field name -> response to the unit load, e.g. 'displacements', 'stresses' or
+            'material_stresses', with the same fields for every load
+        :param components: order of the material stresses, see src/frames.py. ABAQUS if None
+        """
+        names = [set(fields) for fields in units.values()]
+        if any(fields != names[0] for fields in names):
+            raise ValueError("every unit load must have the same fields")
+        self.units = units
+        self.components = components
+        self._failure = {}  # unit load -> evaluation of its unit response, see failure
+
+    @classmethod
+    def from_native(cls, curves: CurvesBunch, element_length: float = rc.LAYUP_MESH_SIZE,
+                    loads: Optional[Dict[str, np.ndarray]] = None, **kwargs) -> "LoadCases":
+        """
+        Solves the unit loads with the built-in solver, see src/axisymmetric.py. One factorization for all of them
+        :param loads: further unit loads, name -> nodal forces of the mesh. Only the unit pressure if None
+        :param kwargs: see axisymmetric.solve_loads
+        """
+        from src.axisymmetric import generate_mesh, pressure_load, solve_loads
+        from src.sublaminates import VOIGT
+        mesh = generate_mesh(curves, element_length)
+        loads = {PRESSURE: pressure_load(mesh, UNIT_PRESSURE), **(loads or {})}
+        solutions = solve_loads(mesh, loads, **kwargs)
+        units = {name: {'displacements': solution.displacements, 'stresses': solution.stresses,
+                        'material_stresses': solution.material_stresses()} for name, solution in solutions.items()}
+        return cls(units, components=VOIGT)
+
+    # ----- Storage: one file per geometry -----
+    def save(self, path: str) -> None:
+        arrays = {f"{load}/{name}": value for load, fields in self.units.items() for name, value in fields.items()}
+        np.savez(path, components=np.array(self.components if self.components is not None else []), **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "LoadCases":
+        with np.load(path) as data:
+            units = {}
+            for key in data.files:
+                if key != 'components':
+                    load, name = key.split('/')
+                    units.setdefault(load, {})[name] = data[key]
+            components = tuple(tuple(int(k) for k in pair) for pair in data['components']) or None
+        return cls(units, components)
+
+    # ----- Combination -----
+    def field(self, name: str, case: Case) -> np.ndarray:
+        """
+        :return: field :name: of the combination :case:, e.g. {'pressure': 75.}
+        """
+        unknown = set(case) - set(self.units)
+        if unknown:
+            raise KeyError(f"no unit response for {', '.join(sorted(unknown))}")
+        return sum(factor * self.units[load][name] for load, factor in case.items())
+
+    def fields(self, name: str, cases: Iterable[Case]) -> np.ndarray:
+        """
+        :return: (cases, ...) field :name: of every case, one contraction over the unit loads
+        """
+        loads = list(self.units)
+        factors = np.array([[case.get(load, 0.) for load in loads] for case in cases])
+        return np.tensordot(factors, np.stack([self.units[load][name] for load in loads]), axes=1)
+
+    def failure(self, case: Case, **kwargs):
+        """
+        :param kwargs: see failure.evaluate
+        :return: FailureResult of the combination. Positive multiples of one unit load are scaled from the evaluation
+            of the unit response: the reserve factor is the load factor along the load path, whatever the criterion
+        """
+        from src.failure import FailureResult, evaluate
+        if self.components is not None:
+            kwargs.setdefault('components', self.components)
+        loaded = [(load, factor) for load, factor in case.items() if factor != 0.]
+        if len(loaded) != 1 or loaded[0][1] < 0.:
+            return evaluate(self.field('material_stresses', case), pressure=case.get(PRESSURE, 0.), **kwargs)
+        load, factor = loaded[0]
+        key = (load, repr(sorted(kwargs.items())))
+        if key not in self._failure:
+            self._failure[key] = evaluate(self.units[load]['material_stresses'], pressure=1., **kwargs)
+        unit = self._failure[key]
+        return FailureResult({criterion: factors / factor for criterion, factors in unit.reserve_factors.items()},
+                             unit.modes, case.get(PRESSURE, 0.),
+                             {criterion: factors / factor for criterion, factors in unit.fiber_reserve_factors.items()})
+
+    def pressure_cases(self, multiples: Dict[str, float] = None, nominal: float = rc.LOAD_MAG) -> Dict[str, Case]:
+        """
+        :return: case name -> case of the internal pressure, e.g. {'burst': {'pressure': 168.75}}
+        """
+        multiples = PRESSURE_CASES if multiples is None else multiples
+        return {name: {PRESSURE: multiple * nominal} for name, multiple in multiples.items()}
+
+
+def pressure_kpis(cases: LoadCases, criterion: str = 'puck') -> Dict[str, float]:
+    """
+    :return: radial displacement, fiber stress and reserve factor of every pressure case, e.g. 'burst_reserve_factor'
+    """
+    kpis = {}
+    for name, case in cases.pressure_cases().items():
+        failure = cases.failure(case, criteria=(criterion, ))
+        kpis[f"{name}_max_u_r"] = float(cases.field('displacements', case)[:, 0].max())
+        kpis[f"{name}_max_fiber_stress"] = float(cases.field('material_stresses', case)[:, 0].max())
+        kpis[f"{name}_reserve_factor"] = float(failure.reserve_factors[criterion].min())
+    return kpis
+
+
+if __name__ == "__main__":
+    import time
+    from src.axisymmetric import solve_layup
+    from src.thickness import main as calculate_layup
+
+    layup = calculate_layup()
+    start = time.perf_counter()
+    cases = LoadCases.from_native(layup)
+    solved = time.perf_counter()
+    pressures = np.linspace(0., 2.5 * rc.LOAD_MAG, 101)
+    stresses = cases.fields('material_stresses', [{PRESSURE: p} for p in pressures])
+    reserve = [cases.failure({PRESSURE: p}, criteria=('puck', )).reserve_factors['puck'].min() for p in pressures[1:]]
+    scaled = time.perf_counter()
+    print(f"unit pressure solved in {solved - start:.2f} s, {len(pressures)} pressures scaled in {scaled - solved:.3f} s")
+    print(f"peak fiber stress at {pressures[-1]:.1f} MPa: {stresses[-1, :, 0].max():.0f} MPa, "
+          f"lowest reserve factor at {pressures[1]:.2f} MPa: {reserve[0]:.1f}")
+    for name, value in pressure_kpis(cases).items():
+        print(f"    {name}: {value:.4g}")
+
+    # against a solution at the burst pressure
+    burst = cases.pressure_cases()['burst']
+    reference = solve_layup(layup, pressure=burst[PRESSURE])
+    error = np.abs(cases.field('stresses', burst) - reference.stresses).max() / np.abs(reference.stresses).max()
+    print(f"burst case against a solution at {burst[PRESSURE]:.2f} MPa: max difference {100 * error:.1e} % of the peak")
@@ -18,15 +18,30 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 import subprocess
 
+from src.flat_build import format_timings, read_timings, write_script
+from src.monitor import JobMonitor
+from src.slivers import merge_slivers
 from src.thickness import main as calculate_layup
 
 if __name__ == "__main__":
-    # Calculate curves and transform to the abaqus format of List[Tuple[Tuple[float, float], ... ] ]
-    curves = calculate_layup().to_abaqus_format()
-    # Transform to string and write it to an intermediate text file
+    # Calculate curves, remove the thin tails of the layers, see src/slivers.py,
+    # and transform to the abaqus format of List[Tuple[Tuple[float, float], ... ] ]
+    slivers = merge_slivers(calculate_layup())
+    print(slivers)
+    curves = slivers.curves.to_abaqus_format()
+    # Transform to string and write it to an intermediate text file, as read by build_model.py
     with open("./resources/intermediate_file.txt", "w") as file:
         file.write(str(curves))
-    # Call the build_model script in the abaqus python interpreter by using a PowerShell command
-    p = subprocess.Popen(['powershell', 'abaqus cae script=../src/build_model.py'], cwd='./temp')
+    # Compute the pick points, splines and orientation tables here and write a flat build script: the abaqus python
+    # interpreter only replays its calls, see src/flat_build.py
+    elapsed = write_script('./temp/build_Job-1.py', curves, job_name='Job-1')
+    print('Build script written in {:.2f} s'.format(elapsed))
+    # Run it in CAE by using a PowerShell command
+    # Follow the job it submits. It is terminated if it diverges, see src/monitor.py
+    monitor = JobMonitor('Job-1', './temp')
+    p = subprocess.Popen(['powershell', 'abaqus cae script=build_Job-1.py'], cwd='./temp')
+    for event in monitor.watch(lambda: p.poll() is None):
+        print(event)
     p.wait()
+    print(format_timings(read_timings('Job-1', './temp')))
 
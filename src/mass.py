@@ -0,0 +1,146 @@
+# coding=utf-8
+"""
+Composite volume and mass computation
+Works directly on the CurvesBunch, no CAE model needed.
+The volume of each layer is obtained with Pappus' theorem: the region between two consecutive curves is revolved
+around the axis of the vessel (x = 0). Only the modelled half of the vessel (y >= 0) is accounted for, as in the CAE model.
+Units follow the rest of the tool: mm, and LAYUP_DENSITY in t/mm^3, i.e., masses in t.
+The mass is checked against the one of the CAE model, which CAE writes next to the input deck, see read_cae_mass.
+Run from  root '/' directory
+"""
+import os
+from typing import Dict, List, Sequence
+
+import numpy as np
+from numpy import pi
+
+import src.routines.routine_constants as rc
+from model import Curve, CurvesBunch, Array1D, Array2D
+
+MASS_DEVIATION_LIMIT = 0.01  # relative deviation from the CAE mass accepted, see mass_deviation
+
+
+def first_moments(points: Array2D, curve_ids: Array1D, n_curves: int) -> Array1D:
+    """
+    Signed first moment about the axis (times 6) of the regions enclosed by each curve and the axis.
+    Each region is closed by the horizontal segments from the curve ends to the axis and the axis itself,
+    which only contribute through the end points. Curves are passed flattened to allow for a single bincount.
+    Repeated points add nothing, hence curves padded with their last point can be passed as they are.
+    :param points: Mx2 array of all the points of all the curves, one curve after the other
+    :param curve_ids: M array, index of the curve each point belongs to. Must be sorted.
+    :param n_curves: number of curves
+    :return: array of length n_curves
+    """
+    x, y = points[:, 0], points[:, 1]
+    # shoelace-like terms of the first moment for consecutive points belonging to the same curve
+    same = curve_ids[:-1] == curve_ids[1:]
+    terms = (x[:-1] + x[1:]) * (x[:-1] * y[1:] - x[1:] * y[:-1]) * same
+    moments = np.bincount(curve_ids[:-1], weights=terms, minlength=n_curves)
+
+    # closing segments: end -> axis and axis -> start
+    ends = np.flatnonzero(np.append(~same, True))
+    starts = np.insert(ends[:-1] + 1, 0, 0)
+    moments += x[ends] ** 2 * y[ends] - x[starts] ** 2 * y[starts]
+    return moments
+
+
+def _flatten(curves: Sequence[Curve]):
+    lengths = np.fromiter((len(curve.points) for curve in curves), dtype=np.intp, count=len(curves))
+    points = np.concatenate([curve.points for curve in curves], axis=0)
+    curve_ids = np.repeat(np.arange(len(curves)), lengths)
+    return points, curve_ids
+
+
+def layer_volumes(curves: CurvesBunch) -> Array1D:
+    """
+    :param curves: layup. The first curve is the liner
+    :return: array with the revolved volume (mm^3) of every layer, i.e., of the region between consecutive curves
+    """
+    return batch_layer_volumes([curves, ])[0]
+
+
+def batch_layer_volumes(bunches: Sequence[CurvesBunch]) -> List[Array1D]:
+    """
+    Vectorized version of layer_volumes for many layups at once. All the curves of all the layups are processed
+    in a single pass.
+    :param bunches: sequence of layups
+    :return: list with one array of layer volumes per layup
+    """
+    all_curves = [curve for bunch in bunches for curve in bunch.curves]
+    points, curve_ids = _flatten(all_curves)
+    moments = first_moments(points, curve_ids, len(all_curves))
+
+    # the layer region is the difference of the regions of consecutive curves. Shared points cancel out.
+    layer_moments = np.abs(np.diff(moments))
+    volumes = 2 * pi * layer_moments / 6.
+
+    # split per layup, discarding the differences between the last curve of a layup and the liner of the next one
+    bounds = np.cumsum([len(bunch.curves) for bunch in bunches])
+    return [volumes[start:stop - 1] for start, stop in zip(np.insert(bounds[:-1], 0, 0), bounds)]
+
+
+def layer_masses(curves: CurvesBunch, density: float = rc.LAYUP_DENSITY) -> Array1D:
+    return density * layer_volumes(curves)
+
+
+def mass_by_angle(curves: CurvesBunch, density: float = rc.LAYUP_DENSITY) -> Dict[float, float]:
+    """
+    :return: dictionary of winding angle -> total mass of the layers wound at that angle
+    """
+    angles = np.array([curve.winding_angle for curve in curves.curves[1:]], dtype=float)
+    masses = layer_masses(curves, density)
+    groups, inverse = np.unique(angles, return_inverse=True)
+    return dict(zip(groups.tolist(), np.bincount(inverse, weights=masses).tolist()))
+
+
+def composite_mass(curves: CurvesBunch, density: float = rc.LAYUP_DENSITY) -> float:
+    return float(layer_masses(curves, density).sum())
+
+
+def batch_composite_mass(bunches: Sequence[CurvesBunch], density: float = rc.LAYUP_DENSITY) -> Array1D:
+    """
+    :return: array with the total composite mass of every layup
+    """
+    return density * np.array([volumes.sum() for volumes in batch_layer_volumes(bunches)])
+
+
+def mass_deviation(curves: CurvesBunch, cae_mass: float, density: float = rc.LAYUP_DENSITY) -> float:
+    """
+    Relative deviation of the mass computed from the curves against the one measured in the CAE model,
+    e.g., the one printed by assign_property. The CAE model loses some material at the polar opening,
+    where small faces are removed, so deviations of up to about 1 % are expected.
+    :param cae_mass: mass reported by CAE for the layup part
+    :return: (mass - cae_mass) / cae_mass
+    """
+    return (composite_mass(curves, density) - cae_mass) / cae_mass
+
+
+def read_cae_mass(job_name: str, directory: str = '.') -> float:
+    """
+    :param directory: where CAE wrote the input deck of the job, see trivial.write_job and flat_build
+    :return: mass of the layup part in the CAE model, in t
+    """
+    with open(os.path.join(directory, job_name + rc.LAYUP_MASS_EXTENSION)) as file:
+        return float(file.read())
+
+
+if __name__ == "__main__":
+    import sys
+    from timeit import timeit
+    from src.thickness import main as calculate_layup
+
+    # python ./src/mass.py [job name [directory]]: compares with the mass of a CAE model of the default layup
+    layup = calculate_layup()
+    print(f"composite mass: {composite_mass(layup) * 1e3:.3f} kg")
+    for angle, mass in mass_by_angle(layup).items():
+        print(f"    {angle:>4.0f}°: {mass * 1e3:.3f} kg")
+    if len(sys.argv) > 1:
+        cae_mass = read_cae_mass(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else '.')
+        deviation = mass_deviation(layup, cae_mass)
+        print(f"CAE mass: {cae_mass * 1e3:.3f} kg, deviation {100 * deviation:+.2f} % "
+              f"({'within' if abs(deviation) <= MASS_DEVIATION_LIMIT else 'above'} "
+              f"{100 * MASS_DEVIATION_LIMIT:.0f} %)")
+
+    n = 1000
+    seconds = timeit(lambda: batch_composite_mass([layup, ] * n), number=1)
+    print(f"{n} layups in {seconds:.3f} s ({n / seconds:.0f} layups/s)")
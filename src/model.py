@@ -17,10 +17,12 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 '''
 # Import necessary objects from the typing package
-from typing import List, Optional, Tuple
-from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
 
 import numpy as np
+
+from src import geometry
 # Declare the custom type aliases
 type Array2D = np.ndarray  # Nx2 size
 type Array1D = np.ndarray  # Nx1 size
@@ -38,6 +40,8 @@ class Curve:
     _points: Array2D
     _alpha_0: Optional[float] = None
     _layer_start_index: Optional[int] = None
+    # Derived geometry, computed on first access. Cleared when the points are set
+    _cache: Dict[str, np.ndarray] = field(default_factory=dict, init=False, repr=False, compare=False)
 
     #  ## Constructors
     def __post_init__(self):
@@ -58,6 +62,7 @@ class Curve:
     @points.setter
     def points(self, value) -> None:
         self._points = value
+        self._cache.clear()
 
     @property
     def x(self) -> Array1D:
@@ -85,6 +90,38 @@ class Curve:
         self._alpha_0 = value
 
 
+    #  ## Derived geometry. See src/geometry.py. Read-only arrays: set the points to change the curve
+    def _cached(self, name: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        if name not in self._cache:
+            value = compute()
+            value.flags.writeable = False
+            self._cache[name] = value
+        return self._cache[name]
+
+    @property
+    def arclength(self) -> Array1D:
+        """ cumulative arclength from the first point """
+        return self._cached('arclength', lambda: geometry.arclength(self._points))
+
+    @property
+    def tangents(self) -> Array2D:
+        """ unit tangents, from the top of the neck downwards """
+        return self._cached('tangents', lambda: geometry.tangents(self._points))
+
+    @property
+    def normals(self) -> Array2D:
+        """ unit normals, outwards """
+        return self._cached('normals', lambda: geometry.normals(self.tangents))
+
+    @property
+    def tangent_angles(self) -> Array1D:
+        """ angle between the tangents and the y axis, in radians """
+        return self._cached('tangent_angles', lambda: geometry.tangent_angles(self.tangents))
+
+    @property
+    def curvature(self) -> Array1D:
+        return self._cached('curvature', lambda: geometry.curvature(self._points))
+
     def get_unpacked_xy(self) -> UnpackedXY:
         return self.x, self.y
 
@@ -107,12 +144,15 @@ class Curve:
             return self.points
         return self.points[:idx]
     def to_abaqus_format(self) -> AbaqusCurveFormat:
-        return tuple(zip(*self.get_layer_unpacked_xy()))
+        # plain floats: the intermediate file is the str() of these tuples, evaluated by build_model.py
+        return tuple(map(tuple, self.get_layer_points().tolist()))
 
 
 class CurvesBunch:
-    def __init__(self, initial_curve: Curve):
+    def __init__(self, initial_curve: Curve, hoop_end: Optional[float] = None):
         self._curves: List[Curve] = [initial_curve, ]
+        # y coordinate at which the hoop layers of this layup end. thickness.max_y_hoop if None
+        self.hoop_end = hoop_end
     @property
     def curves(self) -> List[Curve]: return self._curves  # readonly
 
@@ -0,0 +1,402 @@
+# coding=utf-8
+"""
+Live monitoring of Abaqus/Standard jobs
+Tails the status (.sta) and message (.msg) files of a running job, reading only what was appended since the last poll,
+and turns them into events: accepted increments, cutbacks, warnings and errors, end of the analysis.
+Abort policies look at the progress after every poll. A job that keeps cutting back its increments would otherwise run
+until MAX_NUM_INC; once a policy fires the job is terminated, which frees its cores for the next one in the queue.
+The parsing does not depend on the files: feed recorded or synthetic status text to JobMonitor.feed, or use replay.
+Run from  root '/' directory
+"""
+import asyncio
+import os
+import re
+import subprocess
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import src.routines.routine_constants as rc
+from src.pipeline import SHELL, WORK_DIR
+
+POLL_INTERVAL = 5.  # s
+STEP_PERIOD = 1.  # time period of the static step, the default of Abaqus. See trivial.py
+TERMINATE_GRACE = 30.  # s - time given to 'abaqus terminate' before the process is killed
+
+# STEP INC ATT SEVERE-DISCON-ITERS EQUIL-ITERS TOTAL-ITERS TOTAL-TIME STEP-TIME INC-TIME. U marks an attempt that did not
+# converge, after which the increment is cut back
+STATUS_LINE = re.compile(r'^\s*(\d+)\s+(\d+)\s+(\d+)(U?)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\S+)\s+(\S+)\s+(\S+)')
+COMPLETED = "THE ANALYSIS HAS COMPLETED SUCCESSFULLY"
+NOT_COMPLETED = "THE ANALYSIS HAS NOT BEEN COMPLETED"
+MESSAGE = re.compile(r'^\s*\*\*\*(WARNING|ERROR|NOTE):\s*(.*)')
+
+
+# ----- Events -----
+@dataclass
+class Increment:
+    step: int
+    increment: int
+    attempt: int
+    converged: bool  # False for an attempt that was cut back
+    severe_iterations: int
+    equilibrium_iterations: int
+    total_iterations: int
+    total_time: float
+    step_time: float
+    time_increment: float
+
+    def __str__(self) -> str:
+        state = "" if self.converged else " cut back"
+        return (f"step {self.step} increment {self.increment} attempt {self.attempt}{state}: "
+                f"step time {self.step_time:.4g}, increment {self.time_increment:.3g}")
+
+
+@dataclass
+class Message:
+    level: str  # WARNING, ERROR or NOTE
+    text: str
+
+    def __str__(self) -> str:
+        return f"{self.level}: {self.text}"
+
+
+@dataclass
+class Finished:
+    completed: bool
+
+    def __str__(self) -> str:
+        return "completed successfully" if self.completed else "not completed"
+
+
+@dataclass
+class Aborted:
+    reason: str
+
+    def __str__(self) -> str:
+        return f"aborted: {self.reason}"
+
+
+type Event = Increment | Message | Finished | Aborted
+
+
+def parse_status_line(line: str) -> Optional[Increment]:
+    """
+    :return: the increment of a line of the .sta file. None for headers and other lines
+    """
+    match = STATUS_LINE.match(line)
+    if match is None:
+        return None
+    step, increment, attempt, cutback, severe, equilibrium, total, total_time, step_time, time_increment = match.groups()
+    try:
+        return Increment(int(step), int(increment), int(attempt), cutback != 'U', int(severe), int(equilibrium),
+                         int(total), float(total_time), float(step_time), float(time_increment))
+    except ValueError:  # e.g. a line of the header that happens to start with numbers
+        return None
+
+
+# ----- Progress -----
+@dataclass
+class JobStatus:
+    started: float  # clock time of the first poll
+    now: float = 0.
+    increments: int = 0  # accepted increments
+    cutbacks: int = 0
+    consecutive_cutbacks: int = 0  # cutbacks since the last accepted increment
+    step: int = 0
+    step_time: float = 0.
+    warnings: int = 0
+    errors: int = 0
+    finished: Optional[bool] = None  # True if completed successfully, False if not. None while running
+    # (clock time, step time, time increment) of the accepted increments
+    history: List[Tuple[float, float, float]] = field(default_factory=list)
+
+    @property
+    def elapsed(self) -> float:
+        return self.now - self.started
+
+    @property
+    def progress(self) -> float:
+        """ fraction of the step time done """
+        return min(self.step_time / STEP_PERIOD, 1.)
+
+    def recent(self, window: int) -> Tuple[float, float, int]:
+        """
+        :return: wall time, step time and number of accepted increments of the last :window: increments
+        """
+        if len(self.history) < 2:
+            return 0., 0., 0
+        first, last = self.history[max(len(self.history) - window - 1, 0)], self.history[-1]
+        return last[0] - first[0], last[1] - first[1], min(window, len(self.history) - 1)
+
+
+# ----- Abort policies. Called after every poll with the status, return the reason to abort or None -----
+type Policy = Callable[[JobStatus], Optional[str]]
+
+
+@dataclass
+class CutbackLimit:
+    total: int = 50  # cutbacks in the whole job
+    consecutive: int = 4  # cutbacks of one increment. Abaqus gives up itself after 5 attempts
+
+    def __call__(self, status: JobStatus) -> Optional[str]:
+        if status.cutbacks >= self.total:
+            return f"{status.cutbacks} cutbacks"
+        if status.consecutive_cutbacks >= self.consecutive:
+            return f"{status.consecutive_cutbacks} consecutive cutbacks at step time {status.step_time:.4g}"
+        return None
+
+
+@dataclass
+class IncrementLimit:
+    """
+    Aborts when the recent increments are so small that the step would not finish within the maximum number of
+    increments, at which point Abaqus stops the job anyway
+    """
+    max_increments: int = rc.MAX_NUM_INC
+    window: int = 20  # accepted increments the rate is taken from
+
+    def __call__(self, status: JobStatus) -> Optional[str]:
+        _, advance, n = status.recent(self.window)
+        if n < self.window or advance <= 0:
+            return None
+        projected = status.increments + (STEP_PERIOD - status.step_time) * n / advance
+        if projected > self.max_increments:
+            return f"projected {projected:.0f} increments, {self.max_increments} allowed"
+        return None
+
+
+@dataclass
+class WallTimeLimit:
+    """
+    Aborts when the time to finish the step, at the rate of the recent increments, exceeds the limit
+    """
+    limit: float = 4 * 3600.  # s - wall time of the whole job
+    window: int = 10  # accepted increments the rate is taken from
+    grace: float = 300.  # s - no projection before, the first increments include the start of the solver
+
+    def __call__(self, status: JobStatus) -> Optional[str]:
+        wall, advance, n = status.recent(self.window)
+        if status.elapsed < self.grace or n < self.window or advance <= 0:
+            return None
+        projected = status.elapsed + (STEP_PERIOD - status.step_time) * wall / advance
+        if projected > self.limit:
+            return f"projected wall time {projected / 3600:.1f} h, {self.limit / 3600:.1f} h allowed"
+        return None
+
+
+DEFAULT_POLICIES: Tuple[Policy, ...] = (CutbackLimit(), IncrementLimit(), WallTimeLimit())
+
+
+# ----- Files -----
+class _Tail:
+    """
+    Text appended to a file since the last read. A file that exists when the tail is created is left out until it is
+    rewritten, e.g. the .sta of a previous run of the same job
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.pending = ''  # last, incomplete line
+        self.stale = self._stat()
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def read_lines(self) -> List[str]:
+        if self.stale is not None:
+            if self._stat() == self.stale:
+                return []
+            self.stale = None
+        try:
+            with open(self.path, 'rb') as file:
+                if os.fstat(file.fileno()).st_size < self.offset:  # rewritten from scratch
+                    self.offset, self.pending = 0, ''
+                file.seek(self.offset)
+                data = file.read()
+        except FileNotFoundError:
+            return []
+        self.offset += len(data)
+        lines = (self.pending + data.decode(errors='replace')).split('\n')
+        self.pending = lines.pop()
+        return lines
+
+
+class JobMonitor:
+    def __init__(self, job_name: str, directory: str = WORK_DIR, policies: Iterable[Policy] = DEFAULT_POLICIES,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param directory: where the job runs
+        :param clock: time source of the policies, in seconds. Replays pass a synthetic one
+        """
+        self.job_name = job_name
+        self.directory = directory
+        self.policies = list(policies)
+        self.clock = clock
+        self.status = JobStatus(started=clock())
+        self.abort_reason: Optional[str] = None
+        self._tails = (_Tail(os.path.join(directory, f"{job_name}.sta")),
+                       _Tail(os.path.join(directory, f"{job_name}.msg")))
+
+    @property
+    def done(self) -> bool:
+        return self.status.finished is not None or self.abort_reason is not None
+
+    def poll(self) -> List[Event]:
+        """
+        Reads what the job appended to its files since the last poll
+        """
+        sta, msg = self._tails
+        return self.feed(sta.read_lines(), msg.read_lines())
+
+    def feed(self, sta: Iterable[str] = (), msg: Iterable[str] = (), now: Optional[float] = None) -> List[Event]:
+        """
+        :param sta, msg: new complete lines of the status and message files
+        :param now: clock time of the lines. That of the clock if None
+        :return: events of the lines, followed by Aborted if a policy fired
+        """
+        status = self.status
+        status.now = self.clock() if now is None else now
+        events = []
+        for line in msg:
+            if (match := MESSAGE.match(line)) is not None:
+                level, text = match.groups()
+                status.warnings += level == 'WARNING'
+                status.errors += level == 'ERROR'
+                events.append(Message(level, text.strip()))
+        for line in sta:
+            if (increment := parse_status_line(line)) is not None:
+                if increment.converged:
+                    status.increments += 1
+                    status.consecutive_cutbacks = 0
+                    status.step, status.step_time = increment.step, increment.step_time
+                    status.history.append((status.now, increment.step_time, increment.time_increment))
+                else:
+                    status.cutbacks += 1
+                    status.consecutive_cutbacks += 1
+                events.append(increment)
+            elif COMPLETED in line or NOT_COMPLETED in line:
+                status.finished = COMPLETED in line
+                events.append(Finished(status.finished))
+        if status.finished is None and self.abort_reason is None:
+            for policy in self.policies:
+                if (reason := policy(status)) is not None:
+                    self.abort_reason = reason
+                    events.append(Aborted(reason))
+                    break
+        return events
+
+    def terminate(self) -> None:
+        """
+        Asks Abaqus to stop the job. The files are closed properly, the odb keeps the increments done so far
+        """
+        subprocess.run([*SHELL, f"abaqus terminate job={self.job_name}"], cwd=self.directory,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def watch(self, running: Callable[[], bool], interval: float = POLL_INTERVAL) -> Iterator[Event]:
+        """
+        Polls until the job finishes, is aborted or :running: returns False. Jobs are terminated when a policy fires
+        """
+        while True:
+            alive = running()
+            yield from self.poll()
+            if self.abort_reason is not None:
+                self.terminate()
+                return
+            if self.done or not alive:
+                return
+            time.sleep(interval)
+
+    async def supervise(self, process: asyncio.subprocess.Process, interval: float = POLL_INTERVAL,
+                        on_event: Optional[Callable[[Event], None]] = None) -> Optional[str]:
+        """
+        Polls while :process: runs the job, terminating it when a policy fires
+        :return: the reason of the abort, None if the job ran to its end
+        """
+        while True:
+            try:
+                await asyncio.wait_for(process.wait(), interval)
+                alive = False
+            except asyncio.TimeoutError:
+                alive = True
+            for event in self.poll():
+                if on_event is not None:
+                    on_event(event)
+            if self.abort_reason is not None:
+                await asyncio.to_thread(self.terminate)
+                try:
+                    await asyncio.wait_for(process.wait(), TERMINATE_GRACE)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                return self.abort_reason
+            if not alive:
+                return None
+
+
+def replay(sta: Iterable[str], msg: Iterable[str] = (), policies: Iterable[Policy] = DEFAULT_POLICIES,
+           seconds_per_line: float = 60.) -> Tuple[List[Event], JobStatus]:
+    """
+    Feeds a recorded or synthetic status file line by line, as if every line took :seconds_per_line: to appear
+    :param msg: lines of the message file, fed at once at the start
+    :return: the events up to the end of the job or to the abort, and the final status
+    """
+    monitor = JobMonitor('replay', policies=policies, clock=lambda: 0.)
+    events = monitor.feed(msg=msg, now=0.)
+    for i, line in enumerate(sta):
+        if monitor.done:
+            break
+        events += monitor.feed(sta=[line], now=i * seconds_per_line)
+    return events, monitor.status
+
+
+def synthetic_status(healthy: int = 20, diverging: bool = True, time_increment: float = rc.INITIAL_INC) -> List[str]:
+    """
+    :param healthy: increments that converge at the first attempt before the trouble starts
+    :param diverging: cut back every increment by 4 after the healthy ones, as a job that lost convergence
+    :return: lines of a .sta file
+    """
+    lines = [" SUMMARY OF JOB INFORMATION:",
+             " STEP  INC ATT SEVERE EQUIL TOTAL  TOTAL      STEP       INC OF       DOF    IF",
+             "               DISCON ITERS ITERS  TIME/    TIME/LPF    TIME/LPF    MONITOR RIKS",
+             "               ITERS               FREQ"]
+    step_time, increment = 0., 0
+    while step_time < STEP_PERIOD - 1e-12 and increment < rc.MAX_NUM_INC:
+        increment += 1
+        attempt = 1
+        if diverging and increment > healthy:
+            lines.append(f"   1 {increment:5d} {attempt:3d}U   0    12    12  {step_time:.4e}  {step_time:.4e}  "
+                         f"{time_increment:.4e}")
+            time_increment /= 4
+            attempt += 1
+        time_increment = min(time_increment, STEP_PERIOD - step_time)
+        step_time += time_increment
+        lines.append(f"   1 {increment:5d} {attempt:3d}     0     4     4  {step_time:.4e}  {step_time:.4e}  "
+                     f"{time_increment:.4e}")
+        if not diverging:
+            time_increment = min(time_increment * 1.5, rc.MAX_INC)
+    lines.append(" THE ANALYSIS HAS " + ("COMPLETED SUCCESSFULLY" if step_time >= STEP_PERIOD - 1e-12
+                                         else "NOT BEEN COMPLETED"))
+    return lines
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Replays a recorded job, python ./src/monitor.py temp/Job-1, or a healthy and a diverging synthetic job
+    if len(sys.argv) > 1:
+        files = {}
+        for extension in ('sta', 'msg'):
+            path = f"{sys.argv[1]}.{extension}"
+            with open(path) if os.path.exists(path) else open(os.devnull) as fh:
+                files[extension] = fh.read().splitlines()
+        jobs = {sys.argv[1]: (files['sta'], files['msg'])}
+    else:
+        jobs = {'healthy': (synthetic_status(diverging=False), []), 'diverging': (synthetic_status(), [])}
+    for name, (sta_lines, msg_lines) in jobs.items():
+        replayed, final = replay(sta_lines, msg_lines)
+        print(f"{name}: {final.increments} increments, {final.cutbacks} cutbacks, step time {final.step_time:.4g} "
+              f"-> {replayed[-1]}")
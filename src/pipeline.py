@@ -0,0 +1,411 @@
+# coding=utf-8
+"""
+Asynchronous batch pipeline
+Runs many designs through the stages geometry -> CAE build -> solve -> extraction.
+Stages are connected by bounded queues: a stage that is ahead blocks as soon as the next queue is full (backpressure),
+while the geometry of the next designs is computed while the previous ones are inside CAE or the solver.
+Each stage has its own concurrency limit, e.g., number of CAE licenses or of simultaneous solver jobs.
+Run from  root '/' directory
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import src.routines.routine_constants as rc
+from model import CurvesBunch
+from src.liner import LinerParameters
+
+# Directory where CAE and the solver run, relative to the root directory. See main.py
+WORK_DIR = './temp'
+# Commands are run through a shell, as in main.py
+SHELL = ['powershell'] if os.name == 'nt' else ['sh', '-c']
+SOLVER_CPUS = 8
+# Queue directory of the persistent CAE workers, relative to WORK_DIR. See build_model.py
+WORKER_QUEUE = 'queue'
+WORKER_POLL_INTERVAL = 0.5  # s
+WORKER_TIMEOUT = 3600.  # s a design may spend in the queue and in the worker before it is failed
+
+
+@dataclass
+class Design:
+    design_id: str
+    angles: List[float]
+    liner: Optional[LinerParameters] = None  # /resources/liner.csv if None
+    sublaminate_tolerance: Optional[float] = None  # group the layers in sublaminates, see src/sublaminates.py
+    block_tolerance: Optional[float] = None  # stack runs of identical angles in blocks, see thickness.stack_blocks
+    sliver_tolerance: Optional[float] = None  # remove thinner layer tails before the export, see src/slivers.py
+    curves: Optional[CurvesBunch] = None
+    artifacts: Dict[str, str] = field(default_factory=dict)  # kind -> path relative to the root directory
+    kpis: Dict[str, float] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)  # stage name -> seconds
+    error: Optional[str] = None
+
+    @property
+    def job_name(self) -> str:
+        return f"job_{self.design_id}"
+
+
+type StageFunction = Callable[[Design], Union[Design, Awaitable[Design]]]
+
+
+@dataclass
+class Stage:
+    name: str
+    func: StageFunction  # coroutine function, or plain function if an executor is given
+    concurrency: int = 1
+    queue_size: int = 2  # size of the input queue of the stage
+    executor: Optional[Executor] = None  # where plain functions are run. Must be picklable for process pools
+    owns_executor: bool = False  # the executor was created for the stages and is shut down with the pipeline
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    concurrency: int
+    processed: int = 0
+    failed: int = 0
+    busy: float = 0.  # summed processing time of all workers
+    waiting: float = 0.  # summed time blocked on a full output queue
+    first_start: Optional[float] = None
+    last_end: Optional[float] = None
+
+    @property
+    def span(self) -> float:
+        if self.first_start is None:
+            return 0.
+        return self.last_end - self.first_start
+
+    @property
+    def throughput(self) -> float:
+        """ designs per second while the stage was active """
+        return self.processed / self.span if self.span > 0 else 0.
+
+    @property
+    def utilization(self) -> float:
+        return self.busy / (self.span * self.concurrency) if self.span > 0 else 0.
+
+    def __str__(self) -> str:
+        return (f"{self.name:<10} x{self.concurrency:<3} done {self.processed:>5} failed {self.failed:>4} "
+                f"| {self.throughput:8.3f} designs/s | busy {self.busy:9.1f} s "
+                f"| blocked {self.waiting:8.1f} s | utilization {self.utilization:6.1%}")
+
+
+_DONE = None  # sentinel closing a queue
+
+
+class Pipeline:
+    """
+    Use as context manager: the executors owned by the stages are shut down on exit, e.g. the process pool of
+    default_stages. Executors passed in by the caller are left running
+    """
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self.metrics = [StageMetrics(stage.name, stage.concurrency) for stage in stages]
+
+    def __enter__(self) -> 'Pipeline':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for executor in {id(stage.executor): stage.executor for stage in self.stages if stage.owns_executor}.values():
+            executor.shutdown()
+
+    async def _process(self, stage: Stage, design: Design) -> Design:
+        if stage.executor is None:
+            return await stage.func(design)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(stage.executor, stage.func, design)
+
+    async def _worker(self, stage: Stage, metrics: StageMetrics, inbox: asyncio.Queue, outbox: asyncio.Queue):
+        while (design := await inbox.get()) is not _DONE:
+            if design.error is None:  # failed designs are passed through untouched
+                start = time.perf_counter()
+                metrics.first_start = start if metrics.first_start is None else metrics.first_start
+                try:
+                    design = await self._process(stage, design)
+                except Exception as error:
+                    design.error = f"{stage.name}: {error!r}"
+                    metrics.failed += 1
+                else:
+                    metrics.processed += 1
+                end = time.perf_counter()
+                design.timings[stage.name] = end - start
+                metrics.busy += end - start
+                metrics.last_end = end
+            start = time.perf_counter()
+            await outbox.put(design)  # blocks while the next stage is saturated
+            metrics.waiting += time.perf_counter() - start
+
+    async def run(self, designs: Iterable[Design]) -> List[Design]:
+        queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        queues.append(asyncio.Queue())  # results, unbounded
+        results = []
+
+        async def feed():
+            for design in designs:
+                await queues[0].put(design)
+            for _ in range(self.stages[0].concurrency):
+                await queues[0].put(_DONE)
+
+        async def run_stage(i: int):
+            stage = self.stages[i]
+            workers = [self._worker(stage, self.metrics[i], queues[i], queues[i + 1]) for _ in range(stage.concurrency)]
+            await asyncio.gather(*workers)
+            # close the next queue once every worker of this stage is done
+            closing = self.stages[i + 1].concurrency if i + 1 < len(self.stages) else 1
+            for _ in range(closing):
+                await queues[i + 1].put(_DONE)
+
+        async def collect():
+            while (design := await queues[-1].get()) is not _DONE:
+                results.append(design)
+
+        await asyncio.gather(feed(), collect(), *(run_stage(i) for i in range(len(self.stages))))
+        return results
+
+    def report(self) -> str:
+        return "\n".join(str(metrics) for metrics in self.metrics)
+
+
+# ----- Default stages -----
+
+def compute_geometry(design: Design) -> Design:
+    # thickness relies on module globals, hence it must run in a process, not a thread
+    from src.thickness import main as calculate_layup
+    from src.liner import generate_liner
+    from src.stacking import shared_workspace
+    liner = None if design.liner is None else generate_liner(design.liner)
+    # the buffers of the stacking kernel are reused by all the designs of the process
+    design.curves = calculate_layup(design.angles, liner, design.block_tolerance, shared_workspace(), verbose=False)
+    if design.sliver_tolerance is not None:
+        from src.slivers import merge_slivers
+        result = merge_slivers(design.curves, design.sliver_tolerance)
+        design.curves = result.curves
+        design.kpis['sliver_area'] = result.removed_area
+        design.kpis['sliver_moved_area'] = float(abs(result.moved_areas).sum())
+    return design
+
+
+def interchange(design: Design) -> str:
+    """
+    :return: content of the intermediate file of build_model.py
+    """
+    if design.sublaminate_tolerance is None:
+        return str(design.curves.to_abaqus_format())
+    from src.sublaminates import sublaminates
+    return str(sublaminates(design.curves, design.sublaminate_tolerance).interchange())
+
+
+async def _run_command(command: str, cwd: str = WORK_DIR) -> None:
+    process = await asyncio.create_subprocess_exec(*SHELL, command, cwd=cwd,
+                                                   stdout=asyncio.subprocess.DEVNULL,
+                                                   stderr=asyncio.subprocess.DEVNULL)
+    if (code := await process.wait()) != 0:
+        raise RuntimeError(f"'{command}' exited with code {code}")
+
+
+async def build_model(design: Design) -> Design:
+    # Write the intermediate file of this design and build the input deck, without submitting
+    filename = f"{design.job_name}.txt"
+    with open(os.path.join(WORK_DIR, filename), "w") as file:
+        file.write(interchange(design))
+    await _run_command(f"abaqus cae noGUI=../src/build_model.py -- {filename} {design.job_name} --no-submit")
+    design.artifacts['interchange'] = os.path.join(WORK_DIR, filename)
+    design.artifacts['input'] = os.path.join(WORK_DIR, f"{design.job_name}.inp")
+    return design
+
+
+async def build_model_with_worker(design: Design, queue_dir: str = WORKER_QUEUE,
+                                  timeout: float = WORKER_TIMEOUT) -> Design:
+    """
+    Alternative to build_model for persistent CAE workers, started from WORK_DIR as
+    abaqus cae noGUI=../src/build_model.py -- --worker queue --no-submit
+    The intermediate file is dropped in the queue and the stage waits for a worker to process it. The design fails if
+    no worker has finished it within :timeout: seconds, e.g. because none is running. Claims of workers that died are
+    put back in the queue by the other workers, see build_model.recover
+    """
+    queue = os.path.join(WORK_DIR, queue_dir)
+    os.makedirs(queue, exist_ok=True)
+    path = os.path.join(queue, f"{design.job_name}.txt")
+    with open(path + '.tmp', "w") as file:
+        file.write(interchange(design))
+    os.replace(path + '.tmp', path)  # only complete files are visible to the workers
+
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path + '.done'):
+        if os.path.exists(path + '.failed'):
+            with open(os.path.join(queue, f"{design.job_name}.err")) as file:
+                raise RuntimeError(file.read())
+        if time.monotonic() > deadline:
+            try:
+                os.remove(path)  # withdrawn unless a worker has claimed it meanwhile
+            except FileNotFoundError:
+                pass
+            raise TimeoutError(f"no CAE worker finished {design.job_name} within {timeout:.0f} s")
+        await asyncio.sleep(WORKER_POLL_INTERVAL)
+    design.artifacts['interchange'] = path + '.done'
+    design.artifacts['input'] = os.path.join(WORK_DIR, f"{design.job_name}.inp")
+    return design
+
+
+async def build_flat_model(design: Design) -> Design:
+    """
+    Alternative to build_model: the pick points, splines and orientation tables are computed on the host, and CAE only
+    replays the calls of a flat build script, see src/flat_build.py. The time CAE spends in Python is recorded as the
+    KPI cae_python_time
+    """
+    from src.flat_build import read_timings, write_script
+    if design.sublaminate_tolerance is None:
+        lines, angles, materials = design.curves.to_abaqus_format(), design.angles, None
+    else:
+        from src.sublaminates import sublaminates
+        result = sublaminates(design.curves, design.sublaminate_tolerance)
+        lines, angles, materials = result.curves.to_abaqus_format(), result.angles, result.properties
+    script = f"build_{design.job_name}.py"
+    await asyncio.to_thread(write_script, os.path.join(WORK_DIR, script), lines, angles, materials, design.job_name,
+                            False)
+    await _run_command(f"abaqus cae noGUI={script}")
+    design.artifacts['build_script'] = os.path.join(WORK_DIR, script)
+    design.artifacts['input'] = os.path.join(WORK_DIR, f"{design.job_name}.inp")
+    design.kpis['cae_python_time'] = read_timings(design.job_name, WORK_DIR)['total']
+    return design
+
+
+async def solve(design: Design) -> Design:
+    """
+    Runs the job while a monitor follows its status file. Diverging jobs are aborted, see src/monitor.py
+    """
+    from src.monitor import JobMonitor
+    name = design.job_name
+    monitor = JobMonitor(name, WORK_DIR)
+    command = f"abaqus job={name} input={name}.inp cpus={SOLVER_CPUS} interactive"
+    process = await asyncio.create_subprocess_exec(*SHELL, command, cwd=WORK_DIR,
+                                                   stdout=asyncio.subprocess.DEVNULL,
+                                                   stderr=asyncio.subprocess.DEVNULL)
+    reason = await monitor.supervise(process)
+    for extension in ('odb', 'sta', 'msg', 'dat'):
+        design.artifacts[extension] = os.path.join(WORK_DIR, f"{name}.{extension}")
+    design.kpis['increments'] = monitor.status.increments
+    design.kpis['cutbacks'] = monitor.status.cutbacks
+    if reason is not None:
+        raise RuntimeError(f"'{command}' aborted: {reason}")
+    if process.returncode != 0:
+        raise RuntimeError(f"'{command}' exited with code {process.returncode}")
+    return design
+
+
+def extract_results(design: Design) -> Design:
+    from src.mass import MASS_DEVIATION_LIMIT, composite_mass, mass_deviation, read_cae_mass
+    with open(design.artifacts['sta']) as file:
+        completed = "COMPLETED SUCCESSFULLY" in file.read()
+    design.kpis['completed'] = float(completed)
+    design.kpis['mass'] = composite_mass(design.curves)
+    # the mass computed from the curves against the one of the CAE model
+    design.kpis['cae_mass'] = read_cae_mass(design.job_name, WORK_DIR)
+    design.kpis['mass_deviation'] = mass_deviation(design.curves, design.kpis['cae_mass'])
+    design.kpis['mass_validated'] = float(abs(design.kpis['mass_deviation']) <= MASS_DEVIATION_LIMIT)
+    return design
+
+
+def solve_native(design: Design) -> Design:
+    """
+    Replaces the CAE, solve and extract stages with the built-in solver, without Abaqus. See src/axisymmetric.py
+    The unit pressure is solved once and scaled to LOAD_MAG and to the pressure cases of src/load_cases.py
+    """
+    from src.load_cases import LoadCases, PRESSURE, pressure_kpis
+    from src.mass import composite_mass
+    cases = LoadCases.from_native(design.curves)
+    nominal = {PRESSURE: rc.LOAD_MAG}
+    stresses = cases.field('material_stresses', nominal)
+    failure = cases.failure(nominal, criteria=('puck', ))
+    design.kpis['completed'] = 1.
+    design.kpis['mass'] = composite_mass(design.curves)
+    design.kpis['max_u_r'] = float(cases.field('displacements', nominal)[:, 0].max())
+    design.kpis['max_fiber_stress'] = float(stresses[:, 0].max())
+    design.kpis['max_transverse_stress'] = float(stresses[:, 1].max())
+    design.kpis['reserve_factor'] = float(failure.reserve_factors['puck'].min())
+    design.kpis['margin'] = design.kpis['reserve_factor'] - 1.
+    design.kpis['burst_pressure'] = failure.burst_pressure('puck')
+    design.kpis.update(pressure_kpis(cases))
+    return design
+
+
+def default_stages(geometry_workers: int = os.cpu_count(), cae_licenses: int = 2, solver_jobs: int = 1,
+                   executor: Optional[Executor] = None, cae_workers: bool = False,
+                   flat_scripts: bool = False) -> List[Stage]:
+    """
+    :param geometry_workers: number of simultaneous layup calculations
+    :param cae_licenses: number of simultaneous CAE sessions
+    :param solver_jobs: number of simultaneous solver jobs, each using SOLVER_CPUS
+    :param executor: process pool for the host-side stages
+    :param cae_workers: hand the designs to persistent CAE workers instead of starting one CAE session per design.
+        cae_licenses workers must be running
+    :param flat_scripts: build every model from a flat script generated on the host, see build_flat_model
+    """
+    owned = executor is None
+    executor = ProcessPoolExecutor(geometry_workers) if owned else executor
+    return [
+        Stage('geometry', compute_geometry, geometry_workers, queue_size=2 * geometry_workers, executor=executor,
+              owns_executor=owned),
+        Stage('cae', build_model_with_worker if cae_workers else build_flat_model if flat_scripts else build_model,
+              cae_licenses, queue_size=cae_licenses),
+        Stage('solve', solve, solver_jobs, queue_size=solver_jobs),
+        Stage('extract', extract_results, 1, queue_size=4, executor=executor, owns_executor=owned),
+    ]
+
+
+def native_stages(geometry_workers: int = os.cpu_count(), solver_workers: int = os.cpu_count(),
+                  executor: Optional[Executor] = None) -> List[Stage]:
+    """
+    Stages of the built-in solver. Every stage runs in the process pool
+    """
+    owned = executor is None
+    executor = ProcessPoolExecutor(max(geometry_workers, solver_workers)) if owned else executor
+    return [
+        Stage('geometry', compute_geometry, geometry_workers, queue_size=2 * geometry_workers, executor=executor,
+              owns_executor=owned),
+        Stage('native', solve_native, solver_workers, queue_size=solver_workers, executor=executor,
+              owns_executor=owned),
+    ]
+
+
+def order_for_updates(designs: Iterable[Design]) -> List[Design]:
+    """
+    Sorts the designs by stacking sequence: consecutive designs share their lowest layers, which CAE workers started
+    with --update keep instead of rebuilding them. See build_model.py
+    """
+    return sorted(designs, key=lambda design: (design.liner is not None, str(design.liner), list(design.angles)))
+
+
+def run_batch(designs: Iterable[Design], stages: Optional[List[Stage]] = None,
+              registry: Optional[str] = None) -> Tuple[List[Design], Pipeline]:
+    """
+    :param stages: the process pools they own are shut down when the batch is done, see Pipeline
+    :param registry: path of the run registry where the results are recorded, see src/registry.py
+    """
+    with Pipeline(default_stages() if stages is None else stages) as pipeline:
+        results = asyncio.run(pipeline.run(designs))
+    if registry is not None:
+        from src.registry import RunRegistry
+        RunRegistry(registry).record_many(results)
+    return results, pipeline
+
+
+if __name__ == "__main__":
+    import csv
+    import sys
+
+    # One stacking sequence per row, in the format of design_variables' variant 4. Optionally, path of the run registry
+    with open(sys.argv[1]) as fh:
+        sequences = [[int(angle.strip()) for angle in row] for row in csv.reader(fh) if row]
+
+    results, pipeline = run_batch((Design(f"{i:05d}", angles) for i, angles in enumerate(sequences)),
+                                  registry=sys.argv[2] if len(sys.argv) > 2 else None)
+    for design in results:
+        print(design.design_id, design.error or design.kpis)
+    print(pipeline.report())
@@ -0,0 +1,340 @@
+# coding=utf-8
+"""
+Run registry
+Local SQLite database of the designs that went through the pipeline: design hash, angle sequence, snapshot of
+design_variables and routine_constants, stage timings, artifact paths and KPIs. Each run is one row of runs; the angle
+counts, KPIs, timings and artifacts are (run, name, value) rows with indexes on (name, value), so that queries such as
+"lightest design with a margin above X and at most 6 layers at 15°" only touch the matching rows.
+The database is in WAL mode: readers do not block the writer, and the workers of a process pool can record their
+designs at the same time, every write being one short transaction.
+Run from  root '/' directory
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import src.design_variables as dv
+import src.routines.routine_constants as rc
+from src.pipeline import Design
+
+BUSY_TIMEOUT = 60.  # s - how long a writer waits for the lock held by another process
+# (min, max) bounds of a query, inclusive. None for an open bound
+type Bounds = Tuple[Optional[float], Optional[float]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    hash TEXT PRIMARY KEY,
+    design_variables TEXT NOT NULL,
+    routine_constants TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    design_hash TEXT NOT NULL,
+    design_id TEXT NOT NULL,
+    angles TEXT NOT NULL,
+    n_layers INTEGER NOT NULL,
+    liner TEXT,
+    sublaminate_tolerance REAL,
+    snapshot TEXT NOT NULL REFERENCES snapshots (hash),
+    error TEXT,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_design_hash ON runs (design_hash);
+CREATE INDEX IF NOT EXISTS runs_design_id ON runs (design_id);
+CREATE TABLE IF NOT EXISTS angle_counts (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    angle REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (run, angle)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS angle_counts_angle ON angle_counts (angle, count, run);
+CREATE TABLE IF NOT EXISTS kpis (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS kpis_name ON kpis (name, value, run);
+CREATE TABLE IF NOT EXISTS timings (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (run, stage)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS artifacts (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (run, kind)
+) WITHOUT ROWID;
+"""
+
+
+def _constants(module) -> Dict:
+    """
+    :return: public constants of a module: numbers, strings and booleans, and tuples of them
+    """
+    def plain(value) -> bool:
+        if isinstance(value, tuple):
+            return all(plain(item) for item in value)
+        return isinstance(value, (bool, int, float, str))
+    return {name: value for name, value in sorted(vars(module).items()) if not name.startswith('_') and plain(value)}
+
+
+def snapshot() -> Tuple[str, str, str]:
+    """
+    :return: hash, design_variables and routine_constants of the current process, as json
+    """
+    design_variables = json.dumps(_constants(dv), sort_keys=True)
+    routine_constants = json.dumps(_constants(rc), sort_keys=True)
+    digest = hashlib.sha1((design_variables + routine_constants).encode()).hexdigest()[:16]
+    return digest, design_variables, routine_constants
+
+
+def design_hash(design: Design, snapshot_hash: str) -> str:
+    """
+    :return: key of everything the results of a design depend on. Equal for reruns of the same design
+    """
+    key = json.dumps([[float(angle) for angle in design.angles],
+                      None if design.liner is None else asdict(design.liner),
+                      design.sublaminate_tolerance, design.block_tolerance, design.sliver_tolerance, snapshot_hash],
+                     sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+@dataclass
+class Run:
+    id: int
+    design_id: str
+    design_hash: str
+    angles: List[float]
+    error: Optional[str] = None
+    kpis: Dict[str, float] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    artifacts: Dict[str, str] = field(default_factory=dict)
+
+
+class RunRegistry:
+    def __init__(self, path: str):
+        """
+        Opens the registry at :path:, creating it if needed. Every process opens its own connection on first use,
+        hence the registry can be passed to the workers of a process pool
+        """
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self.connection.executescript(SCHEMA)  # a transaction of its own
+
+    def __getstate__(self) -> Dict:
+        return {'path': self.path}
+
+    def __setstate__(self, state: Dict) -> None:
+        self.path, self._connection, self._pid = state['path'], None, None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():  # connections must not cross a fork
+            self._connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")  # durable at every checkpoint, enough in WAL mode
+            self._connection.execute("PRAGMA foreign_keys = ON")
+            self._pid = os.getpid()
+        return self._connection
+
+    def close(self) -> None:
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self.connection
+        # take the write lock at the start: a deferred transaction may fail to upgrade its lock with several writers
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    # ----- Writing -----
+    def record(self, design: Design) -> int:
+        """
+        :return: id of the new run
+        """
+        return self.record_many([design, ])[0]
+
+    def record_many(self, designs: Iterable[Design]) -> List[int]:
+        """
+        Records several designs in a single transaction
+        :return: ids of the new runs
+        """
+        snapshot_hash, design_variables, routine_constants = snapshot()
+        recorded = time.time()
+        ids = []
+        with self._transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO snapshots VALUES (?, ?, ?)",
+                               (snapshot_hash, design_variables, routine_constants))
+            for design in designs:
+                angles = [float(angle) for angle in design.angles]
+                liner = None if design.liner is None else json.dumps(asdict(design.liner), sort_keys=True)
+                run = connection.execute(
+                    "INSERT INTO runs (design_hash, design_id, angles, n_layers, liner, sublaminate_tolerance, "
+                    "snapshot, error, recorded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (design_hash(design, snapshot_hash), design.design_id, json.dumps(angles), len(angles), liner,
+                     design.sublaminate_tolerance, snapshot_hash, design.error, recorded)).lastrowid
+                connection.executemany("INSERT INTO angle_counts VALUES (?, ?, ?)",
+                                       ((run, angle, count) for angle, count in Counter(angles).items()))
+                connection.executemany("INSERT INTO kpis VALUES (?, ?, ?)",
+                                       ((run, name, value) for name, value in design.kpis.items()))
+                connection.executemany("INSERT INTO timings VALUES (?, ?, ?)",
+                                       ((run, stage, seconds) for stage, seconds in design.timings.items()))
+                connection.executemany("INSERT INTO artifacts VALUES (?, ?, ?)",
+                                       ((run, kind, path) for kind, path in design.artifacts.items()))
+                ids.append(run)
+        return ids
+
+    # ----- Reading -----
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT count(*) FROM runs").fetchone()[0]
+
+    def find(self, design: Design) -> List[int]:
+        """
+        :return: ids of the previous runs of :design: with the current constants, e.g. to skip it in a sweep
+        """
+        key = design_hash(design, snapshot()[0])
+        return [row[0] for row in self.connection.execute("SELECT id FROM runs WHERE design_hash = ?", (key,))]
+
+    def query(self, kpis: Optional[Dict[str, Bounds]] = None, angle_counts: Optional[Dict[float, Bounds]] = None,
+              order_by: Optional[str] = None, descending: bool = False, limit: Optional[int] = None,
+              include_failed: bool = False) -> List[Run]:
+        """
+        :param kpis: name -> bounds of its value. Runs without the KPI do not match
+        :param angle_counts: winding angle -> bounds of the number of layers at that angle. Missing angles count 0
+        :param order_by: KPI to sort by. Runs without it are not returned
+        :param limit: maximum number of runs returned
+        :param include_failed: return the runs that raised in a stage as well
+        :return: matching runs, with their KPIs, timings and artifacts
+        """
+        joins, conditions, parameters, order = [], [], [], "runs.id"
+
+        def between(column: str, bounds: Bounds) -> str:
+            parts = []
+            for operator, bound in zip(('>=', '<='), bounds):
+                if bound is not None:
+                    parts.append(f"{column} {operator} ?")
+                    parameters.append(bound)
+            return " AND ".join(parts) or "1"
+
+        if order_by is not None:
+            joins.append("JOIN kpis AS sort ON sort.run = runs.id AND sort.name = ?")
+            parameters.append(order_by)
+            order = f"sort.value {'DESC' if descending else 'ASC'}, runs.id"
+        if not include_failed:
+            conditions.append("runs.error IS NULL")
+        for name, bounds in (kpis or {}).items():
+            parameters.append(name)
+            conditions.append(f"runs.id IN (SELECT run FROM kpis WHERE name = ? AND {between('value', bounds)})")
+        for angle, bounds in (angle_counts or {}).items():
+            parameters.append(float(angle))
+            low, high = bounds
+            if low is None or low <= 0:  # designs without the angle match as well: exclude those outside the bounds
+                condition = f"NOT ({between('count', bounds)})"
+                conditions.append(f"runs.id NOT IN (SELECT run FROM angle_counts WHERE angle = ? AND {condition})")
+            else:
+                conditions.append(f"runs.id IN (SELECT run FROM angle_counts WHERE angle = ? AND "
+                                  f"{between('count', bounds)})")
+        sql = (f"SELECT runs.id, runs.design_id, runs.design_hash, runs.angles, runs.error FROM runs {' '.join(joins)}"
+               f" WHERE {' AND '.join(conditions) or '1'} ORDER BY {order}")
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        runs = [Run(run, design_id, key, json.loads(angles), error)
+                for run, design_id, key, angles, error in self.connection.execute(sql, parameters)]
+        self._fill(runs)
+        return runs
+
+    def best(self, kpi: str, maximize: bool = False, **kwargs) -> Optional[Run]:
+        """
+        :param kwargs: constraints, see query
+        :return: run with the lowest, or highest, value of :kpi:. None if no run matches
+        """
+        runs = self.query(order_by=kpi, descending=maximize, limit=1, **kwargs)
+        return runs[0] if runs else None
+
+    def _fill(self, runs: List[Run]) -> None:
+        if not runs:
+            return
+        by_id = {run.id: run for run in runs}
+        ids = ",".join(str(run) for run in by_id)
+        for table, attribute in (('kpis', 'kpis'), ('timings', 'timings'), ('artifacts', 'artifacts')):
+            for run, name, value in self.connection.execute(f"SELECT * FROM {table} WHERE run IN ({ids})"):
+                getattr(by_id[run], attribute)[name] = value
+
+    def snapshot(self, run: int) -> Tuple[Dict, Dict]:
+        """
+        :return: design_variables and routine_constants recorded with :run:
+        """
+        design_variables, routine_constants = self.connection.execute(
+            "SELECT design_variables, routine_constants FROM snapshots JOIN runs ON runs.snapshot = snapshots.hash "
+            "WHERE runs.id = ?", (run,)).fetchone()
+        return json.loads(design_variables), json.loads(routine_constants)
+
+
+def _record_worker(args) -> int:
+    registry, designs = args
+    return len(registry.record_many(designs))
+
+
+if __name__ == "__main__":
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+
+    import numpy as np
+
+    # Benchmark: python ./src/registry.py [number of designs] [registry path]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join('.', 'temp', 'benchmark.sqlite')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    registry = RunRegistry(path)
+
+    rng = np.random.default_rng(0)
+    options = [15, 20, 30, 40, 50, 60, 70, 90]
+
+    def random_design(i: int) -> Design:
+        angles = list(rng.choice(options, rng.integers(20, 45)))
+        design = Design(f"{i:06d}", angles)
+        design.kpis = {'completed': 1., 'mass': float(rng.normal(12., 1.)), 'margin': float(rng.normal(1.5, 0.3))}
+        design.timings = {'geometry': float(rng.random()), 'cae': 60 * float(rng.random())}
+        design.artifacts = {'input': f"./temp/{design.job_name}.inp"}
+        return design
+
+    designs = [random_design(i) for i in range(n)]
+    start = time.perf_counter()
+    for chunk in range(0, n, 1000):
+        registry.record_many(designs[chunk:chunk + 1000])
+    elapsed = time.perf_counter() - start
+    print(f"bulk insert: {n / elapsed:.0f} designs/s")
+
+    chunks = [(registry, designs[i:i + 10]) for i in range(0, n // 10, 10)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor() as executor:
+        recorded = sum(executor.map(_record_worker, chunks))
+    elapsed = time.perf_counter() - start
+    print(f"concurrent inserts of 10 designs: {recorded / elapsed:.0f} designs/s, {len(registry)} runs stored")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        best = registry.best('mass', kpis={'margin': (2., None)}, angle_counts={15: (None, 6)})
+    elapsed = time.perf_counter() - start
+    print(f"lightest design with margin >= 2 and at most 6 layers at 15 deg: {best.design_id}, "
+          f"mass {best.kpis['mass']:.2f} kg, {elapsed * 10:.2f} ms per query")
@@ -0,0 +1,152 @@
+# coding=utf-8
+"""
+Headless batch rendering of layup reports
+Draws the same three plots as thickness.py's standalone mode (stacked layers, thickness of helical layers and of hoop
+layers) for many layups, without pyplot and its global figures. Every figure is drawn by the Agg canvas, with all of
+its layers in a single LineCollection, and the layups are distributed over a process pool.
+Run from  root '/' directory
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+import src.thickness as th
+from model import CurvesBunch
+
+FORMATS = ('png',)
+DPI = 100
+# globals of the thickness module that thickness_profiles sets, see thickness.define_global_variables
+LAYER_GLOBALS = ('R', 'r_0', 'm_R', 'm_0', 'r_b', 'r_2b', 'n_R', 'alpha_0', 'angle_deg', 'polynomial_1')
+
+
+def _new_figure(title: str, x_label: str, y_label: str):
+    figure = Figure(figsize=(8, 6), dpi=DPI)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    figure.suptitle(title, fontsize=16)
+    ax.set_xlabel(x_label)
+    ax.set_ylabel(y_label)
+    return figure, ax
+
+
+def _add_lines(ax, segments: List[np.ndarray], **kwargs) -> None:
+    if not segments:
+        return
+    ax.add_collection(LineCollection(segments, **kwargs))
+    ax.autoscale_view()
+
+
+@contextmanager
+def _kept_layer_globals():
+    """ restores the layer globals of the thickness module on exit, e.g. those of the layup held by the controller """
+    saved = {name: getattr(th, name) for name in LAYER_GLOBALS}
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(th, name, value)
+
+
+def thickness_profiles(curves: CurvesBunch) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    The thickness module is left as it was: its layer globals are restored afterwards
+    :return: (radius, thickness) profiles of the helical layers and (axial coordinate, thickness) profiles of the hoop
+    layers, evaluated on the layer points as in thickness.update_layup_graph. The hoop layers end at the hoop end of
+    the layup, see CurvesBunch.hoop_end
+    """
+    helical, hoop = [], []
+    with _kept_layer_globals():
+        th.R = curves.curves[0].x.max()
+        for curve in curves.curves[1:]:
+            x, y = curve.get_layer_unpacked_xy()
+            th.define_global_variables(curve.winding_angle)
+            if curve.winding_angle == 90:
+                hoop.append(np.column_stack((y, th.thickness_hoop(y, y_start=curves.hoop_end))))
+            else:
+                helical.append(np.column_stack((x, th.thickness(x))))
+    return helical, hoop
+
+
+def render_layup(curves: CurvesBunch, prefix: str, formats: Sequence[str] = FORMATS) -> List[str]:
+    """
+    :param prefix: path and name of the files without extension. Suffixes _layup, _helical and _hoop are appended.
+    :return: list of the written files
+    """
+    layers = [curve.get_layer_points() for curve in curves.curves[1:]]
+    colors = [f"C{i % 10}" for i in range(len(layers))]
+    helical, hoop = thickness_profiles(curves)
+
+    figure, ax = _new_figure('Plot of the stacked layers', 'radial coordinate -- x (mm)', 'axial coordinate -- y (mm)')
+    liner = curves.curves[0]
+    ax.plot(liner.x, liner.y, c="k", label='Liner outer shape')
+    _add_lines(ax, layers, colors=colors, linewidths=1)
+    figures = [('layup', figure)]
+
+    figure, ax = _new_figure('Thickness progression at different winding angles',
+                             'radial coordinate (mm)', 'thickness(mm)')
+    _add_lines(ax, helical, colors=colors[:len(helical)], linewidths=1)
+    figures.append(('helical', figure))
+
+    figure, ax = _new_figure('Thickness progression at different winding angles of hoop layers',
+                             'axial coordinate (mm)', 'thickness(mm)')
+    _add_lines(ax, hoop, colors=colors[:len(hoop)], linewidths=1)
+    figures.append(('hoop', figure))
+
+    written = []
+    for name, figure in figures:
+        for extension in formats:
+            filename = f"{prefix}_{name}.{extension}"
+            figure.savefig(filename, format=extension)
+            written.append(filename)
+    return written
+
+
+def _render_task(task: Tuple[str, CurvesBunch, str, Sequence[str]]) -> List[str]:
+    name, curves, out_dir, formats = task
+    return render_layup(curves, os.path.join(out_dir, name), formats)
+
+
+def render_batch(layups: Iterable[Tuple[str, CurvesBunch]], out_dir: str, formats: Sequence[str] = FORMATS,
+                 workers: int = os.cpu_count() or 1, chunksize: int = 4) -> List[str]:
+    """
+    Renders many layups in parallel. In this process if there is a single worker, or a single chunk of layups: the
+    pool would only add its start-up and the transfer of the layups
+    :param layups: pairs of (name, layup). The name is used as prefix of the files
+    :param out_dir: destination directory. Created if necessary
+    :return: list of all the written files
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(name, curves, out_dir, tuple(formats)) for name, curves in layups]
+    if workers <= 1 or len(tasks) <= chunksize:
+        return [filename for task in tasks for filename in _render_task(task)]
+    with ProcessPoolExecutor(workers) as executor:
+        return [filename for written in executor.map(_render_task, tasks, chunksize=chunksize)
+                for filename in written]
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from src.thickness import main as calculate_layup
+
+    # Throughput benchmark: python ./src/render.py [number of layups] [output directory]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join('.', 'temp', 'render')
+    layup = calculate_layup()
+    os.makedirs(out_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    render_layup(layup, os.path.join(out_dir, 'serial'))
+    serial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    files = render_batch(((f"layup_{i:05d}", layup) for i in range(n)), out_dir)
+    elapsed = time.perf_counter() - start
+    print(f"serial: {3 / serial:.1f} figures/s")
+    print(f"batch: {len(files)} figures of {n} layups in {elapsed:.2f} s ({len(files) / elapsed:.1f} figures/s)")
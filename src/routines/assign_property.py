@@ -27,44 +27,81 @@ import time
 import routine_util as ru
 import routine_constants as rc
 
-def main():
+def create_layup_section(name, properties, region):
+    material = rc.LAYUP_MATERIAL + name
+    section = rc.LAYUP_SECTION + name
+    mdb.models[rc.MODEL].Material(name=material)
 
+    mdb.models[rc.MODEL].materials[material].Elastic(type=ENGINEERING_CONSTANTS,
+                                                     table=(tuple(properties),))
+    mdb.models[rc.MODEL].materials[material].Density(table=((rc.LAYUP_DENSITY,),))
 
-    # import stubs as stb
+    mdb.models[rc.MODEL].HomogeneousSolidSection(name=section,
+                                                 material=material,
+                                                 thickness=None)
 
+    part = mdb.models[rc.MODEL].parts[rc.LAYUP_PART]
+    part.SectionAssignment(region=region, sectionName=section, offset=0.0,
+                           offsetType=MIDDLE_SURFACE, offsetField='',
+                           thicknessAssignment=FROM_SECTION)
 
 
-    # --- Create materials and assign sections
-    # --Layup
-    mdb.models[rc.MODEL].Material(name=rc.LAYUP_MATERIAL)
+def remove_layer_sections(part, first):
+    """
+    Removes the section assignments of the layers from :first: on, created by main with materials
+    """
+    prefix = rc.LAYUP_SECTION + '_'
+    for index in reversed(range(len(part.sectionAssignments))):
+        name = part.sectionAssignments[index].sectionName
+        if name.startswith(prefix) and int(name[len(prefix):]) >= first:
+            del part.sectionAssignments[index]
 
-    mdb.models[rc.MODEL].materials[rc.LAYUP_MATERIAL].Elastic(type=ENGINEERING_CONSTANTS,
-                                                              table=(rc.LAYUP_MATERIAL_PROPS,))
 
-    mdb.models[rc.MODEL].HomogeneousSolidSection(name=rc.LAYUP_SECTION,
-                                                 material=rc.LAYUP_MATERIAL,
-                                                 thickness=None)
+def main(materials=None, first=0):
+    """
+    :param materials: engineering constants of every layer, e.g. of smeared sublaminates (see src/sublaminates.py).
+    LAYUP_MATERIAL_PROPS for the whole layup if None
+    :param first: index of the first changed line when a model is updated, see build_model.update. Only the sections
+    of the layers from :first: on are assigned again, the material orientation is kept
+    """
 
+    # import stubs as stb
+
+
+
+    # --- Create materials and assign sections
+    # --Layup
     part = mdb.models[rc.MODEL].parts[rc.LAYUP_PART]
-    region = part.sets[rc.LAYUP_SET]
-    part.SectionAssignment(region=region, sectionName=rc.LAYUP_SECTION, offset=0.0,
-                           offsetType=MIDDLE_SURFACE, offsetField='',
-                           thicknessAssignment=FROM_SECTION)
+    if first:
+        if materials is not None:
+            remove_layer_sections(part, first)
+            for layer_number in range(first, len(materials) + 1):
+                create_layup_section('_{}'.format(layer_number), materials[layer_number - 1],
+                                     part.sets[rc.LAYER_SET + str(layer_number)])
+    elif materials is None:
+        create_layup_section('', rc.LAYUP_MATERIAL_PROPS, part.sets[rc.LAYUP_SET])
+    else:
+        for layer_number, properties in enumerate(materials, start=1):
+            create_layup_section('_{}'.format(layer_number), properties,
+                                 part.sets[rc.LAYER_SET + str(layer_number)])
 
     # --Orientations
 
     prt = mdb.models[rc.MODEL].parts[rc.LAYUP_PART]
     region = prt.sets[rc.LAYUP_SET]
     orientation = None
-    mdb.models[rc.MODEL].parts[rc.LAYUP_PART].MaterialOrientation(region=region,
-        orientationType=FIELD, axis=AXIS_3, fieldName=rc.ORIENTATION,
-        localCsys=None, additionalRotationType=ROTATION_NONE, angle=0.0,
-        additionalRotationField='', stackDirection=STACK_3)
+    if not first:
+        mdb.models[rc.MODEL].parts[rc.LAYUP_PART].MaterialOrientation(region=region,
+            orientationType=FIELD, axis=AXIS_3, fieldName=rc.ORIENTATION,
+            localCsys=None, additionalRotationType=ROTATION_NONE, angle=0.0,
+            additionalRotationField='', stackDirection=STACK_3)
 
+    # mass of the layup, to be checked against the one computed from the curves (see src/mass.py)
+    print('Layup mass: {} t'.format(prt.getMassProperties()['mass']))
 
 
 
-    if rc.LINER_TOGGLE:
+    if rc.LINER_TOGGLE and not first:
         # --Liner
         mdb.models[rc.MODEL].Material(name=rc.LINER_MATERIAL) #bn
 
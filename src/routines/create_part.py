@@ -2,8 +2,8 @@
 Medium-level abaqus routine
 Creates axisymmetric part with twist
 
-in: list of curves in the form of (x,y) that conform a closed shape
-points = [(x,y)], list of tuples, each tuple is the coordinates of the line segment
+in: lines of the intermediate file. The part is sketched in an outline that encloses them, see
+routine_geometry.part_outline
 out: axisymmentric part with twist generated inside CAE
 '''
 
@@ -33,20 +33,17 @@ import connectorBehavior
 # import own modules
 import routine_util as ru
 import routine_constants as rc
+import routine_geometry as rg
 
 
 import time
 
 
-def main():
+def main(lines):
 
     start_time = time.time()
 
-    points = [(0, 0),
-              (200, 0),
-              (200, 600),
-              (0, 600),
-              (0, 0)]  # stub.
+    points = rg.part_outline(lines)
 
     # initialize model
 
@@ -45,9 +45,14 @@ import time
 # import own modules
 import routine_util as ru
 import routine_constants as rc
+import routine_geometry as rg
 
 
-def main(lines):
+def main(lines, first=0):
+    """
+    :param first: index of the first changed line when a model is updated, see build_model.update. The faces of the
+    layers below are kept by the update, and so are their sets. Surfaces and the set for the BC are always recreated
+    """
     start_time = time.time()
 
     # import stubs as stb
@@ -74,12 +79,19 @@ def main(lines):
     faces = part.faces
 
     for index, landmark in enumerate(landmarks):
+        if index < first:
+            continue
         location = ru.offset_point(landmark, 45 + 90)  # look to the left of the vertical
         face_array = part.faces.findAt((location, (0., 0., 1.)))  # find face at location
         name = rc.LAYER_SET + str(index)
         part.Set(faces=(face_array,), name=name)
 
-    del mdb.models['model'].parts['layup'].sets['set_layer_0']
+    if first == 0:
+        del mdb.models['model'].parts['layup'].sets['set_layer_0']
+    else:  # sets of the layers the updated layup does not have anymore
+        for name in part.sets.keys():
+            if name.startswith(rc.LAYER_SET) and int(name[len(rc.LAYER_SET):]) >= len(lines):
+                del part.sets[name]
     # -----------------
     # create surf on layup for pressure loading
     # -----------------
@@ -94,7 +106,8 @@ def main(lines):
     selection = edge.getEdgesByEdgeAngle(rc.GET_EDGES_BY_ANGLE)
 
     points = [e.pointOn[0] for e in selection]  # extract characteristic points of the curve of interest
-    points = [(point,) for point in points if point[1] < 477.340487]
+    end_point = rg.pressure_end_point(lines)  # the layup is loaded below this height
+    points = [(point,) for point in points if point[1] < end_point]
 
     selection = part.edges.findAt(*points)
 
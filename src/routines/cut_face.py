@@ -40,55 +40,81 @@ import routine_constants as rc
 start_time = time.time()
 
 
-def main(lines):
-    print(time.time() - start_time)
-
-    # set work part
-    p = mdb.models[rc.MODEL].parts[rc.LAYUP_PART]
-    # initialize cutting sketch
-    f, e, d1 = p.faces, p.edges, p.datums
+def partition(part, lines):
+    """
+    Partitions the faces of the part by a sketch of the lines
+    :return: partition feature
+    """
+    f, e, d1 = part.faces, part.edges, part.datums
     s1 = mdb.models[rc.MODEL].ConstrainedSketch(name='cutting_sketch',
                                                 sheetSize=1000)
     g, v, d, c = s1.geometry, s1.vertices, s1.dimensions, s1.constraints
     s1.setPrimaryObject(option=SUPERIMPOSE)
-    p = mdb.models[rc.MODEL].parts[rc.LAYUP_PART]
-    p.projectReferencesOntoSketch(sketch=s1, filter=COPLANAR_EDGES)
+    part.projectReferencesOntoSketch(sketch=s1, filter=COPLANAR_EDGES)
 
-    counter = 1
     for line in lines:
         s1.Spline(points=(line[:-1]),
                   constrainPoints=False)  # use points up to second-to-last-point to draw a spline
         ru.draw_line(s1, line[-2:])  # use last two points to go straight below
-        print('Partition line {} of {} has been created'.format(counter, len(lines)))
-        counter += 1
     # ru.draw_lines(s1, lines)
 
-    print(time.time() - start_time)
-
-    # cut part according to sketch
-    p = mdb.models[rc.MODEL].parts[rc.LAYUP_PART]
-    f = p.faces
-    pickedFaces = f.getSequenceFromMask(mask=('[#1 ]',), )  # TODO refactor selection method
-    e1, d2 = p.edges, p.datums
-    p.PartitionFaceBySketch(faces=pickedFaces, sketch=s1)
+    feature = part.PartitionFaceBySketch(faces=part.faces, sketch=s1)
     s1.unsetPrimaryObject()
+    return feature
 
-    # remove excess material
-    f = p.faces
-    p.RemoveFaces(faceList=(f.findAt(coordinates=(0.1, 0.1, 0.0)),),
-                  deleteCells=False)
 
-    # remove faulty faces
+def remove_excess_material(part):
+    f = part.faces
+    part.RemoveFaces(faceList=(f.findAt(coordinates=(0.1, 0.1, 0.0)),),
+                     deleteCells=False)
 
-    f = p.faces
+
+def remove_faulty_faces(part):
+    f = part.faces
     face_list = [face for face in f if face.getSize() < 10]
 
     try:
-        p.RemoveFaces(faceList=face_list, deleteCells=False)
+        feature = part.RemoveFaces(faceList=face_list, deleteCells=False)
+        part.features.changeKey(fromName=feature.name, toName=rc.FAULTY_FACES_FEATURE)
     except:
         print('No faces were removed')
 
 
+def partition_line(part, lines, index):
+    """
+    Partitions by one line only, in a feature named after it. See update
+    """
+    feature = partition(part, lines[index:index + 1])
+    part.features.changeKey(fromName=feature.name, toName=rc.PARTITION_FEATURE + str(index))
+    print('Partition line {} of {} has been created'.format(index + 1, len(lines)))
+
+
+def main(lines, separate=False):
+    """
+    :param separate: one partition feature per line, so that the model can be updated later. See update.
+    Otherwise all the lines are drawn in a single sketch, which is faster
+    """
+    print(time.time() - start_time)
+
+    # set work part
+    p = mdb.models[rc.MODEL].parts[rc.LAYUP_PART]
+
+    # cut part according to sketch, then remove excess material
+    if separate:
+        partition_line(p, lines, 0)
+        remove_excess_material(p)
+        for index in range(1, len(lines)):
+            partition_line(p, lines, index)
+    else:
+        partition(p, lines)
+        print('{} partition lines have been created'.format(len(lines)))
+        remove_excess_material(p)
+
+    print(time.time() - start_time)
+
+    # remove faulty faces
+    remove_faulty_faces(p)
+
     end_time = time.time()
 
     total_time = end_time - start_time
@@ -96,3 +122,21 @@ def main(lines):
     print(total_time)
 
 
+def update(lines, first, previous_count):
+    """
+    Replaces the partitions of the lines from :first: on, keeping those below. The part must have been cut with
+    main(lines, separate=True)
+    :param first: index of the first changed line, at least 1: the liner is kept
+    :param previous_count: number of lines of the model being updated
+    """
+    start = time.time()
+    p = mdb.models[rc.MODEL].parts[rc.LAYUP_PART]
+    names = [rc.PARTITION_FEATURE + str(index) for index in range(first, previous_count)]
+    names += [rc.FAULTY_FACES_FEATURE] if rc.FAULTY_FACES_FEATURE in p.features.keys() else []
+    if names:
+        p.deleteFeatures(featureNames=tuple(names))
+
+    for index in range(first, len(lines)):
+        partition_line(p, lines, index)
+    remove_faulty_faces(p)
+    print('Partitions from line {} replaced in {:.1f} s'.format(first, time.time() - start))
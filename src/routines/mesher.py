@@ -29,12 +29,35 @@ import routine_util as ru
 import routine_constants as rc
 
 
-def main():
+def mesh_unmeshed_faces(prt, elem_types):
+    """
+    Meshes only the faces without elements. The mesh of the others is kept
+    """
+    unmeshed = [face.index for face in prt.faces if len(face.getElements()) == 0]
+    print('Layup mesh update: {} of {} faces to mesh'.format(len(unmeshed), len(prt.faces)))
+    if not unmeshed:
+        return
+    regions = prt.faces[unmeshed[0]:unmeshed[0] + 1]
+    for index in unmeshed[1:]:
+        regions += prt.faces[index:index + 1]
+    prt.setElementType(regions=(regions,), elemTypes=elem_types)
+    prt.setMeshControls(regions=regions, technique=FREE)
+    prt.generateMesh(regions=regions)
+
+
+def main(update=False):
+    """
+    :param update: only mesh the layup faces replaced by cut_face.update, see build_model.update
+    """
     # --------- Layup ---------
     # ----- Element Types -----
     elemType1 = mesh.ElemType(elemCode=CGAX8R, elemLibrary=STANDARD)
     elemType2 = mesh.ElemType(elemCode=CGAX6, elemLibrary=STANDARD)
     prt = mdb.models[rc.MODEL].parts[rc.LAYUP_PART]
+    if update:
+        mesh_unmeshed_faces(prt, (elemType1, elemType2))
+        print('Layup mesh: {} elements'.format(len(prt.elements)))
+        return
     pickedRegions = prt.sets[rc.LAYUP_SET]
     prt.setElementType(regions=pickedRegions, elemTypes=(elemType1, elemType2))
     # ----- Mesh Controls -----
@@ -44,6 +67,7 @@ def main():
     prt.seedPart(size=rc.LAYUP_MESH_SIZE, deviationFactor=0.1, minSizeFactor=0.1)
     # ----- Mesh -----
     prt.generateMesh()
+    print('Layup mesh: {} elements'.format(len(prt.elements)))
 
 
     # --------- Liner ---------
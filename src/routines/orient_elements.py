@@ -27,46 +27,30 @@ from time import time
 
 # import own modules
 from src.design_variables import get_angles
+from src.layers import LayerClassifier
+from src.geometry import tangents, tangent_angles
 import routine_constants as rc
 
-# Extract liner shape
-filename = r'..\resources\liner.csv'
-
-
-liner = np.loadtxt(filename, delimiter=",", skiprows=0)
-
-
 angles = get_angles()
 
+# basis of every element of the last call, by label: (centroid, basis). See the update mode of main
+bases = {}
+# y coordinates and tangent angles of every line, by layer number. Reset on every call of main
+gammas = {}
 
-def get_gamma(position, layer_number):
-    baseline = np.array(list(zip(*lines[layer_number])))
-
-    x_vals = baseline[1]
-    y_vals = baseline[0]
-
-    x_lengths = np.gradient(x_vals)
-    y_lengths = np.gradient(y_vals)
-
-    vec_lengths = np.array([(x ** 2 + y ** 2)**0.5 for x, y in zip(x_lengths, y_lengths)])
 
-    gamma_array = np.arccos(x_lengths / vec_lengths)
-
-    # try:
-    #     gamma_array = np.arctan(np.gradient(baseline[0], baseline[1]))
-    # except FloatingPointError:
-    #     mask_func = np.gradient(baseline[1]) != 0
-    #     mask_func[np.where(mask_func == False)[0][0] - 1] = False
-    #     mask_func[np.where(mask_func == False)[0][-1] + 1] = False
-    #     mask_vert = np.invert(mask_func)
-    #
-    #     gamma_array = np.zeros(baseline.shape[1])
-    #
-    #     gamma_array[mask_vert] = - 90 * pi / 180
-    #
-    #     gamma_array[mask_func] = np.arctan(np.gradient(baseline[0][mask_func], baseline[1][mask_func]))
+def get_gamma(position, layer_number):
+    """
+    :param position: axial coordinate in mm
+    :return: angle between the tangent of the line and the axis, in radians. The angles of every line are computed
+    once per call of main
+    """
+    if layer_number not in gammas:
+        baseline = np.array(lines[layer_number], dtype=float)
+        gammas[layer_number] = (baseline[:, 1], tangent_angles(tangents(baseline)))
+    y_vals, gamma_array = gammas[layer_number]
 
-    idx = (np.abs(baseline[1] - position)).argmin()
+    idx = (np.abs(y_vals - position)).argmin()
     return gamma_array[idx]
 
 
@@ -142,29 +126,51 @@ def get_basis(element, layer_number):
     return element.label, np.concatenate((g_1, g_2), axis=0)
 
 
-def main(_lines):
-    global lines
+def main(_lines, _angles=None, first=0):
+    """
+    :param _lines: curves in the abaqus format
+    :param _angles: winding angle of every layer. Those of design_variables if None
+    :param first: index of the first changed line when a model is updated, see build_model.update. The elements of the
+    layers below keep the basis of the previous call, as long as their label and centroid did not change
+    """
+    global lines, angles, bases, gammas
     lines = _lines
+    gammas = {}
+    angles = get_angles() if _angles is None else _angles
     # # Define part
     prt = mdb.models['model'].parts['layup']
 
-    # Extract array of Set objects
-
-    sts = prt.sets
-
-    sts = [(int(key.split("_")[-1]), sts[key]) for key in sts.keys() if key.startswith('set_layer')]  # Filter: only layer sets
+    # Layer of every element, classified by its centroid
+    classifier = LayerClassifier.from_abaqus_format(lines)
+    nodes = np.array([node.coordinates for node in prt.nodes])[:, 0:2]
+    elements = prt.elements
+    centroids = np.array([nodes[list(element.connectivity)].mean(axis=0) for element in elements])
+    layer_numbers = classifier.classify(centroids)
 
     indices_list = []
 
     bases_list = []
 
-    for layer_number, st in sts:
-        for element in st.elements:
+    previous, bases, reused = bases, {}, 0
+    for element, layer_number, centroid in zip(elements, layer_numbers, centroids):
+        if layer_number < 1:  # not in a layer, keeps the default orientation
+            continue
+        cached = previous.get(element.label) if layer_number < first else None
+        if cached is not None and np.allclose(cached[0], centroid):
+            idx, basis = element.label, cached[1]
+            reused += 1
+        else:
             idx, basis = get_basis(element, layer_number)
-            indices_list.append(idx), bases_list.append(basis)
+        bases[idx] = (centroid, basis)
+        indices_list.append(idx), bases_list.append(basis)
+    print('{} of {} elements outside the layers'.format(np.sum(layer_numbers < 1), len(layer_numbers)))
+    if first:
+        print('{} orientations of the unchanged layers reused'.format(reused))
 
     indices_list, bases_list = tuple(np.array(indices_list).flatten()), tuple(np.array(bases_list).flatten())
 
+    if rc.ORIENTATION in mdb.models[rc.MODEL].discreteFields.keys():  # update of an existing model
+        del mdb.models[rc.MODEL].discreteFields[rc.ORIENTATION]
     mdb.models[rc.MODEL].DiscreteField(name=rc.ORIENTATION,
                                        description='',
                                        location=ELEMENTS,
@@ -18,6 +18,10 @@ BC2 = 'BC-2'
 
 ORIENTATION = 'orientation'
 
+#  -- Features. Named in the update mode of build_model.py, see cut_face.py --
+PARTITION_FEATURE = 'partition_'  # one per line
+FAULTY_FACES_FEATURE = 'remove_faulty_faces'
+
 #  -- Sets and surfs --
 bset = 'set'  # base name for sets
 LAYER_SET = bset + '_layer_'
@@ -64,6 +68,20 @@ LAYUP_MATERIAL_PROPS = (
     2612.0,  # G13
     2139.0)  #
 
+LAYUP_DENSITY = 1.55e-9  # t/mm^3  # consistent with mm, N, MPa
+LAYUP_MASS_EXTENSION = '.layup_mass'  # CAE writes the layup mass next to the input deck, see src/mass.py
+
+# Ply strengths in MPa, see src/failure.py
+LAYUP_STRENGTHS = (
+    2550.0,  # Xt, fiber tension
+    1470.0,  # Xc, fiber compression
+    69.0,  # Yt, transverse tension
+    220.0,  # Yc, transverse compression
+    110.0,  # S12, in-plane shear
+    80.0)  # S23, transverse shear
+LAYUP_PUCK_INCLINATIONS = (0.35, 0.30)  # p_perp_par (+), (-). Recommended for CFRP
+LAYUP_TSAI_WU_INTERACTION = -0.5  # normalized interaction coefficient F12*
+
 
 LAYUP_SECTION = LAYUP_PART + '_section'
 
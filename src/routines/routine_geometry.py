@@ -0,0 +1,33 @@
+"""
+Geometry the routines derive from the lines of the intermediate file, instead of constants of the stock liner.
+Shared with the host, see src/flat_build.py and src/axisymmetric.py: plain Python, for the interpreters of Abaqus and
+of the host. The lines are in the abaqus format, see CurvesBunch.to_abaqus_format: the liner first, then every layer
+from the point where it starts on the curve below
+"""
+
+TOLERANCE = 1e-6  # mm, points closer than this to the cylinder radius are on the cylinder
+OUTLINE_STEP = 100.  # mm, the outline of the part ends at the next multiple of it beyond the lines
+
+
+def part_outline(lines):
+    """
+    Rectangle the part is sketched in, before the lines partition it, e.g. 200 x 600 mm for the stock liner
+    :return: corners of the closed outline, from the origin
+    """
+    width, height = [OUTLINE_STEP * (int(max(point[axis] for line in lines for point in line) // OUTLINE_STEP) + 1)
+                     for axis in (0, 1)]
+    return [(0., 0.), (width, 0.), (width, height), (0., height), (0., 0.)]
+
+
+def pressure_end_point(lines):
+    """
+    The layup is loaded on the liner side below the first helical layer. Higher up, where the liner rises to the polar
+    opening and the neck, the other layers start on it and the boss carries the pressure.
+    :return: height of the lowest point at which a line starts on the liner outside the cylinder. The liner is loaded
+    below it. Infinity if no line starts there, e.g. a layup of hoop layers only
+    """
+    liner = lines[0]
+    radius = max(point[0] for point in liner)
+    points = set(tuple(point) for point in liner)
+    starts = [line[0][1] for line in lines[1:] if line[0][0] < radius - TOLERANCE and tuple(line[0]) in points]
+    return min(starts) if starts else float('inf')
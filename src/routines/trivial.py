@@ -28,7 +28,11 @@ import routine_util as ru
 import routine_constants as rc
 
 
-def main():
+def main(job_name='Job-1', submit=True):
+    """
+    :param job_name: name of the job and therefore of the input deck
+    :param submit: submit the job right away. Otherwise only the input deck is written
+    """
     start_time = time.time()
 
     # ----- Step -----
@@ -78,19 +82,30 @@ def main():
                                                         adjustMethod=OVERCLOSED, initialClearance=OMIT, datumAxis=None,
                                                         clearanceRegion=None, tied=OFF)
 
+    write_job(job_name, submit)
+
+
+def write_job(job_name='Job-1', submit=True):
+    """
+    Writes the input deck of the current model. Enough after an update of the model, see build_model.update
+    """
     # ----- Job -----
 
     a = mdb.models[rc.MODEL].rootAssembly
     a.regenerate()
-    mdb.Job(name='Job-1', model=rc.MODEL, description='', type=ANALYSIS,
+    mdb.Job(name=job_name, model=rc.MODEL, description='', type=ANALYSIS,
             atTime=None, waitMinutes=0, waitHours=0, queue=None, memory=90,
             memoryUnits=PERCENTAGE, getMemoryFromAnalysis=True,
             explicitPrecision=SINGLE, nodalOutputPrecision=SINGLE, echoPrint=OFF,
             modelPrint=OFF, contactPrint=OFF, historyPrint=OFF, userSubroutine='',
             scratch='', resultsFormat=ODB, multiprocessingMode=DEFAULT, numCpus=8,
             numDomains=8, numGPUs=2)
-    mdb.jobs['Job-1'].writeInput(consistencyChecking=OFF)
-    mdb.jobs['Job-1'].submit(consistencyChecking=OFF)
+    mdb.jobs[job_name].writeInput(consistencyChecking=OFF)
+    # mass of the layup, checked against the one computed from the curves, see src/mass.py
+    with open(job_name + rc.LAYUP_MASS_EXTENSION, 'w') as mass_file:
+        mass_file.write(repr(mdb.models[rc.MODEL].parts[rc.LAYUP_PART].getMassProperties()['mass']))
+    if submit:
+        mdb.jobs[job_name].submit(consistencyChecking=OFF)
 
 
 
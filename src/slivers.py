@@ -0,0 +1,181 @@
+# coding=utf-8
+"""
+Sliver merging
+Near the polar opening the layers end in thin tails: a layer starts on the one below with zero thickness and grows to
+its full thickness over a few points. Where it is thinner than a fraction of an element, the partition of CAE cuts
+tiny faces between the two splines, which cut_face.remove_faulty_faces deletes afterwards, or which end up as distorted
+elements.
+Before the export, the points of the beginning of a layer that lie closer than SLIVER_TOLERANCE to the layer below,
+over less than SLIVER_LENGTH of arclength, are dropped: the layer starts at the vertex of the layer below next to its
+first point that is thick enough. The tail is removed, not handed over to the layer above: the points of the layers
+above are moved along the normal of the old curve below them onto the same distance from the new one, so that their
+thickness is kept.
+Run from  root '/' directory
+"""
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+
+import src.routines.routine_constants as rc
+from model import Curve, CurvesBunch
+
+SLIVER_TOLERANCE = 0.5 * rc.LAYUP_MESH_SIZE  # mm, thinner parts of a tail are merged
+SLIVER_LENGTH = 20.  # mm, longer thin regions are thin layers, not tails, and are kept
+
+
+@dataclass
+class MergedSlivers:
+    curves: CurvesBunch  # liner and layers without slivers
+    areas: np.ndarray  # cross-section area of the tail removed from every layer, mm^2
+    lengths: np.ndarray  # arclength of the merged tail of every layer, mm
+    area_changes: np.ndarray  # change of the cross-section area of every layer, mm^2. Negative if it decreased
+
+    @property
+    def merged(self) -> np.ndarray:
+        """ indices of the layers with a merged tail, 0 being the first layer above the liner """
+        return np.flatnonzero(self.lengths > 0.)
+
+    @property
+    def removed_area(self) -> float:
+        """ decrease of the cross-section area of the layup, mm^2 """
+        return float(-self.area_changes.sum())
+
+    @property
+    def moved_areas(self) -> np.ndarray:
+        """ area every layer gained from, or lost to, the others while the layers above followed the curves, mm^2 """
+        return self.area_changes + self.areas
+
+    def __str__(self) -> str:
+        return (f"{len(self.merged)} of {len(self.lengths)} layers with a sliver, longest tail "
+                f"{self.lengths.max(initial=0.):.1f} mm: {self.areas.sum():.2f} mm^2 of tails, layup area "
+                f"{self.removed_area:.2f} mm^2 smaller, {np.abs(self.moved_areas).max(initial=0.):.2f} mm^2 moved "
+                f"between layers at most")
+
+
+def _project(points: np.ndarray, polyline: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :return: distance from every point to :polyline:, index of the nearest segment and position along it, in [0, 1]
+    """
+    p = points[:, None, :]
+    a = polyline[:-1]
+    d = polyline[1:] - a
+    s = np.clip(np.einsum('nmk,mk->nm', p - a, d) / np.maximum(np.einsum('mk,mk->m', d, d), 1e-12), 0., 1.)
+    distances = np.linalg.norm(p - a - s[..., None] * d, axis=2)
+    nearest = distances.argmin(axis=1)
+    rows = np.arange(len(points))
+    return distances[rows, nearest], nearest, s[rows, nearest]
+
+
+def _shoelace(polygon: np.ndarray) -> float:
+    x, y = polygon.T
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def _follow(points: np.ndarray, old: np.ndarray, new: np.ndarray) -> np.ndarray:
+    """
+    :return: :points: moved along the normal of the polyline :old: to the same distance from the polyline :new:
+    """
+    distances, segments, position = _project(points, old)
+    nearest = old[segments] + position[:, None] * (old[segments + 1] - old[segments])
+    normals = (points - nearest) / np.maximum(distances, 1e-12)[:, None]
+    # ray from every point towards the old curve: points - t normals = a + s d
+    a, d = new[:-1], new[1:] - new[:-1]
+    ap = a[None] - points[:, None]
+    denominator = normals[:, None, 0] * d[None, :, 1] - normals[:, None, 1] * d[None, :, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = -(ap[..., 0] * d[None, :, 1] - ap[..., 1] * d[None, :, 0]) / denominator
+        s = (ap[..., 0] * normals[:, None, 1] - ap[..., 1] * normals[:, None, 0]) / denominator
+    t[~((s >= 0.) & (s <= 1.) & (t >= 0.))] = np.inf
+    t = t.min(axis=1)
+    shift = np.where(np.isfinite(t) & (distances > 1e-12), t - distances, 0.)
+    return points - shift[:, None] * normals
+
+
+def _enclosed_areas(curves) -> np.ndarray:
+    """
+    :return: cross-section area enclosed by every curve and the axis. Differences are the areas of the layers
+    """
+    return np.array([_shoelace(np.concatenate((points, [[0., points[-1, 1]], [0., points[0, 1]]])))
+                     for points in curves])
+
+
+def merge_slivers(curves: CurvesBunch, tolerance: float = SLIVER_TOLERANCE,
+                  length: float = SLIVER_LENGTH) -> MergedSlivers:
+    """
+    :param curves: liner and layers, as given by thickness.calculate_layup. Not modified
+    :param tolerance: thickness below which the beginning of a layer is a sliver, mm
+    :param length: longest sliver, mm. Thin regions that go on further are kept
+    """
+    liner = curves.curves[0]
+    merged = CurvesBunch(liner, curves.hoop_end)
+    # index of every point of the previous curve in the new one. The head of a curve, before its layer start index,
+    # is a copy of the beginning of the previous curve
+    mapping = np.arange(len(liner.points))
+    areas, lengths = [], []
+
+    for old_below, curve in zip(curves.curves[:-1], curves.curves[1:]):
+        below = merged.curves[-1].points
+        start = curve.layer_start_index or 0
+        base = mapping[start]  # the layer starts on this vertex of the new curve below
+        layer = curve.points[start:].copy()
+        if not np.array_equal(below, old_below.points):
+            # the layer follows the curve below, keeping its thickness
+            layer[1:] = _follow(layer[1:], old_below.points, below)
+        layer[0] = below[base]
+
+        arclength = np.concatenate(([0.], np.cumsum(np.linalg.norm(np.diff(layer, axis=0), axis=1))))
+        window = layer[:np.searchsorted(arclength, length, side='right') + 1]
+        gaps, segments, _ = _project(window, below[base:])
+        thick = np.flatnonzero(gaps[1:] >= tolerance) + 1
+        first = thick[0] if len(thick) else 1
+        # the new start is the vertex of the curve below nearest to the last thin point, before the first thick one:
+        # the layer then rises over the same interval as the layers above, which were offset from its points
+        if first > 1:
+            vertices = below[base:base + segments[first] + 1]
+            snapped = base + int(np.linalg.norm(vertices - layer[first - 1], axis=1).argmin())
+        else:
+            snapped = base
+
+        merged.add_curve(Curve(np.concatenate((below[:snapped + 1], layer[first:])), curve.winding_angle, snapped))
+        areas.append(_shoelace(np.concatenate((layer[:first + 1], below[snapped:base - 1 if base else None:-1])))
+                     if first > 1 else 0.)
+        lengths.append(arclength[first - 1])
+
+        mapping = np.concatenate((mapping[:start + 1], np.full(first - 1, snapped),
+                                  snapped + np.arange(1, len(layer) - first + 1)))
+
+    changes = np.diff(_enclosed_areas([c.points for c in merged.curves])) - np.diff(
+        _enclosed_areas([c.points for c in curves.curves]))
+    return MergedSlivers(merged, np.array(areas), np.array(lengths), changes)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from src.thickness import main as calculate_layup
+
+    # python ./src/slivers.py [tolerance in mm] [length in mm]
+    tolerance = float(sys.argv[1]) if len(sys.argv) > 1 else SLIVER_TOLERANCE
+    length = float(sys.argv[2]) if len(sys.argv) > 2 else SLIVER_LENGTH
+    layup = calculate_layup()
+    start = time.perf_counter()
+    result = merge_slivers(layup, tolerance, length)
+    elapsed = time.perf_counter() - start
+
+    print(f"{result} ({1e3 * elapsed:.1f} ms)")
+    for i in result.merged:
+        curve = result.curves.curves[i + 1]
+        print(f"layer {i + 1:2d}  {curve.winding_angle:4.0f} deg  tail of {result.lengths[i]:5.1f} mm merged, "
+              f"{result.areas[i]:5.2f} mm^2 removed, area of the layer {result.area_changes[i]:+6.2f} mm^2")
+    # layers above follow the new curves: every head is a copy of the beginning of the curve below
+    heads = all(np.array_equal(above.points[:above.layer_start_index + 1], below.points[:above.layer_start_index + 1])
+                for below, above in zip(result.curves.curves[:-1], result.curves.curves[1:]))
+    # the merged layers now start at least the tolerance away from the layer below
+    curves = result.curves.curves
+    thinnest = min((_project(curves[i + 1].get_layer_points()[1:2], curves[i].points)[0][0] for i in result.merged),
+                   default=np.nan)
+    print(f"heads shared with the layer below: {heads}, thinnest merged start {thinnest:.2f} mm")
+    # the tails are removed from the layup, not handed to the layers above
+    from src.mass import composite_mass
+    print(f"composite mass {composite_mass(layup) * 1e3:.3f} -> {composite_mass(result.curves) * 1e3:.3f} kg")
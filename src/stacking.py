@@ -0,0 +1,342 @@
+# coding=utf-8
+"""
+Allocation-free kernel of the ply by ply stacking of thickness.py
+thickness.stack_layers allocates a few dozen temporary arrays per layer: the masks of the thickness regions, the
+gradients and normals of the previous curve, the offset points, the arclength, an interpolator for the resampling...
+In sweeps of many designs the allocator and the garbage collector take a noticeable share of the time. This kernel
+computes the same layers in the buffers of a Workspace, sized to the liner and reused from layer to layer and from
+design to design, with in-place ufuncs (out=). The only array allocated per layer is the points of the new curve.
+The workspace also keeps the thickness polynomials of the angles it has seen.
+The arithmetic follows thickness.py, np.gradient and interp1d operation by operation. The curves are equal to
+round-off, not bitwise: e.g. the summation order of NumPy may differ between builds. See the check in __main__.
+Run from  root '/' directory
+"""
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy import pi
+
+import src.thickness as th
+from model import Curve, CurvesBunch
+
+RESAMPLING_ARCLENGTH = 5.  # mm, as in thickness.interpolate_layer_region_constant_arclength
+ROUND_OFF = 1e-9  # mm, largest difference to thickness.stack_layers expected from the floating-point arithmetic
+_POINT_BUFFERS = ('t', 'u', 'v', 'dx', 'dy', 'norm', 'x', 'y', 'arclength')
+_GRID_BUFFERS = ('s', 'x_lo', 'x_hi', 'w_lo', 'w_hi', 'y_lo', 'y_hi')
+
+
+class Workspace:
+    """
+    Work buffers of the stacking kernel. Point buffers hold one value per point of the previous curve, grid buffers one
+    per point of the resampled layer region. Both grow when a curve does not fit, which happens at most a few times
+    per process if the workspace is sized to the liner.
+    """
+
+    def __init__(self, points: int = 0, grid: int = 0):
+        self.points = self.grid = 0
+        self.reserve(points, grid)
+        # thickness polynomials of region 1, see thickness.thickness_1: their quadratures cost more than the layer
+        self.polynomials: Dict[Tuple[float, ...], np.poly1d] = {}
+
+    @classmethod
+    def for_liner(cls, liner: Curve) -> "Workspace":
+        """
+        :param liner: resampled liner, as in thickness.main. The layers have fewer points: the layer regions are
+            resampled at a larger arclength
+        """
+        return cls(len(liner.points), len(liner.points) + 1)
+
+    def reserve(self, points: int, grid: int = 0) -> None:
+        if points > self.points:
+            self.points = points
+            for name in _POINT_BUFFERS:
+                setattr(self, name, np.empty(points))
+            self.mask, self.other_mask = np.empty(points, dtype=bool), np.empty(points, dtype=bool)
+            self.index = np.empty(points, dtype=np.intp)
+        if grid > self.grid:
+            self.grid = grid
+            for name in _GRID_BUFFERS:
+                setattr(self, name, np.empty(grid))
+            self.ramp = np.arange(grid, dtype=float)
+            self.counts = np.empty(grid + 1, dtype=np.intp)
+            self.lo, self.hi = np.empty(grid, dtype=np.intp), np.empty(grid, dtype=np.intp)
+
+
+_shared: Optional[Workspace] = None
+
+
+def shared_workspace() -> Workspace:
+    """
+    :return: workspace of this process, e.g. for the designs of a geometry worker of the pipeline
+    """
+    global _shared
+    if _shared is None:
+        _shared = Workspace()
+    return _shared
+
+
+# ----- Kernel. Arguments are views of the workspace buffers of the length of the previous curve -----
+
+def _helical_thickness(x: np.ndarray, t: np.ndarray, w: Workspace) -> None:
+    """ thickness.thickness into :t: """
+    n = len(x)
+    u, v, mask, other_mask = w.u[:n], w.v[:n], w.mask[:n], w.other_mask[:n]
+    # region 1: the polynomial, evaluated as np.polyval does
+    t.fill(0.)
+    for coefficient in th.thickness_1().coeffs:
+        np.multiply(t, x, out=t)
+        np.add(t, coefficient, out=t)
+    np.greater_equal(t, 0., out=mask)
+    np.less_equal(x, th.r_2b, out=other_mask)
+    np.logical_and(mask, other_mask, out=mask)
+    np.multiply(t, mask, out=t)
+    # region 2
+    np.divide(th.r_0, x, out=u)
+    np.minimum(u, 1., out=u)
+    np.arccos(u, out=u)
+    np.divide(th.r_b, x, out=v)
+    np.minimum(v, 1., out=v)
+    np.arccos(v, out=v)
+    np.subtract(u, v, out=u)
+    np.multiply(u, th.m_R * th.n_R / pi, out=u)
+    np.multiply(u, th.t_P, out=u)
+    np.nan_to_num(u, copy=False)
+    np.less(th.r_2b, x, out=other_mask)
+    np.multiply(u, other_mask, out=u)
+    np.add(t, u, out=t)
+
+    np.less_equal(t, th.MINIMUM_THICKNESS_THRESHOLD, out=mask)
+    np.copyto(t, 0., where=mask)
+
+
+def _hoop_thickness(y: np.ndarray, t: np.ndarray, w: Workspace, y_start: float,
+                    thickness_development: float = 40.) -> None:
+    """ thickness.thickness_hoop into :t: """
+    u = w.u[:len(y)]
+    np.subtract(y, y_start, out=u)
+    np.abs(u, out=u)
+    idx_start = int(u.argmin())
+    np.subtract(y, y_start - thickness_development, out=u)
+    np.abs(u, out=u)
+    idx_end = int(u.argmin())
+
+    t.fill(0.)
+    count = abs(idx_start - idx_end)
+    ramp = t[idx_start: idx_end]
+    if count > 1:  # np.linspace(0, 1, count) ** 0.5
+        np.multiply(w.ramp[:count], 1. / (count - 1), out=ramp)
+        ramp[-1] = 1.
+        np.sqrt(ramp, out=ramp)
+    np.multiply(ramp, th.t_hoop, out=ramp)
+    t[idx_end:] = th.t_hoop
+
+
+def _offset(x: np.ndarray, y: np.ndarray, t: np.ndarray, w: Workspace) -> None:
+    """ points + t * normals of the curve (x, y), into w.x and w.y. See geometry.tangents """
+    n = len(x)
+    dx, dy, norm, v = w.dx[:n], w.dy[:n], w.norm[:n], w.v[:n]
+    for f, df in ((x, dx), (y, dy)):  # np.gradient
+        np.subtract(f[2:], f[:-2], out=df[1:-1])
+        np.divide(df[1:-1], 2., out=df[1:-1])
+        df[0], df[-1] = f[1] - f[0], f[-1] - f[-2]
+    np.multiply(dx, dx, out=norm)
+    np.multiply(dy, dy, out=v)
+    np.add(norm, v, out=norm)
+    np.sqrt(norm, out=norm)
+    # the normal is the tangent rotated by +90 degrees: (-dy, dx) / norm
+    np.divide(dy, norm, out=v)
+    np.negative(v, out=v)
+    np.multiply(t, v, out=v)
+    np.add(x, v, out=w.x[:n])
+    np.divide(dx, norm, out=v)
+    np.multiply(t, v, out=v)
+    np.add(y, v, out=w.y[:n])
+
+
+def _smoothen(x: np.ndarray, y: np.ndarray, t: np.ndarray, w: Workspace) -> None:
+    """ thickness.smoothen_curve, in place """
+    n = len(x)
+    u, v, mask = w.u[:n], w.v[:n], w.mask[:n]
+    np.greater(t, 0., out=mask)
+    np.multiply(y, mask, out=u)
+    max_y_idx = int(u.argmax())
+    y_max = y[max_y_idx]
+    mask.fill(False)
+    np.less(y[:max_y_idx], y_max, out=mask[:max_y_idx])
+    count = int(np.count_nonzero(mask))
+    if count == 0:
+        return
+    first, last = int(mask.argmax()), n - 1 - int(mask[::-1].argmax())
+    start, stop = x[first] + 1, x[max_y_idx]
+    np.copyto(y, y_max, where=mask)
+    # np.linspace(start, stop, count) at the points of the mask
+    np.cumsum(mask, dtype=float, out=v)
+    np.subtract(v, 1., out=v)
+    if count > 1:
+        np.multiply(v, (stop - start) / (count - 1), out=v)
+    np.add(v, start, out=v)
+    np.copyto(x, v, where=mask)
+    if count > 1:
+        x[last] = stop
+
+
+def _layer_start(x: np.ndarray, y: np.ndarray, w: Workspace) -> int:
+    """ thickness.detect_layer_start of the curve in w.x, w.y on (x, y) """
+    n = len(x)
+    mask, other_mask = w.mask[:n], w.other_mask[:n]
+    np.not_equal(w.x[:n], x, out=mask)
+    np.not_equal(w.y[:n], y, out=other_mask)
+    np.logical_or(mask, other_mask, out=mask)
+    return int(mask.argmax()) - 1
+
+
+def _resample(n: int, start: int, w: Workspace, arclength: float = RESAMPLING_ARCLENGTH) -> np.ndarray:
+    """
+    thickness.interpolate_layer_region_constant_arclength of the curve in w.x, w.y
+    :return: points of the resampled curve, the only allocation of the kernel
+    """
+    x, y, s, u, v = w.x[:n], w.y[:n], w.arclength[:n], w.u[:n - 1], w.v[:n - 1]
+    # cumulative arclength from the layer start
+    np.subtract(x[1:], x[:-1], out=u)
+    np.multiply(u, u, out=u)
+    np.subtract(y[1:], y[:-1], out=v)
+    np.multiply(v, v, out=v)
+    np.add(u, v, out=u)
+    np.sqrt(u, out=u)
+    s[0] = 0.
+    np.cumsum(u, out=s[1:])
+    s = s[start:]
+    np.subtract(s, s[0], out=s)
+    m = len(s)
+
+    size = math.ceil(s[-1] / arclength)  # len(np.arange(0, s[-1], arclength))
+    w.reserve(n, size + 1)
+    grid = w.s[:size]
+    np.multiply(w.ramp[:size], arclength, out=grid)
+
+    # np.searchsorted(s, grid): the number of points of s below every grid point. The point i lies in the intervals
+    # [k, k + 1) * arclength with k = floor(s_i / arclength), rounded so that k * arclength <= s_i
+    q, floor = w.index[:m], w.u[:m]
+    np.divide(s, arclength, out=floor)
+    np.floor(floor, out=floor)
+    np.multiply(floor, arclength, out=w.v[:m])
+    np.greater(w.v[:m], s, out=w.mask[:m])
+    np.subtract(floor, w.mask[:m], out=floor)
+    np.add(floor, 1., out=floor)
+    np.minimum(floor, size, out=floor)
+    np.copyto(q, floor, casting='unsafe')
+    counts = w.counts[:size + 1]
+    counts.fill(0)
+    np.add.at(counts, q, 1)
+    hi, lo = w.hi[:size], w.lo[:size]
+    np.cumsum(counts[:size], out=hi)
+    np.clip(hi, 1, m - 1, out=hi)
+    np.subtract(hi, 1, out=lo)
+
+    # linear interpolation, as interp1d: (s - s_lo) / ds * y_hi + (s_hi - s) / ds * y_lo
+    s_lo, s_hi, w_lo, w_hi = w.x_lo[:size], w.x_hi[:size], w.w_lo[:size], w.w_hi[:size]
+    np.take(s, lo, out=s_lo)
+    np.take(s, hi, out=s_hi)
+    np.subtract(grid, s_lo, out=w_hi)
+    np.subtract(s_hi, s_lo, out=s_lo)
+    np.divide(w_hi, s_lo, out=w_hi)
+    np.subtract(s_hi, grid, out=w_lo)
+    np.divide(w_lo, s_lo, out=w_lo)
+
+    points = np.empty((start + size, 2))
+    points[:start, 0], points[:start, 1] = x[:start], y[:start]
+    y_lo, y_hi = w.y_lo[:size], w.y_hi[:size]
+    for column, f in enumerate((x[start:], y[start:])):
+        np.take(f, lo, out=y_lo)
+        np.take(f, hi, out=y_hi)
+        np.multiply(w_hi, y_hi, out=y_hi)
+        np.multiply(w_lo, y_lo, out=y_lo)
+        np.add(y_hi, y_lo, out=points[start:, column])
+    points[-1, -1] = 0.  # Guarantee that the curve finishes in y=0
+    return points
+
+
+def stack_layer(previous_topmost: Curve, w: Workspace, smoothing_threshold: float = 30,
+                hoop_end: Optional[float] = None) -> Curve:
+    """
+    thickness.calculate_layer_points followed by interpolate_layer_region_constant_arclength, in the buffers of :w:.
+    The globals of thickness.py must be defined for the angle of the layer
+    :param hoop_end: y coordinate at which hoop layers end, see CurvesBunch.hoop_end. thickness.max_y_hoop if None
+    """
+    x, y = previous_topmost.get_unpacked_xy()
+    n = len(x)
+    w.reserve(n, n + 1)
+    t = w.t[:n]
+    if th.angle_deg == 90.:
+        _hoop_thickness(y, t, w, th.max_y_hoop if hoop_end is None else hoop_end)
+    else:
+        _helical_thickness(x, t, w)
+    _offset(x, y, t, w)
+    if th.angle_deg < smoothing_threshold:
+        _smoothen(w.x[:n], w.y[:n], t, w)
+    start = _layer_start(x, y, w)
+
+    curve = Curve(_resample(n, start, w))
+    curve.layer_start_index = start
+    return curve
+
+
+def stack_layers(curves: CurvesBunch, angles: List[float], workspace: Optional[Workspace] = None) -> CurvesBunch:
+    """
+    thickness.stack_layers with the kernel of this module. R must be already defined
+    :param workspace: buffers to work in. The one of this process if None
+    """
+    workspace = shared_workspace() if workspace is None else workspace
+    topmost_curve = curves.curves[-1]
+    for angle in angles:
+        th.define_global_variables(angle)
+        if angle != 90.:
+            key = (angle, th.R, th.b, th.t_R, th.t_P)
+            if key not in workspace.polynomials:
+                workspace.polynomials[key] = th.thickness_1()
+            th.polynomial_1 = workspace.polynomials[key]
+        topmost_curve = stack_layer(topmost_curve, workspace, hoop_end=curves.hoop_end)
+        topmost_curve.winding_angle = angle
+        curves.add_curve(topmost_curve)
+    return curves
+
+
+if __name__ == "__main__":
+    import sys
+    import tracemalloc
+    from timeit import repeat
+    import src.design_variables as dv
+
+    # Against thickness.stack_layers: python ./src/stacking.py [designs]
+    designs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    liner = Curve(np.loadtxt(r'.\resources\liner.csv', delimiter=","))
+    th.R = liner.x.max()
+    angles = dv.get_angles()
+    th.define_global_variables(angles[0])
+    liner = th.interpolate_layer_region_constant_arclength(liner, arclength=1)
+    workspace = Workspace.for_liner(liner)
+
+    def kernel():
+        return th.calculate_layup(angles, liner, workspace=workspace)
+
+    def reference():
+        return th.calculate_layup(angles, liner)
+
+    error = max(np.abs(a.points - b.points).max() if a.points.shape == b.points.shape else np.inf
+                for a, b in zip(kernel().curves, reference().curves))
+    starts = [c.layer_start_index for c in kernel().curves] == [c.layer_start_index for c in reference().curves]
+    print(f"{len(angles)} layers against thickness.stack_layers: max difference {error:.1e} mm "
+          f"({'equal to round-off' if error < ROUND_OFF else 'DIFFERENT'}), "
+          f"layer starts {'equal' if starts else 'DIFFERENT'}")
+
+    for name, function in (('thickness.stack_layers', reference), ('workspace kernel', kernel)):
+        elapsed = min(repeat(function, number=designs, repeat=3)) / designs
+        tracemalloc.start()
+        result = function()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # the points of every layer are the result, the rest of the peak is made of temporaries
+        kept = sum(c.points.nbytes for c in result.curves[1:])
+        print(f"{name}: {elapsed * 1e3:.2f} ms per design, {1 / elapsed:.0f} designs/s, "
+              f"peak traced memory {peak / 1024:.0f} kB for {kept / 1024:.0f} kB of results")
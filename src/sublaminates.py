@@ -0,0 +1,297 @@
+# coding=utf-8
+"""
+Sublaminate homogenization
+Groups consecutive layers of similar winding angle into smeared sublaminates, so that the CAE partition and mesh are
+built per group instead of per ply. The 3D stiffness of every group is obtained with the mixed (Sun & Li) averaging:
+in-plane strains and out-of-plane stresses are continuous through the thickness, hence the thickness-weighted average
+is taken of the mixed matrix H
+    [sigma_p, eps_n] = H [eps_p, sigma_n],    p = (11, 22, 12), n = (33, 23, 13)
+The effective stiffness is expressed in the frame of the mean winding angle of the group, and reduced to the 9
+orthotropic engineering constants of LAYUP_MATERIAL_PROPS.
+The accuracy of the mode is the error of the peak ply stresses against the resolved layup, see homogenization_report.
+It is not the stiffness error: a group of identical angles has the exact stiffness and still misses the peak stresses by
+16 to 31 % on the default layup, where the layers of the group follow different angles along the dome.
+Run from  root '/' directory
+"""
+import warnings
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+import src.routines.routine_constants as rc
+from model import Curve, CurvesBunch
+
+VOIGT = ((0, 0), (1, 1), (2, 2), (1, 2), (0, 2), (0, 1))  # 11, 22, 33, 23, 13, 12 with engineering shear strains
+IN_PLANE = [0, 1, 5]
+OUT_OF_PLANE = [2, 3, 4]
+ORTHOTROPIC = np.zeros((6, 6), dtype=bool)  # non-zero entries of an orthotropic compliance
+ORTHOTROPIC[:3, :3] = True
+ORTHOTROPIC[[3, 4, 5], [3, 4, 5]] = True
+STRESS_ERROR_LIMIT = 0.05  # peak stress error of a group, relative to the peak of the layup, above which it is flagged
+
+
+@dataclass
+class Sublaminates:
+    groups: List[Tuple[int, int]]  # (first, stop) layer indices, 0 being the first layer above the liner
+    angles: List[float]  # mean winding angle of every group
+    properties: List[Tuple[float, ...]]  # engineering constants of every group, as LAYUP_MATERIAL_PROPS
+    coupling: np.ndarray  # norm of the non-orthotropic part of the compliance, relative to the whole, per group
+    curves: CurvesBunch  # liner and topmost curve of every group
+
+    def interchange(self) -> dict:
+        """
+        :return: content of the intermediate file of build_model.py
+        """
+        return {'lines': self.curves.to_abaqus_format(), 'angles': self.angles, 'materials': self.properties}
+
+
+def group_layers(angles: List[float], tolerance: float = 0.) -> List[Tuple[int, int]]:
+    """
+    Consecutive layers whose angle differs at most :tolerance: degrees from the first layer of the group
+    :return: list of (first, stop) indices of the groups
+    """
+    groups, first = [], 0
+    for i in range(1, len(angles) + 1):
+        if i == len(angles) or abs(angles[i] - angles[first]) > tolerance:
+            groups.append((first, i))
+            first = i
+    return groups
+
+
+def stiffness(properties) -> np.ndarray:
+    """
+    :param properties: E1, E2, E3, Nu12, Nu13, Nu23, G12, G13, G23
+    :return: 6x6 stiffness matrix in Voigt notation
+    """
+    E1, E2, E3, nu12, nu13, nu23, G12, G13, G23 = properties
+    S = np.zeros((6, 6))
+    S[0, :3] = 1 / E1, -nu12 / E1, -nu13 / E1
+    S[1, :3] = -nu12 / E1, 1 / E2, -nu23 / E2
+    S[2, :3] = -nu13 / E1, -nu23 / E2, 1 / E3
+    S[3, 3], S[4, 4], S[5, 5] = 1 / G23, 1 / G13, 1 / G12
+    return np.linalg.inv(S)
+
+
+def engineering_constants(C: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param C: (..., 6, 6) stiffness matrices
+    :return: (..., 9) orthotropic engineering constants, and the relative norm of the dropped coupling terms
+    """
+    S = np.linalg.inv(C)
+    d = np.diagonal(S, axis1=-2, axis2=-1)
+    constants = np.stack([1 / d[..., 0], 1 / d[..., 1], 1 / d[..., 2],
+                          -S[..., 0, 1] / d[..., 0], -S[..., 0, 2] / d[..., 0], -S[..., 1, 2] / d[..., 1],
+                          1 / d[..., 5], 1 / d[..., 4], 1 / d[..., 3]], axis=-1)
+    coupling = np.linalg.norm(S * ~ORTHOTROPIC, axis=(-2, -1)) / np.linalg.norm(S, axis=(-2, -1))
+    return constants, coupling
+
+
+def bond_matrices(theta: np.ndarray) -> np.ndarray:
+    """
+    :param theta: rotation angles about axis 3, the stacking direction, in radians
+    :return: (..., 6, 6) matrices M such that C' = M C M^T
+    """
+    c, s = np.cos(theta), np.sin(theta)
+    a = np.zeros(np.shape(theta) + (3, 3))
+    a[..., 0, 0], a[..., 0, 1], a[..., 1, 0], a[..., 1, 1], a[..., 2, 2] = c, s, -s, c, 1.
+    return rotation_bond_matrices(a)
+
+
+def rotation_bond_matrices(a: np.ndarray) -> np.ndarray:
+    """
+    :param a: (..., 3, 3) rotations, a[i, k] is the cosine between the new axis i and the old axis k
+    :return: (..., 6, 6) matrices M such that C' = M C M^T
+    """
+    i, j = np.array(VOIGT).T
+    k, l = i, j
+    M = a[..., i[:, None], k[None, :]] * a[..., j[:, None], l[None, :]]
+    M += (k != l) * a[..., i[:, None], l[None, :]] * a[..., j[:, None], k[None, :]]
+    return M
+
+
+def _mixed(C: np.ndarray) -> np.ndarray:
+    """
+    Stiffness to mixed matrix H, in the order (p, n)
+    """
+    pp = C[..., IN_PLANE, :][..., IN_PLANE]
+    pn = C[..., IN_PLANE, :][..., OUT_OF_PLANE]
+    np_ = C[..., OUT_OF_PLANE, :][..., IN_PLANE]
+    nn_inv = np.linalg.inv(C[..., OUT_OF_PLANE, :][..., OUT_OF_PLANE])
+    return np.concatenate((np.concatenate((pp - pn @ nn_inv @ np_, pn @ nn_inv), axis=-1),
+                           np.concatenate((-nn_inv @ np_, nn_inv), axis=-1)), axis=-2)
+
+
+def _unmixed(H: np.ndarray) -> np.ndarray:
+    """
+    Mixed matrix in the order (p, n) back to stiffness in Voigt order
+    """
+    pp, pn, np_, nn = H[..., :3, :3], H[..., :3, 3:], H[..., 3:, :3], H[..., 3:, 3:]
+    nn_inv = np.linalg.inv(nn)
+    C = np.zeros(H.shape[:-2] + (6, 6))
+    p, n = np.array(IN_PLANE), np.array(OUT_OF_PLANE)
+    C[..., p[:, None], p] = pp - pn @ nn_inv @ np_
+    C[..., p[:, None], n] = pn @ nn_inv
+    C[..., n[:, None], p] = -nn_inv @ np_
+    C[..., n[:, None], n] = nn_inv
+    return C
+
+
+def homogenize(ply: np.ndarray, relative_angles: np.ndarray, weights: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Vectorized over all the layers, and over any leading dimensions of :relative_angles:
+    :param ply: 6x6 stiffness of the ply in its material frame
+    :param relative_angles: (..., layers) angle of every layer relative to the frame of its group, in radians
+    :param weights: (layers,) thickness of every layer
+    :param starts: index of the first layer of every group
+    :return: (..., groups, 6, 6) effective stiffness of the groups
+    """
+    M = bond_matrices(relative_angles)
+    H = _mixed(M @ ply @ np.swapaxes(M, -1, -2)) * weights[:, None, None]
+    axis = H.ndim - 3
+    H = np.add.reduceat(H, starts, axis=axis) / np.add.reduceat(weights, starts)[:, None, None]
+    return _unmixed(H)
+
+
+def layer_thicknesses(curves: CurvesBunch) -> np.ndarray:
+    """
+    :return: thickness of every layer at the cylinder, y = 0
+    """
+    x = np.array([curve.points[-1, 0] for curve in curves.curves])
+    return np.diff(x)
+
+
+def sublaminates(curves: CurvesBunch, tolerance: float = 0., properties=rc.LAYUP_MATERIAL_PROPS) -> Sublaminates:
+    """
+    :param tolerance: maximum difference of winding angle in degrees within a group
+    """
+    angles = np.array([curve.winding_angle for curve in curves.curves[1:]], dtype=float)
+    groups = group_layers(list(angles), tolerance)
+    starts = np.array([first for first, _ in groups])
+    weights = layer_thicknesses(curves)
+
+    # thickness-weighted mean angle of every group, and angle of every layer relative to it
+    group_angles = np.add.reduceat(angles * weights, starts) / np.add.reduceat(weights, starts)
+    reference = np.repeat(group_angles, [stop - first for first, stop in groups])
+    C = homogenize(stiffness(properties), np.radians(angles - reference), weights, starts)
+    constants, coupling = engineering_constants(C)
+
+    reduced = CurvesBunch(curves.curves[0], curves.hoop_end)
+    for (first, stop), angle in zip(groups, group_angles):
+        top = curves.curves[stop]
+        curve = Curve(top.points)
+        curve.winding_angle = float(angle)
+        # the topmost curve of the group shares its head with the topmost curve of the previous group
+        curve.layer_start_index = min(c.layer_start_index for c in curves.curves[first + 1:stop + 1])
+        reduced.add_curve(curve)
+
+    return Sublaminates(groups, [float(angle) for angle in group_angles],
+                       [tuple(float(value) for value in row) for row in constants], coupling, reduced)
+
+
+def homogenization_report(curves: CurvesBunch, result: Sublaminates, element_length: float = rc.LAYUP_MESH_SIZE,
+                          samples: int = 50, properties=rc.LAYUP_MATERIAL_PROPS,
+                          stress_error_limit: float = STRESS_ERROR_LIMIT) -> dict:
+    """
+    Errors of the sublaminate model with respect to the fully resolved one.
+    The constants of a group are computed at the cylinder. Along the dome the winding angles follow Clairaut's
+    relation, sin(alpha) = R sin(alpha_0) / r, hence the angles within a group spread differently. The stiffness of
+    the group is recomputed at several radii and compared with the one used.
+    Both layups are then solved under pressure with src/axisymmetric.py. The ply stresses of the grouped model are
+    recovered from its in-plane strains and out-of-plane stresses, which the mixed averaging assumes continuous, at
+    the local winding angle of every layer of the group
+    Groups whose peak fiber or transverse stress error exceeds :stress_error_limit: are flagged, with a warning
+    :return: dict with per-group stiffness error (relative Frobenius norm, maximum along the meridian; nan for groups of
+    identical angles, whose stiffness is exact by construction), dropped coupling, per-group error of the peak fiber and
+    transverse stresses of its layers (relative to the peak of the layup), the stress error of every group as the larger
+    of both and whether it is within the limit, displacement error at the common nodes (relative to the largest
+    displacement), and the number of elements of both models
+    """
+    from src.axisymmetric import generate_mesh, solve, winding_angles
+
+    R = curves.curves[0].x.max()
+    angles = np.radians([curve.winding_angle for curve in curves.curves[1:]])
+    starts = np.array([first for first, _ in result.groups])
+    counts = [stop - first for first, stop in result.groups]
+    weights = layer_thicknesses(curves)
+    ply = stiffness(properties)
+
+    # radii where all the helical layers exist
+    r = np.linspace(R * np.sin(angles[angles < np.pi / 2]).max(initial=0.), R, samples)[:, None]
+    local = np.arcsin(np.clip(R * np.sin(angles) / r, -1., 1.))  # (samples, layers)
+    local_reference = np.arcsin(np.clip(R * np.sin(np.radians(result.angles)) / r, -1., 1.))
+    exact = homogenize(ply, local - np.repeat(local_reference, counts, axis=1), weights, starts)
+    used = homogenize(ply, angles - np.repeat(np.radians(result.angles), counts), weights, starts)
+    error = np.linalg.norm(exact - used, axis=(-2, -1)) / np.linalg.norm(exact, axis=(-2, -1))
+    mixed = np.maximum.reduceat(angles, starts) > np.minimum.reduceat(angles, starts)
+
+    resolved = solve(generate_mesh(curves, element_length), properties=properties)
+    grouped = solve(generate_mesh(result.curves, element_length), properties=result.properties)
+
+    # displacements of the nodes both meshes share: the stations on the liner and the top curve of every group
+    nodes = {tuple(node): i for i, node in enumerate(np.round(grouped.mesh.nodes, 9))}
+    common = np.array([(i, nodes[tuple(node)]) for i, node in enumerate(np.round(resolved.mesh.nodes, 9))
+                       if tuple(node) in nodes])
+    difference = grouped.displacements[common[:, 1]] - resolved.displacements[common[:, 0]]
+    displacement_error = np.abs(difference).max() / np.abs(resolved.displacements).max()
+
+    # peak fiber and transverse stress of every layer
+    stresses = resolved.material_stresses()[:, :2]
+    exact_peaks = np.array([np.abs(stresses[resolved.mesh.layers == layer]).max(axis=0)
+                            for layer in range(1, len(curves.curves))])
+    H = _mixed(ply)
+    centroids = grouped.mesh.centroids()[:, 0]
+    group_peaks = []
+    for group, (first, stop) in enumerate(result.groups, 1):
+        at = grouped.mesh.layers == group
+        for layer in range(first + 1, stop + 1):
+            layer_angles = grouped.mesh.angles.copy()
+            layer_angles[at] = winding_angles(curves, np.full(at.sum(), layer), centroids[at])
+            strains = grouped.material_strains(layer_angles)[at]
+            out_of_plane = grouped.material_stresses(layer_angles)[at][:, OUT_OF_PLANE]
+            in_plane = strains[:, IN_PLANE] @ H[:3, :3].T + out_of_plane @ H[:3, 3:].T
+            group_peaks.append(np.abs(in_plane[:, :2]).max(axis=0))
+    stress_error = np.abs(np.array(group_peaks) - exact_peaks) / exact_peaks.max(axis=0)
+    stress_error = np.maximum.reduceat(stress_error, starts)
+    within_limit = stress_error.max(axis=1) <= stress_error_limit
+    if not within_limit.all():
+        flagged = ", ".join(f"{first + 1}-{stop}" for (first, stop), ok in zip(result.groups, within_limit) if not ok)
+        warnings.warn(f"peak stress error of the sublaminates above {100 * stress_error_limit:.0f} % "
+                      f"in the groups of layers {flagged}")
+
+    return {'stiffness_error': np.where(mixed, error.max(axis=0), np.nan), 'coupling': result.coupling,
+            'fiber_stress_error': stress_error[:, 0], 'transverse_stress_error': stress_error[:, 1],
+            'stress_error': stress_error.max(axis=1), 'within_limit': within_limit,
+            'displacement_error': float(displacement_error),
+            'elements_resolved': resolved.mesh.n_elements, 'elements_grouped': grouped.mesh.n_elements}
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from src.thickness import main as calculate_layup
+
+    # python ./src/sublaminates.py [tolerance in degrees ...]. By default, groups of identical angles and mixed groups
+    tolerances = [float(arg) for arg in sys.argv[1:]] or [0., 10.]
+    layup = calculate_layup()
+    for tolerance in tolerances:
+        start = time.perf_counter()
+        result = sublaminates(layup, tolerance)
+        elapsed = time.perf_counter() - start
+        report = homogenization_report(layup, result)
+
+        print(f"tolerance {tolerance} deg: {len(layup.curves) - 1} layers in {len(result.groups)} sublaminates "
+              f"({1e3 * elapsed:.1f} ms)")
+        for (first, stop), angle, constants, error, coupling, fiber, transverse, ok in zip(
+                result.groups, result.angles, result.properties, report['stiffness_error'], report['coupling'],
+                report['fiber_stress_error'], report['transverse_stress_error'], report['within_limit']):
+            stiffness_error = "  exact" if np.isnan(error) else f"{100 * error:5.2f} %"
+            print(f"layers {first + 1:2d}-{stop:2d}  {angle:5.1f} deg  E1 {constants[0]:8.0f}  E2 {constants[1]:7.0f}  "
+                  f"G12 {constants[6]:6.0f}  stiffness error {stiffness_error}  coupling {100 * coupling:5.2f} %  "
+                  f"peak stress error: fiber {100 * fiber:6.2f} %, transverse {100 * transverse:6.2f} %"
+                  f"{'' if ok else '  above limit'}")
+        print(f"accuracy: peak stress error up to {100 * report['stress_error'].max():.1f} % "
+              f"(limit {100 * STRESS_ERROR_LIMIT:.0f} %), "
+              f"displacement error at the common nodes {100 * report['displacement_error']:.2f} %")
+        print(f"elements: {report['elements_resolved']} resolved, {report['elements_grouped']} grouped "
+              f"({report['elements_resolved'] / report['elements_grouped']:.1f} x fewer)")
@@ -0,0 +1,425 @@
+# coding=utf-8
+"""
+Distributed sweeps over a shared directory, without a scheduler
+Batches of designs are written as task files to a directory that every node mounts, e.g. over NFS. Any number of
+worker processes, on any node, claim the tasks by renaming them, run the stages of pipeline.py on their designs and
+write the results next to them. A rename within a directory is atomic, also on NFS: every task is claimed only once.
+Files of a task NAME:
+    NAME.task           pending
+    NAME.task.WORKER    claimed by WORKER, which touches it every HEARTBEAT seconds while it runs the task
+    NAME.done           finished. NAME.result.json holds the designs with their KPIs, timings and errors, and
+                        NAME.layups their curves, see src/archive.py
+    NAME.failed         the worker could not run the task (NAME.err), or MAX_ATTEMPTS workers died running it
+    NAME.recovered      workers that died while holding the task, one per line
+Claims not touched for LEASE seconds are taken back from their dead workers by the other workers. The modification
+times are compared with the clock of the file server, read from a file touched for the purpose, so the clocks of the
+nodes need not agree. LEASE must exceed the attribute cache of the NFS clients (acregmax, 60 s by default).
+The run registry is SQLite, which must not be shared over NFS: collect the results on one node, see collect.
+Run from  root '/' directory
+"""
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import asdict, fields
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from src.liner import LinerParameters
+from src.pipeline import Design, Stage, compute_geometry, default_stages, native_stages, run_batch
+
+TASK = '.task'
+HEARTBEAT = 30.  # s between touches of a claim
+LEASE = 300.  # s without touches after which a claim is recovered
+POLL_INTERVAL = 5.  # s between looks at an empty queue
+MAX_ATTEMPTS = 3  # workers that may die on a task before it is failed
+STOP_FILE = 'STOP'
+CLOCK_FILE = '.clock'
+WORKERS = 'workers'  # subdirectory of the heartbeat files of the workers
+STAGES = ('geometry', 'native', 'abaqus')
+
+
+def worker_name() -> str:
+    """
+    :return: host and process id. Without dots: it is a suffix of the claimed files
+    """
+    return f"{socket.gethostname().split('.')[0]}-{os.getpid()}"
+
+
+def worker_stages(stages: str, executor: Executor) -> List[Stage]:
+    """
+    :param stages: one of STAGES: geometry only, geometry and built-in solver, or geometry, CAE, Abaqus and extraction
+    :param executor: where the plain stage functions run
+    """
+    match stages:
+        case 'geometry':
+            return [Stage('geometry', compute_geometry, 1, executor=executor)]
+        case 'native':
+            return native_stages(1, 1, executor)
+        case 'abaqus':
+            return default_stages(1, executor=executor)
+    raise ValueError(f"stages must be one of {STAGES}, not {stages}")
+
+
+# ----- Serialization of the designs, without their curves -----
+
+def design_to_dict(design: Design) -> Dict[str, Any]:
+    data = {f.name: getattr(design, f.name) for f in fields(Design) if f.name not in ('curves', 'liner')}
+    data['angles'] = [float(angle) for angle in design.angles]
+    data['liner'] = None if design.liner is None else asdict(design.liner)
+    return data
+
+
+def design_from_dict(data: Dict[str, Any]) -> Design:
+    data = dict(data)
+    liner = data.pop('liner')
+    return Design(liner=None if liner is None else LinerParameters(**liner), **data)
+
+
+def _write_json(path: str, content: Any) -> None:
+    # only complete files become visible. Hidden while written, not to be taken for a claim
+    directory, name = os.path.split(path)
+    temporary = os.path.join(directory, f".{name}.tmp")
+    with open(temporary, 'w') as file:
+        json.dump(content, file, default=float)
+    os.replace(temporary, path)
+
+
+class SweepQueue:
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, WORKERS), exist_ok=True)
+
+    def path(self, name: str, suffix: str = '') -> str:
+        return os.path.join(self.root, name + suffix)
+
+    # ----- State of the tasks, from the names of the files -----
+    def _names(self, suffix: str) -> List[str]:
+        return sorted(entry[:-len(suffix)] for entry in os.listdir(self.root)
+                      if entry.endswith(suffix) and not entry.startswith('.'))
+
+    def pending(self) -> List[str]:
+        return self._names(TASK)
+
+    def done(self) -> List[str]:
+        return self._names('.done')
+
+    def failed(self) -> List[str]:
+        return self._names('.failed')
+
+    def claims(self) -> List[Tuple[str, str]]:
+        """
+        :return: (task name, worker) of every claimed task
+        """
+        return sorted(tuple(entry.split(TASK + '.', 1)) for entry in os.listdir(self.root)
+                      if TASK + '.' in entry and not entry.startswith('.'))
+
+    def now(self) -> float:
+        """
+        :return: time of the file server, to compare with the modification times of the files
+        """
+        path = self.path(CLOCK_FILE)
+        with open(path, 'a'):
+            pass
+        os.utime(path)
+        return os.stat(path).st_mtime
+
+    def workers(self, lease: float = LEASE) -> List[str]:
+        """
+        :return: workers that have touched their heartbeat file within :lease:
+        """
+        now, directory = self.now(), os.path.join(self.root, WORKERS)
+        return sorted(name for name in os.listdir(directory)
+                      if now - os.stat(os.path.join(directory, name)).st_mtime < lease)
+
+    def status(self) -> Dict[str, int]:
+        return {'pending': len(self.pending()), 'claimed': len(self.claims()), 'done': len(self.done()),
+                'failed': len(self.failed()), 'workers': len(self.workers())}
+
+    # ----- Submission -----
+    def submit(self, designs: Iterable[Design], batch_size: int = 8, stages: str = 'geometry',
+               prefix: str = 'batch') -> List[str]:
+        """
+        Writes the designs as tasks of :batch_size: designs
+        :param stages: see worker_stages
+        :param prefix: of the task names, which are numbered. Must differ from that of the previous submissions
+        :return: task names
+        """
+        if stages not in STAGES:
+            raise ValueError(f"stages must be one of {STAGES}, not {stages}")
+        designs = list(designs)
+        names = []
+        for i in range(0, len(designs), batch_size):
+            name = f"{prefix}_{i // batch_size:05d}"
+            if any(os.path.exists(self.path(name, suffix)) for suffix in (TASK, '.done', '.failed')):
+                raise FileExistsError(f"task {name} already exists in {self.root}")
+            task = {'stages': stages, 'designs': [design_to_dict(design) for design in designs[i:i + batch_size]]}
+            _write_json(self.path(name, TASK), task)
+            names.append(name)
+        return names
+
+    def stop(self) -> None:
+        """ the workers exit once they have finished their current task """
+        with open(self.path(STOP_FILE), 'w'):
+            pass
+
+    def stopped(self) -> bool:
+        return os.path.exists(self.path(STOP_FILE))
+
+    # ----- Workers -----
+    def claim(self, worker: str) -> Optional[str]:
+        """
+        :return: name of the claimed task, or None if there are no pending tasks
+        """
+        for name in self.pending():
+            try:
+                os.rename(self.path(name, TASK), self.path(name, f"{TASK}.{worker}"))  # atomic: one worker succeeds
+            except OSError:
+                continue  # claimed by another worker
+            os.utime(self.path(name, f"{TASK}.{worker}"))  # the rename keeps the time of the submission
+            return name
+        return None
+
+    def beat(self, worker: str) -> None:
+        """ touches the heartbeat file of :worker:, see workers """
+        path = os.path.join(self.root, WORKERS, worker)
+        with open(path, 'a'):
+            pass
+        os.utime(path)
+
+    def touch(self, name: str, worker: str) -> bool:
+        """
+        Touches the claim of task :name: and the heartbeat file of :worker:
+        :return: False if the claim has been lost, i.e., recovered by another worker
+        """
+        self.beat(worker)
+        try:
+            os.utime(self.path(name, f"{TASK}.{worker}"))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def recover(self, worker: str, lease: float = LEASE, max_attempts: int = MAX_ATTEMPTS) -> List[str]:
+        """
+        Takes back the claims not touched for :lease: seconds: pending again, or failed after :max_attempts:
+        :return: names of the recovered tasks
+        """
+        recovered = []
+        now = self.now()
+        for name, owner in self.claims():
+            claimed = self.path(name, f"{TASK}.{owner}")
+            try:
+                if now - os.stat(claimed).st_mtime < lease:
+                    continue
+                # take the claim over first: of several recovering workers, one succeeds
+                os.rename(claimed, self.path(name, f"{TASK}.{worker}"))
+            except OSError:
+                continue
+            os.utime(self.path(name, f"{TASK}.{worker}"))
+            with open(self.path(name, '.recovered'), 'a') as file:
+                file.write(owner + '\n')
+            with open(self.path(name, '.recovered')) as file:
+                attempts = len(file.read().split())
+            if attempts >= max_attempts:
+                self.fail(name, worker, f"{attempts} workers died running it: see {name}.recovered")
+            else:
+                os.rename(self.path(name, f"{TASK}.{worker}"), self.path(name, TASK))
+            recovered.append(name)
+        return recovered
+
+    def load(self, name: str, worker: str) -> Tuple[str, List[Design]]:
+        """
+        :return: stages and designs of a task claimed by :worker:
+        """
+        with open(self.path(name, f"{TASK}.{worker}")) as file:
+            task = json.load(file)
+        return task['stages'], [design_from_dict(design) for design in task['designs']]
+
+    def _finish(self, name: str, worker: str, suffix: str) -> None:
+        try:
+            os.rename(self.path(name, f"{TASK}.{worker}"), self.path(name, suffix))
+        except FileNotFoundError:
+            # recovered while it ran, e.g. during a long pause of the node. Nobody needs to run it again
+            try:
+                os.rename(self.path(name, TASK), self.path(name, suffix))
+            except FileNotFoundError:
+                pass  # claimed again: the new owner writes the same results
+
+    def complete(self, name: str, worker: str, designs: List[Design]) -> None:
+        from src.archive import LayupArchive
+        layups = [(design.design_id, design.curves) for design in designs if design.curves is not None]
+        if layups:
+            path = self.path(name, '.layups')
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')  # left by a dead worker
+            archive = LayupArchive.create(path + '.tmp', capacity=len(layups),
+                                          max_curves=max(len(curves.curves) for _, curves in layups))
+            archive.extend(layups)
+            del archive
+            os.replace(path + '.tmp', path)
+        _write_json(self.path(name, '.result.json'), {'worker': worker,
+                                                       'designs': [design_to_dict(design) for design in designs]})
+        self._finish(name, worker, '.done')
+
+    def fail(self, name: str, worker: str, message: str) -> None:
+        with open(self.path(name, '.err'), 'w') as file:
+            file.write(f"{worker}: {message}")
+        self._finish(name, worker, '.failed')
+
+    # ----- Collection -----
+    def results(self, curves: bool = False) -> List[Design]:
+        """
+        :param curves: load the layups as well, copied into memory
+        :return: designs of the finished tasks, in the order of the task names
+        """
+        from src.archive import LayupArchive
+        designs = []
+        for name in self.done():
+            with open(self.path(name, '.result.json')) as file:
+                batch = [design_from_dict(design) for design in json.load(file)['designs']]
+            if curves and os.path.exists(self.path(name, '.layups')):
+                archive = LayupArchive(self.path(name, '.layups'))
+                for design in batch:
+                    if design.design_id in archive.design_ids:
+                        design.curves = archive.load(archive.find(design.design_id), copy=True)
+            designs.extend(batch)
+        return designs
+
+    def collect(self, registry: str) -> int:
+        """
+        Records the finished designs in a run registry on a local disk, see src/registry.py
+        :return: number of designs recorded
+        """
+        from src.registry import RunRegistry
+        designs = self.results(curves=True)
+        RunRegistry(registry).record_many(designs)
+        return len(designs)
+
+
+class _Heartbeat:
+    """ touches a claim from a thread while the task runs """
+
+    def __init__(self, queue: SweepQueue, name: str, worker: str, interval: float):
+        self.queue, self.name, self.worker, self.interval = queue, name, worker, interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.lost = not self.queue.touch(self.name, self.worker) or self.lost
+
+    def __enter__(self) -> "_Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def work(root: str, worker: Optional[str] = None, poll_interval: float = POLL_INTERVAL,
+         heartbeat: float = HEARTBEAT, lease: float = LEASE, exit_when_empty: bool = False,
+         max_tasks: Optional[int] = None) -> int:
+    """
+    Claims and runs tasks until a STOP file appears in :root:
+    :param worker: name of the worker. worker_name() if None
+    :param exit_when_empty: return once no task is pending nor claimed, instead of waiting for new ones
+    :param max_tasks: return after this many tasks. Unlimited if None
+    :return: number of tasks run
+    """
+    queue = SweepQueue(root)
+    worker = worker_name() if worker is None else worker
+    executor = ThreadPoolExecutor(1)  # one stage at a time: thickness.py relies on module globals
+    count = 0
+    while max_tasks is None or count < max_tasks:
+        if queue.stopped():
+            break
+        queue.beat(worker)
+        queue.recover(worker, lease)
+        name = queue.claim(worker)
+        if name is None:
+            if exit_when_empty and not queue.pending() and not queue.claims():
+                break
+            time.sleep(poll_interval)
+            continue
+
+        start = time.time()
+        with _Heartbeat(queue, name, worker, heartbeat) as beat:
+            try:
+                stages, designs = queue.load(name, worker)
+                designs, _ = run_batch(designs, worker_stages(stages, executor))
+            except Exception:
+                queue.fail(name, worker, traceback.format_exc())
+                status = 'failed'
+            else:
+                queue.complete(name, worker, designs)
+                status = 'done'
+        count += 1
+        lost = ', claim lost meanwhile' if beat.lost else ''
+        print(f"{worker}: {name} {status} in {time.time() - start:.1f} s{lost} ({count} tasks)", flush=True)
+    executor.shutdown()
+    return count
+
+
+if __name__ == "__main__":
+    import csv
+    import multiprocessing
+    import sys
+    import tempfile
+
+    # python ./src/sweep.py submit ROOT sequences.csv [batch size] [geometry|native|abaqus]
+    # python ./src/sweep.py work ROOT       on every node, as many as it has cores for
+    # python ./src/sweep.py status ROOT
+    # python ./src/sweep.py collect ROOT registry.sqlite
+    # python ./src/sweep.py stop ROOT
+    # python ./src/sweep.py demo [nodes] [designs]: local processes as nodes, one of which dies
+    command = sys.argv[1]
+    if command == 'submit':
+        with open(sys.argv[3]) as fh:
+            sequences = [[int(angle.strip()) for angle in row] for row in csv.reader(fh) if row]
+        names = SweepQueue(sys.argv[2]).submit((Design(f"{i:05d}", angles) for i, angles in enumerate(sequences)),
+                                               int(sys.argv[4]) if len(sys.argv) > 4 else 8,
+                                               sys.argv[5] if len(sys.argv) > 5 else 'geometry',
+                                               prefix=time.strftime('batch%Y%m%d%H%M%S'))
+        print(f"{len(sequences)} designs in {len(names)} tasks")
+    elif command == 'work':
+        work(sys.argv[2])
+    elif command == 'status':
+        print(SweepQueue(sys.argv[2]).status())
+    elif command == 'collect':
+        print(f"{SweepQueue(sys.argv[2]).collect(sys.argv[3])} designs recorded")
+    elif command == 'stop':
+        SweepQueue(sys.argv[2]).stop()
+    elif command == 'demo':
+        import src.design_variables as dv
+        nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+        n = int(sys.argv[3]) if len(sys.argv) > 3 else 48
+        root = tempfile.mkdtemp(prefix='sweep_')
+        queue = SweepQueue(root)
+        base = list(dv.get_angles())
+        queue.submit((Design(f"{i:05d}", base[:20 + i % 20]) for i in range(n)), batch_size=4)
+
+        start = time.time()
+        settings = dict(poll_interval=0.1, heartbeat=0.2, lease=2., exit_when_empty=True)
+        processes = [multiprocessing.Process(target=work, args=(root, ), kwargs=settings) for _ in range(nodes)]
+        for process in processes:
+            process.start()
+        # a node dies while it holds a task
+        victim = processes[0]
+        while victim.is_alive() and not any(worker.endswith(f"-{victim.pid}") for _, worker in queue.claims()):
+            time.sleep(0.01)
+        victim.kill()
+        for process in processes:
+            process.join()
+
+        designs = queue.results(curves=True)
+        ids = sorted(design.design_id for design in designs)
+        recovered = [name for name in queue.done() if os.path.exists(queue.path(name, '.recovered'))]
+        print(f"{nodes} workers, one killed: {len(designs)} of {n} designs in {time.time() - start:.1f} s, "
+              f"{'each once' if ids == [f'{i:05d}' for i in range(n)] else 'MISSING OR DUPLICATED'}, "
+              f"tasks recovered from the dead worker: {', '.join(recovered)}")
+        print(f"errors: {sum(design.error is not None for design in designs)}, layups loaded: "
+              f"{sum(design.curves is not None for design in designs)}, status: {queue.status()}")
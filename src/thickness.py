@@ -11,7 +11,9 @@ Run from  root '/' directory
 # True: graphing is enabled, i.e., running standalone, not in the abaqus interpreter
 RUNNING_STANDALONE = __name__ == "__main__"
 
-from typing import List
+import sys
+from itertools import groupby
+from typing import List, Optional
 
 
 import numpy as np
@@ -35,8 +37,9 @@ def define_global_variables(angle: float):
     :param angle: alpha_0. Desired cylindrical-section winding angle.
     :return:
     """
-    global r_0, m_R, m_0, r_b, r_2b, n_R, alpha_0, angle_deg
+    global r_0, m_R, m_0, r_b, r_2b, n_R, alpha_0, angle_deg, polynomial_1
     angle_deg = angle
+    polynomial_1 = None  # see thickness_1
     alpha_0 = np.radians(angle)
     r_0 = R * np.sin(alpha_0)  # Polar opening radius. BC for initial drawing of each layer.
     m_R = 2 * pi * R * np.cos(alpha_0) / b
@@ -98,7 +101,11 @@ def thickness_1():
     """
     # Callable and vectorized. To be called on array of "radius coordinate" values (lin-space)
     # Vector is flipped because of difference in nomenclature between reference and numpy
-    return np.poly1d(np.flip(get_a_vec(alpha_0)))
+    # Memoized until the next angle: consecutive plies of the same angle share it
+    global polynomial_1
+    if polynomial_1 is None:
+        polynomial_1 = np.poly1d(np.flip(get_a_vec(alpha_0)))
+    return polynomial_1
 
 
 # Segment 2
@@ -168,7 +175,7 @@ def smoothen_curve(t: Array1D, curve: Curve):  # TODO fix and refalctor
     return curve
 
 
-def thickness_hoop(y: Array1D, thickness_development: float = 40.) -> Array1D:
+def thickness_hoop(y: Array1D, thickness_development: float = 40., y_start: Optional[float] = None) -> Array1D:
     """
     Calculates the thickness distribution of hoop layers based on a given vertical position array.
 
@@ -176,6 +183,8 @@ def thickness_hoop(y: Array1D, thickness_development: float = 40.) -> Array1D:
     - y (array-like): Array of vertical positions.
     - thickness_development (float, optional): Distance in mm it takes a hoop layer to achieve max thickness.
         Default is 20.
+    - y_start (float, optional): y coordinate at which the hoop layer ends, see CurvesBunch.hoop_end.
+        Default is max_y_hoop.
 
     Returns:
     - t (numpy array): Array representing the thickness distribution.
@@ -184,7 +193,8 @@ def thickness_hoop(y: Array1D, thickness_development: float = 40.) -> Array1D:
     y = np.asarray(y)
     t = np.zeros(y.shape)
 
-    y_start = max_y_hoop  # starting y position of the hoop layer
+    if y_start is None:
+        y_start = max_y_hoop  # starting y position of the hoop layer
     t_0 = t_hoop
 
     y_end = y_start - thickness_development  # ending y position of the hoop development
@@ -228,30 +238,30 @@ def detect_layer_start(prev: Curve, new: Curve) -> int:
     return first
 
 
-def calculate_layer_points(previous_topmost: Curve, smoothing_threshold=30) -> Curve:
+def ply_thickness(previous_topmost: Curve, hoop_end: Optional[float] = None) -> Array1D:
     """
-    :param previous_topmost: previous curve
-    :param smoothing_threshold: Minimum angle at which neck smoothing occurs
+    :param hoop_end: y coordinate at which hoop layers end, see CurvesBunch.hoop_end
+    :return: thickness of a ply of the current angle at the points of :previous_topmost:
     """
-    # unpack values
-    x, y = previous_topmost.get_unpacked_xy()
-
-    # calculate the appropriate thickness distribution
     match angle_deg:
         case 90.:
-            t = thickness_hoop(y)
+            return thickness_hoop(previous_topmost.y, y_start=hoop_end)
         case _:
-            t = thickness(x)
+            return thickness(previous_topmost.x)
 
-    dx = np.gradient(x)  # derivative wrt parameter of parametric curve, i.e., index
-    dy = np.gradient(y)
-    den = np.sqrt(dx ** 2 + dy ** 2)
-    # calculate new points
-    x = x - t * dy / den
-    y = y + t * dx / den
-    # compensate for the loss of a point when applying diff
 
-    new_curve = Curve.from_unpacked_xy(x, y)
+def calculate_layer_points(previous_topmost: Curve, smoothing_threshold=30, t: Optional[Array1D] = None) -> Curve:
+    """
+    :param previous_topmost: previous curve
+    :param smoothing_threshold: Minimum angle at which neck smoothing occurs
+    :param t: thickness at the points of :previous_topmost:, e.g. of several plies at once. One ply if None
+    """
+    # calculate the appropriate thickness distribution
+    if t is None:
+        t = ply_thickness(previous_topmost)
+
+    # calculate new points, offset along the normals of the previous curve
+    new_curve = Curve(previous_topmost.points + t[:, None] * previous_topmost.normals)
 
     # --- smoothing to enter neck ---
     if angle_deg < smoothing_threshold:
@@ -272,10 +282,9 @@ def calculate_layer_points(previous_topmost: Curve, smoothing_threshold=30) -> C
 def interpolate_layer_region_constant_arclength(curve: Curve, arclength=5) -> Curve:
     pts = curve.get_layer_points().copy()
 
-    # Compute the cumulative arc length
-    diff = np.diff(pts, axis=0)
-    distances = np.sqrt((diff ** 2).sum(axis=1))  # 1-D array
-    cumulative_length = np.insert(np.cumsum(distances), 0, 0)
+    # Cumulative arc length of the layer region
+    idx = curve.layer_start_index
+    cumulative_length = curve.arclength if idx is None else curve.arclength[idx:] - curve.arclength[idx]
     # Interpolate based on arc length
     # Determine the desired distance between interpolated points
 
@@ -284,27 +293,51 @@ def interpolate_layer_region_constant_arclength(curve: Curve, arclength=5) -> Cu
     interp_func = interp1d(cumulative_length, pts, kind=interpolator_kind, axis=0)
 
     if curve.layer_start_index is None:  # Liner
-        curve.points = interp_func(s)
+        points = interp_func(s)
     else:
         head = curve.get_non_layer_points()
         tail = interp_func(s)
-        curve.points = np.concatenate((head, tail), axis=0)
-    curve.points[-1, -1] = 0.  # Guarantee that the curve finishes in y=0
+        points = np.concatenate((head, tail), axis=0)
+    points[-1, -1] = 0.  # Guarantee that the curve finishes in y=0
+    curve.points = points
     return curve
 
 
-def calculate_layup(angles: List[float], liner: Curve) -> CurvesBunch:
+def calculate_layup(angles: List[float], liner: Curve, block_tolerance: Optional[float] = None,
+                    workspace=None, hoop_end: Optional[float] = None) -> CurvesBunch:
+    """
+    :param block_tolerance: stack runs of identical angles in blocks, see stack_blocks. Ply by ply if None
+    :param workspace: stack ply by ply in the buffers of this stacking.Workspace, without temporary arrays
+    :param hoop_end: y coordinate at which the hoop layers end, kept with the layup as CurvesBunch.hoop_end.
+    max_y_hoop if None
+    """
     # data initialization
-    curves = CurvesBunch(liner)  # initialize container
+    curves = CurvesBunch(liner, hoop_end)  # initialize container
     global R
     R = liner.x.max()
-    topmost_curve = liner
+
+    if block_tolerance is not None:
+        return stack_blocks(curves, angles, block_tolerance)
+    if workspace is not None:
+        from src.stacking import stack_layers as stack_layers_in
+        return stack_layers_in(curves, angles, workspace)
+    return stack_layers(curves, angles)
+
+
+def stack_layers(curves: CurvesBunch, angles: List[float]) -> CurvesBunch:
+    """
+    Stacks layers on top of the topmost curve of the bunch. R must be already defined.
+    :param curves: bunch to which the new curves are added. Its hoop layers end at curves.hoop_end
+    :param angles: winding angles of the new layers
+    """
+    topmost_curve = curves.curves[-1]
 
     for angle in angles:
         # overwrite globals
         define_global_variables(angle)
         # calculate new curve
-        topmost_curve = calculate_layer_points(topmost_curve, 30)  # TODO points and index, no need to replicate data
+        t = ply_thickness(topmost_curve, curves.hoop_end)
+        topmost_curve = calculate_layer_points(topmost_curve, 30, t)  # TODO points and index, no need to replicate data
         # add new Curve to Bunch
         topmost_curve = interpolate_layer_region_constant_arclength(topmost_curve)
         topmost_curve.winding_angle = angle
@@ -315,6 +348,106 @@ def calculate_layup(angles: List[float], liner: Curve) -> CurvesBunch:
     return curves
 
 
+def stack_blocks(curves: CurvesBunch, angles: List[float], tolerance: float = np.inf) -> CurvesBunch:
+    """
+    Fast, approximate version of stack_layers. A block of k consecutive plies of the same angle is offset in one step,
+    by k times the thickness of its first ply, and resampled once. The surfaces of the plies within the block are
+    interpolated between its bottom and top.
+    The thickness is evaluated on the bottom of the block instead of on every ply, so the deviation from stacking ply
+    by ply grows with the block, mostly at the polar opening. It is estimated by step doubling: one step of k plies
+    deviates about twice as much as it differs from two steps of k / 2 plies.
+    The tolerance only decides where blocks are split. It is not the accuracy of the layup: every block is stacked on
+    the deviated top of the ones below, and the plies within a block may deviate more than its top. On the default
+    layup, whole runs (inf) are about 4 times faster than stacking ply by ply and deviate by 1.6 mm; finite tolerances
+    from 1 to 0.05 mm are only 1.1 to 1.9 times faster and deviate by 0.6 to 0.12 mm, above the tolerance from 0.2 mm
+    down. Compare with layup_deviation, e.g. with python ./src/thickness.py --blocks
+    :param curves: bunch to which the new curves are added
+    :param angles: winding angles of the new layers
+    :param tolerance: blocks are halved while the estimated deviation of their top from the curve below them exceeds
+        it, in mm. Whole runs of identical angles if inf, without estimating
+    """
+    topmost_curve = curves.curves[-1]
+
+    for angle, run in groupby(angles):
+        define_global_variables(angle)
+        remaining = size = len(list(run))
+        while remaining:
+            size = min(size, remaining)
+            t = ply_thickness(topmost_curve, curves.hoop_end)
+            top = calculate_layer_points(topmost_curve, 30, size * t)
+            while size > 1 and np.isfinite(tolerance) and block_deviation(topmost_curve, top, t, size,
+                                                                          curves.hoop_end) > tolerance:
+                size //= 2
+                top = calculate_layer_points(topmost_curve, 30, size * t)
+
+            # plies within the block, offset from its bottom by the same thickness profile
+            for ply in range(1, size):
+                curve = calculate_layer_points(topmost_curve, 30, ply * t)
+                curve.winding_angle = angle
+                curves.add_curve(curve)
+            topmost_curve = interpolate_layer_region_constant_arclength(top)
+            topmost_curve.winding_angle = angle
+            curves.add_curve(topmost_curve)
+            remaining -= size
+
+    return curves
+
+
+def block_deviation(bottom: Curve, top: Curve, t: Array1D, plies: int, hoop_end: Optional[float] = None) -> float:
+    """
+    :param top: :plies: plies offset at once from :bottom:
+    :param t: thickness of one ply at the points of :bottom:
+    :param hoop_end: see ply_thickness
+    :return: estimated deviation of :top: from stacking ply by ply, in mm
+    """
+    half = plies // 2
+    middle = calculate_layer_points(bottom, 30, half * t)
+    two_steps = calculate_layer_points(middle, 30, (plies - half) * ply_thickness(middle, hoop_end))
+    # both keep the points of the bottom: no need to search the closest ones
+    return 2. * float(np.linalg.norm(top.points - two_steps.points, axis=1).max())
+
+
+def curve_distance(curve: Curve, reference: Curve) -> float:
+    """
+    :return: largest distance from the points of :curve: to the polyline of :reference:
+    """
+    p = curve.points[:, None, :]
+    a = reference.points[:-1]
+    d = reference.points[1:] - a
+    s = np.einsum('nmk,mk->nm', p - a, d) / np.maximum(np.einsum('mk,mk->m', d, d), 1e-12)
+    distances = np.linalg.norm(p - a - np.clip(s, 0., 1.)[..., None] * d, axis=2)
+    return float(distances.min(axis=1).max())
+
+
+def layup_deviation(curves: CurvesBunch, reference: CurvesBunch) -> Array1D:
+    """
+    :param curves: layup stacked in blocks, see stack_blocks
+    :param reference: same layup stacked ply by ply
+    :return: deviation of every layer, the Hausdorff distance between its curves, in mm
+    """
+    return np.array([max(curve_distance(curve, other), curve_distance(other, curve))
+                     for curve, other in zip(curves.curves[1:], reference.curves[1:])])
+
+
+def recalculate_layup(curves: CurvesBunch, angles: List[float], first: int) -> CurvesBunch:
+    """
+    Incremental version of calculate_layup. The layers below :first: are reused, the rest is stacked again.
+    :param curves: previous result. Is not modified
+    :param angles: complete, new stacking sequence
+    :param first: index in :angles: of the first layer to be recalculated
+    :return: new bunch sharing the unchanged curves with :curves:
+    """
+    global R
+    liner = curves.curves[0]
+    R = liner.x.max()
+
+    new_curves = CurvesBunch(liner, curves.hoop_end)
+    for curve in curves.curves[1:first + 1]:
+        new_curves.add_curve(curve)
+
+    return stack_layers(new_curves, angles[first:])
+
+
 def update_layup_graph(curve: Curve):
     x, y = curve.get_layer_unpacked_xy()
 
@@ -331,16 +464,38 @@ def update_layup_graph(curve: Curve):
             line3, = ax2.plot(x, thickness(x), disp)
 
 
-def main():
-    filename = r'.\resources\liner.csv'
-    liner = Curve(np.loadtxt(filename, delimiter=",", skiprows=0))
+def cylinder_top(liner: Curve, tolerance: float = 1e-6) -> float:
+    """
+    :return: highest y of the points of the liner at the cylinder radius, where the dome begins
+    """
+    return float(liner.y[liner.x >= liner.x.max() - tolerance].max())
 
-    # extract points from liner
 
+def main(angles: Optional[List[float]] = None, liner: Optional[Curve] = None,
+         block_tolerance: Optional[float] = None, workspace=None, verbose: bool = True):
+    """
+    :param angles: stacking sequence. Defaults to the one in design_variables
+    :param liner: liner shape, e.g., from liner.generate_liner. Defaults to the one in /resources/liner.csv, for which
+    the hoop layers end at max_y_hoop. They end at the top of the cylinder of any other liner, see CurvesBunch.hoop_end
+    :param block_tolerance: stack runs of identical angles in blocks, for screening. See stack_blocks
+    :param workspace: stacking.Workspace to stack in, e.g. one per process for sweeps
+    :param verbose: print the stacking sequence. Off in batches, see pipeline.compute_geometry
+    """
     global R
+    hoop_end = None
+    if liner is None:
+        filename = r'.\resources\liner.csv'
+        liner = Curve(np.loadtxt(filename, delimiter=",", skiprows=0))
+    else:
+        hoop_end = cylinder_top(liner)
+
+    # extract points from liner
+
     R = liner.x.max()
-    angles = dv.get_angles()
-    print(angles)
+    if angles is None:
+        angles = dv.get_angles()
+    if verbose:
+        print(angles)
     # initial values are those of the liner
     define_global_variables(angles[0])
 
@@ -349,7 +504,7 @@ def main():
     if RUNNING_STANDALONE:
         initialize_plots(liner)
 
-    curves: CurvesBunch = calculate_layup(angles, liner)
+    curves: CurvesBunch = calculate_layup(angles, liner, block_tolerance, workspace, hoop_end)
 
     return curves
 
@@ -376,7 +531,28 @@ def initialize_plots(curve: Curve) -> None:
 
 MINIMUM_THICKNESS_THRESHOLD = 0.2
 r_0 = m_R = m_0 = r_b = r_2b = n_R = alpha_0 = angle_deg = R = t_p = 0.
-if __name__ == "__main__":
+polynomial_1 = None
+if __name__ == "__main__" and '--blocks' in sys.argv:
+    # Block stacking against ply by ply: python ./src/thickness.py --blocks [tolerance in mm ...]
+    from timeit import repeat
+    RUNNING_STANDALONE = False
+    tolerances = [float(arg) for arg in sys.argv[sys.argv.index('--blocks') + 1:]] or [np.inf, 1., 0.5, 0.2]
+    angles = dv.get_angles()
+    liner = Curve(np.loadtxt(r'.\resources\liner.csv', delimiter=","))
+    R = liner.x.max()
+    define_global_variables(angles[0])
+    liner = interpolate_layer_region_constant_arclength(liner, arclength=1)
+
+    reference = calculate_layup(angles, liner)
+    elapsed = min(repeat(lambda: calculate_layup(angles, liner), number=1, repeat=5))
+    print(f"{len(angles)} plies, ply by ply: {elapsed * 1e3:.1f} ms")
+    for tolerance in tolerances:
+        blocks = calculate_layup(angles, liner, tolerance)
+        speedup = elapsed / min(repeat(lambda: calculate_layup(angles, liner, tolerance), number=1, repeat=5))
+        deviation = layup_deviation(blocks, reference)
+        print(f"blocks split at {tolerance} mm: {speedup:.1f} times faster, deviation of the layers max "
+              f"{deviation.max():.3f} mm, mean {deviation.mean():.3f} mm")
+elif __name__ == "__main__":
 
     # Initialize global variables
 
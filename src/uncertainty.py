@@ -0,0 +1,349 @@
+# coding=utf-8
+"""
+Manufacturing variability of the layup
+Monte Carlo over the roving bandwidth b, the ply thickness t_P, the laminate thickness t_R (and optionally t_hoop).
+The thickness and stacking math of thickness.py is rewritten with a leading sample dimension: all the perturbed layups
+are computed in one vectorized pass, as arrays of shape (samples, points), instead of one calculate_layup call each.
+As in interpolate_layer_region_constant_arclength, the points before the layer start are kept and the layer region is
+resampled every 5 mm of arclength, hence the number of points of a curve differs between the samples. To keep the
+arrays rectangular, every curve is padded to the number of points of the liner with its last point, which adds nothing
+to the moments of mass.first_moments. The sample of the nominal parameters reproduces calculate_layup to round-off.
+Run from  root '/' directory
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from numpy import pi
+
+import src.design_variables as dv
+import src.routines.routine_constants as rc
+import src.thickness as th
+from model import Curve, CurvesBunch, Array2D
+from src.mass import first_moments
+
+type Parameters = Dict[str, np.ndarray]  # name -> array of length N
+
+
+@dataclass
+class ManufacturingVariability:
+    # standard deviations, in mm, of normally distributed deviations from the nominal values in thickness
+    b: float = 0.5
+    t_P: float = 0.01
+    t_R: float = 0.02
+    t_hoop: float = 0.
+
+
+def sample_parameters(n: int, variability: ManufacturingVariability = ManufacturingVariability(),
+                      seed: Optional[int] = None) -> Parameters:
+    rng = np.random.default_rng(seed)
+    parameters = {}
+    for name in ('b', 't_P', 't_R', 't_hoop'):
+        nominal = getattr(th, name)
+        values = nominal + getattr(variability, name) * rng.standard_normal(n)
+        parameters[name] = np.clip(values, 0.1 * nominal, None)  # keep them physical
+    return parameters
+
+
+# ----- Vectorized versions of the thickness routines. Arrays of shape (N, P), parameters of shape (N, 1) -----
+
+def _a_vectors(alpha_0: float, R: float, b, t_R, t_P) -> np.ndarray:
+    """
+    Batched thickness.get_a_vec. The integrals are solved in closed form instead of with quad.
+    :return: (N, 4) coefficients of the cubic thickness polynomial of region 1
+    """
+    r_0 = R * np.sin(alpha_0)
+    m_R = 2 * pi * R * np.cos(alpha_0) / b
+    m_0 = 2 * pi * r_0 * np.cos(alpha_0) / b
+    r_b, r_2b = r_0 + b, r_0 + 2 * b
+    n_R = t_R / (2 * t_P)
+
+    def pd(degree):
+        return r_2b ** degree - r_0 ** degree
+
+    ones, zeros = np.ones_like(r_2b), np.zeros_like(r_2b)
+    A = np.stack([
+        np.stack([ones, r_0 * ones, r_0 ** 2 * ones, r_0 ** 3 * ones], axis=-1),
+        np.stack([ones, r_2b, r_2b ** 2, r_2b ** 3], axis=-1),
+        np.stack([zeros, ones, 2 * r_2b, 3 * r_2b ** 2], axis=-1),
+        np.stack([pi * pd(2), 2 * pi / 3 * pd(3), pi / 2 * pd(4), 2 * pi / 5 * pd(5)], axis=-1),
+    ], axis=-2)
+
+    c_0 = t_R * pi * R * np.cos(alpha_0) / (m_0 * b)
+    c_1 = m_R * n_R / pi * (np.arccos(r_0 / r_2b) - np.arccos(r_b / r_2b)) * t_P
+    c_2 = m_R * n_R / pi * (r_0 / (r_2b * np.sqrt(pd(2))) - r_b / (r_2b * np.sqrt(r_2b ** 2 - r_b ** 2))) * t_P
+    # int_1 = integral of r arccos(r_0 / r) from r_0 to r_b
+    int_1 = r_b ** 2 / 2 * np.arccos(r_0 / r_b) - r_0 / 2 * np.sqrt(r_b ** 2 - r_0 ** 2)
+    # int_2 = integral of r (arccos(r_0 / r_2b) - arccos(r_b / r_2b)) from r_b to r_2b
+    int_2 = (np.arccos(r_0 / r_2b) - np.arccos(r_b / r_2b)) * (r_2b ** 2 - r_b ** 2) / 2
+    c_3 = 2. * m_R * n_R * t_P * (int_1 + int_2)
+    c = np.stack([c_0, c_1, c_2, c_3], axis=-1)
+
+    return np.linalg.solve(A, c[..., None])[..., 0]
+
+
+def thickness(r: np.ndarray, alpha_0: float, R: float, b, t_R, t_P) -> np.ndarray:
+    """
+    Batched thickness.thickness for helical layers
+    """
+    r_0 = R * np.sin(alpha_0)
+    m_R = 2 * pi * R * np.cos(alpha_0) / b
+    r_b, r_2b = r_0 + b, r_0 + 2 * b
+    n_R = t_R / (2 * t_P)
+
+    a = _a_vectors(alpha_0, R, b[:, 0], t_R[:, 0], t_P[:, 0])
+    t_1 = a[:, 0:1] + r * (a[:, 1:2] + r * (a[:, 2:3] + r * a[:, 3:4]))  # Horner
+    t = t_1 * ((t_1 >= 0) & (r <= r_2b))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_2 = (m_R * n_R / pi) * (np.arccos(np.minimum(r_0 / r, 1)) - np.arccos(np.minimum(r_b / r, 1))) * t_P
+    t += np.nan_to_num(t_2) * (r_2b < r)
+
+    t[t <= th.MINIMUM_THICKNESS_THRESHOLD] = 0.
+    return t
+
+
+def thickness_hoop(y: np.ndarray, t_hoop, y_start: float, thickness_development: float = 40.) -> np.ndarray:
+    """
+    Batched thickness.thickness_hoop
+    """
+    idx_start = np.argmin(np.abs(y - y_start), axis=1)[:, None]
+    idx_end = np.argmin(np.abs(y - (y_start - thickness_development)), axis=1)[:, None]
+    j = np.arange(y.shape[1])
+    count = np.abs(idx_start - idx_end)
+    ramp = (j >= idx_start) & (j < idx_end)
+    t = t_hoop * np.sqrt(np.clip(j - idx_start, 0, None) / np.maximum(count - 1, 1)) * ramp
+    return np.where(j >= idx_end, t_hoop, t)
+
+
+def smoothen_curves(t: np.ndarray, x: np.ndarray, y: np.ndarray) -> None:
+    """
+    Batched thickness.smoothen_curve. Modifies x and y in place
+    """
+    rows = np.arange(len(y))[:, None]
+    j = np.arange(y.shape[1])
+    max_y_idx = (y * (t > 0)).argmax(axis=1)[:, None]
+    y_max = y[rows, max_y_idx]
+    x_max = x[rows, max_y_idx]
+    aux_mask = (j < max_y_idx) & (y < y_max)
+
+    count = aux_mask.sum(axis=1, keepdims=True)
+    first = aux_mask.argmax(axis=1)[:, None]
+    x_first = x[rows, first] + 1
+    rank = np.cumsum(aux_mask, axis=1) - 1
+    new_x = x_first + (x_max - x_first) * rank / np.maximum(count - 1, 1)
+    y[aux_mask] = np.broadcast_to(y_max, y.shape)[aux_mask]
+    x[aux_mask] = new_x[aux_mask]
+
+
+def resample_layer_regions(x: np.ndarray, y: np.ndarray, start: np.ndarray, lengths: np.ndarray,
+                           arclength: float = 5.) -> np.ndarray:
+    """
+    Batched interpolate_layer_region_constant_arclength: the points from :start: onward are resampled every
+    :arclength: mm, and the rows are padded with their last point. Modifies x and y.
+    The interpolation of all rows is done at once on the flattened cumulative arclength.
+    :param lengths: number of points of every row. The points after them must repeat the last one
+    :return: new number of points of every row
+    """
+    n, p = x.shape
+    rows = np.arange(n)[:, None]
+    segments = np.hypot(np.diff(x, axis=1), np.diff(y, axis=1))
+    cumulative = np.concatenate((np.zeros((n, 1)), np.cumsum(segments, axis=1)), axis=1)  # constant on the padding
+
+    start = np.clip(start, 0, lengths - 2)[:, None]
+    j = np.arange(p)
+    s_start = cumulative[rows, start]
+    s_end = cumulative[:, -1:]
+    new_lengths = start[:, 0] + np.ceil((s_end - s_start)[:, 0] / arclength).astype(int)  # as np.arange
+    if new_lengths.max() > p:
+        raise ValueError(f"{new_lengths.max()} points do not fit in the {p} of the liner")
+    target = np.where(j >= start, s_start + (j - start) * arclength, cumulative)
+
+    # make rows disjoint so that a single searchsorted serves all of them
+    shift = (np.arange(n) * (s_end.max() + 1.))[:, None]
+    idx = np.searchsorted((cumulative + shift).ravel(), (target + shift).ravel(), side='right') - 1
+    # flat index of the segment of every point, within the points of its row
+    idx = np.clip(idx.reshape(n, p), rows * p, rows * p + lengths[:, None] - 2)
+
+    x_0, y_0 = x.take(idx), y.take(idx)
+    dx, dy = x.take(idx + 1) - x_0, y.take(idx + 1) - y_0
+    length = np.hypot(dx, dy)
+    weight = np.divide(target - cumulative.take(idx), length, out=np.zeros_like(length), where=length > 0)
+    keep = j < start
+    np.copyto(x, x_0 + weight * dx, where=~keep)
+    np.copyto(y, y_0 + weight * dy, where=~keep)
+    last = new_lengths[:, None] - 1
+    y[rows, last] = 0.  # Guarantee that the curves finish in y=0
+    padding = j > last
+    np.copyto(x, x[rows, last], where=padding)
+    np.copyto(y, y[rows, last], where=padding)
+    return new_lengths
+
+
+@dataclass
+class LayupSamples:
+    parameters: Parameters
+    angles: List[float]
+    points: np.ndarray  # (N, curves, P, 2), the first curve is the liner. Padded with the last point of every curve
+    layer_start: np.ndarray  # (N, curves), -1 for the liner
+    lengths: np.ndarray  # (N, curves) number of points of every curve
+    hoop_end: Optional[float] = None  # see CurvesBunch.hoop_end
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def envelopes(self, percentiles: Sequence[float] = (5., 50., 95.), resolution: int = 500) -> np.ndarray:
+        """
+        The layer region of every curve, from its layer start to the cylinder, is resampled in every sample on
+        :resolution: points evenly spaced in arclength: point i lies at the fraction i / (resolution - 1) of the length
+        of the layer in every sample. The heads before the layer starts and the padding are left out
+        :return: (len(percentiles), curves, resolution, 2) percentiles of the coordinates of these points
+        """
+        n, curves, p, _ = self.points.shape
+        rows = np.arange(n)
+        fractions = np.linspace(0., 1., resolution)
+        resampled = np.empty((n, curves, resolution, 2))
+        for k in range(curves):
+            points = self.points[:, k]
+            start, last = np.maximum(self.layer_start[:, k], 0), self.lengths[:, k] - 1
+            cumulative = np.concatenate((np.zeros((n, 1)), np.cumsum(np.linalg.norm(np.diff(points, axis=1), axis=2),
+                                                                     axis=1)), axis=1)
+            s_start, s_end = cumulative[rows, start], cumulative[rows, last]
+            target = s_start[:, None] + fractions * (s_end - s_start)[:, None]
+            # make rows disjoint so that a single interpolation serves all of them
+            shift = (rows * (cumulative[:, -1].max() + 1.))[:, None]
+            for axis in (0, 1):
+                resampled[:, k, :, axis] = np.interp(target + shift, (cumulative + shift).ravel(),
+                                                     points[..., axis].ravel())
+        return np.percentile(resampled, percentiles, axis=0)
+
+    def layer_volumes(self) -> np.ndarray:
+        """
+        :return: (N, layers) revolved volume of every layer, as in mass.layer_volumes
+        """
+        n, curves, p, _ = self.points.shape
+        moments = first_moments(self.points.reshape(-1, 2), np.repeat(np.arange(n * curves), p), n * curves)
+        return 2 * pi * np.abs(np.diff(moments.reshape(n, curves), axis=1)) / 6.
+
+    def masses(self, density: float = rc.LAYUP_DENSITY) -> np.ndarray:
+        """
+        :return: (N,) composite mass of every sample
+        """
+        return density * self.layer_volumes().sum(axis=1)
+
+    def total_thickness(self) -> np.ndarray:
+        """
+        :return: (N,) thickness of the laminate at the cylinder, y = 0
+        """
+        return self.points[:, -1, -1, 0] - self.points[:, 0, -1, 0]
+
+    def to_bunch(self, i: int) -> CurvesBunch:
+        """
+        :return: sample :i: as a CurvesBunch, e.g., to be exported to CAE
+        """
+        curves = CurvesBunch(Curve(self.points[i, 0, :self.lengths[i, 0]].copy()), self.hoop_end)
+        for k, angle in enumerate(self.angles, start=1):
+            curve = Curve(self.points[i, k, :self.lengths[i, k]].copy())
+            curve.winding_angle = angle
+            curve.layer_start_index = int(self.layer_start[i, k])
+            curves.add_curve(curve)
+        return curves
+
+
+def _stack_chunk(points: np.ndarray, starts: np.ndarray, lengths: np.ndarray, angles: Sequence[float], R: float, b,
+                 t_P, t_R, t_hoop, hoop_end: float, smoothing_threshold: float) -> None:
+    """
+    Stacks the layers of a chunk of samples. The liner must already be in points[:, 0]. Fills :points:, :starts: and
+    :lengths:
+    """
+    x, y = points[:, 0, :, 0].copy(), points[:, 0, :, 1].copy()
+    starts[:, 0] = -1
+    lengths[:, 0] = x.shape[1]
+    valid = np.ones(x.shape, dtype=bool)
+
+    for k, angle in enumerate(angles, start=1):
+        if angle == 90:
+            t = thickness_hoop(y, t_hoop, hoop_end)
+        else:
+            t = thickness(x, np.radians(angle), R, b, t_R, t_P)
+        t[~valid] = 0.
+
+        # normals of Curve: the padding repeats the last point, where the central difference is the one-sided one
+        dx = np.gradient(x, axis=1)
+        dy = np.gradient(y, axis=1)
+        den = np.sqrt(dx ** 2 + dy ** 2)
+        den[~valid] = 1.
+        new_x = x + t * -(dy / den)
+        new_y = y + t * (dx / den)
+        if angle < smoothing_threshold:
+            smoothen_curves(t, new_x, new_y)
+
+        start = np.argmax((new_x != x) | (new_y != y), axis=1) - 1
+        lengths[:, k] = resample_layer_regions(new_x, new_y, start, lengths[:, k - 1])
+        valid = np.arange(x.shape[1]) < lengths[:, k, None]
+        x, y = new_x, new_y
+        points[:, k, :, 0], points[:, k, :, 1] = x, y
+        starts[:, k] = start
+
+
+def calculate_layup_samples(angles: Sequence[float], liner: Curve, parameters: Parameters,
+                            smoothing_threshold: float = 30, chunk_size: int = 64,
+                            hoop_end: Optional[float] = None) -> LayupSamples:
+    """
+    Vectorized calculate_layup over the samples of the parameters
+    :param liner: liner shape, already resampled as in thickness.main
+    :param parameters: arrays of b, t_P, t_R and t_hoop, see sample_parameters
+    :param chunk_size: number of samples stacked at once. Chunks whose arrays fit in the CPU cache are faster than a
+    single pass over all the samples
+    :param hoop_end: y coordinate at which the hoop layers end, see CurvesBunch.hoop_end. thickness.max_y_hoop if None
+    """
+    n = len(parameters['b'])
+    b, t_P, t_R, t_hoop = (np.asarray(parameters[name], dtype=float)[:, None] for name in ('b', 't_P', 't_R', 't_hoop'))
+    R = liner.x.max()
+    hoop_end = th.max_y_hoop if hoop_end is None else hoop_end
+
+    points = np.empty((n, len(angles) + 1, len(liner.points), 2))
+    starts = np.empty((n, len(angles) + 1), dtype=int)
+    lengths = np.empty((n, len(angles) + 1), dtype=int)
+    points[:, 0] = liner.points
+    for i in range(0, n, chunk_size):
+        chunk = slice(i, i + chunk_size)
+        _stack_chunk(points[chunk], starts[chunk], lengths[chunk], angles, R, b[chunk], t_P[chunk], t_R[chunk],
+                     t_hoop[chunk], hoop_end, smoothing_threshold)
+
+    return LayupSamples(parameters, list(angles), points, starts, lengths, hoop_end)
+
+
+if __name__ == "__main__":
+    import time
+
+    filename = r'.\resources\liner.csv'
+    liner = Curve(np.loadtxt(filename, delimiter=",", skiprows=0))
+    th.R = liner.x.max()
+    liner = th.interpolate_layer_region_constant_arclength(liner, arclength=1)
+    angles = dv.get_angles()
+
+    n = 1000
+    start = time.perf_counter()
+    samples = calculate_layup_samples(angles, liner, sample_parameters(n, seed=0))
+    elapsed = time.perf_counter() - start
+    print(f"{n} samples of {len(angles)} layers in {elapsed:.2f} s")
+
+    masses = samples.masses() * 1e3
+    print("mass percentiles 5/50/95: {:.3f} / {:.3f} / {:.3f} kg".format(*np.percentile(masses, (5, 50, 95))))
+    print("laminate thickness at the cylinder 5/50/95: {:.2f} / {:.2f} / {:.2f} mm".format(
+        *np.percentile(samples.total_thickness(), (5, 50, 95))))
+    low, _, high = samples.envelopes()
+    gaps = np.linalg.norm(high - low, axis=2).max(axis=1)
+    print(f"largest distance between the 5 and 95 % envelopes: {gaps.max():.2f} mm, curve {gaps.argmax()}")
+
+    # without variability, the sample is the layup of calculate_layup
+    nominal = calculate_layup_samples(angles, liner, sample_parameters(1, ManufacturingVariability(0., 0., 0., 0.)))
+    from src.mass import composite_mass
+    reference = th.calculate_layup(angles, liner)
+    sample = nominal.to_bunch(0)
+    same = all(len(a.points) == len(b.points) and a.layer_start_index == b.layer_start_index
+               for a, b in zip(reference.curves, sample.curves))
+    deviation = max(np.abs(a.points - b.points).max() for a, b in zip(reference.curves, sample.curves)) if same else np.nan
+    print(f"nominal sample against calculate_layup: same points and layer starts {same}, max deviation "
+          f"{deviation:.1e} mm, mass {1e3 * composite_mass(reference):.4f} / {1e3 * nominal.masses()[0]:.4f} kg")
@@ -0,0 +1,242 @@
+# coding=utf-8
+"""
+Input deck variants without CAE
+Changes of the material properties, of the load magnitude or of the step controls in routine_constants do not change
+the geometry nor the mesh, hence they do not need build_model.py: the input deck written once per geometry is patched.
+The base deck is streamed once, line by line, and split into verbatim text and the blocks that may be edited
+    *Material -> *Elastic, *Density    *Step (inc=)    *Static    *Dsload, *Cload
+Every variant is then written by joining the verbatim text with the edited blocks.
+Run from  root '/' directory
+"""
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+import src.routines.routine_constants as rc
+
+# material options that do not close a *Material block
+MATERIAL_OPTIONS = ('density', 'elastic', 'expansion', 'damping', 'plastic', 'conductivity', 'specific heat',
+                    'depvar', 'user material')
+VALUES_PER_LINE = 8  # data lines of material options hold at most 8 values
+LOAD_NAME = re.compile(r'\*\* Name: (\S+)\s+Type:')
+
+# routine_constants that can be changed by patching, and where they are in the deck
+PATCHABLE_CONSTANTS = {
+    'LAYUP_MATERIAL_PROPS': ('material', rc.LAYUP_MATERIAL, 'elastic'),
+    'LAYUP_DENSITY': ('material', rc.LAYUP_MATERIAL, 'density'),
+    'LINER_MATERIAL_PROPS': ('material', rc.LINER_MATERIAL, 'elastic'),
+    'LOAD_MAG': ('load', rc.LOAD, 'magnitude'),
+    'MAX_NUM_INC': ('step', rc.STEP, 'inc'),
+    'INITIAL_INC': ('step', rc.STEP, 'initial'),
+    'MAX_INC': ('step', rc.STEP, 'max'),
+}
+STATIC_FIELDS = {'initial': 0, 'max': 3}  # position in the data line of *Static: initial, period, min, max increment
+
+type Edits = Dict[Tuple[str, str, str], Union[float, Sequence[float]]]  # (kind, name, entry) -> value(s)
+
+
+@dataclass
+class _Block:
+    kind: str  # 'elastic', 'density', 'step', 'static' or 'load'
+    name: str  # name of the material, step or load
+    keyword: str  # keyword line
+    data: List[str] = field(default_factory=list)  # data lines
+
+
+def _parse_keyword(line: str) -> Tuple[str, Dict[str, str]]:
+    """
+    :return: lower case keyword and its parameters. E.g. '*Step, name=Step-1, inc=100' -> 'step', {'name': 'Step-1', ...}
+    """
+    keyword, *parameters = [item.strip() for item in line[1:].rstrip().split(',')]
+    options = {}
+    for parameter in parameters:
+        key, _, value = parameter.partition('=')
+        options[key.strip().lower()] = value.strip()
+    return keyword.lower(), options
+
+
+def _format(value: float) -> str:
+    return repr(float(value))
+
+
+def _data_lines(values: Sequence[float]) -> List[str]:
+    return [', '.join(_format(value) for value in values[i:i + VALUES_PER_LINE]) + '\n'
+            for i in range(0, len(values), VALUES_PER_LINE)]
+
+
+def _replace_field(line: str, position: int, value: float) -> str:
+    fields = [item.strip() for item in line.rstrip().rstrip(',').split(',')]
+    fields[position] = _format(value)
+    return ', '.join(fields) + '\n'
+
+
+def edits_from_constants(**constants) -> Edits:
+    """
+    :param constants: new values of routine_constants, e.g. LOAD_MAG=80., LAYUP_MATERIAL_PROPS=(...)
+    """
+    edits = {}
+    for name, value in constants.items():
+        if name not in PATCHABLE_CONSTANTS:
+            raise ValueError(f"{name} cannot be changed without rebuilding the model. "
+                             f"Patchable constants: {', '.join(PATCHABLE_CONSTANTS)}")
+        kind, target, entry = PATCHABLE_CONSTANTS[name]
+        edits[(kind, target, entry)] = (value,) if entry == 'density' else value
+    return edits
+
+
+class DeckTemplate:
+    def __init__(self, lines: Iterable[str]):
+        """
+        :param lines: lines of the base input deck, e.g. an open file. See from_file
+        """
+        self.segments: List[Union[str, _Block]] = []
+        verbatim: List[str] = []
+        material = step = load = None
+        block = None
+
+        def flush():
+            if verbatim:
+                self.segments.append(''.join(verbatim))
+                verbatim.clear()
+
+        for line in lines:
+            if line.startswith('**'):
+                block = None
+                match = LOAD_NAME.match(line)
+                if match:
+                    load = match.group(1)
+                verbatim.append(line)
+                continue
+
+            if not line.startswith('*'):
+                if block is not None:
+                    block.data.append(line)
+                else:
+                    verbatim.append(line)
+                continue
+
+            keyword, options = _parse_keyword(line)
+            block = None
+            if keyword == 'material':
+                material = options.get('name')
+            elif keyword not in MATERIAL_OPTIONS:
+                material = None
+
+            if keyword == 'step':
+                step = options.get('name')
+                flush()
+                self.segments.append(_Block('step', step, line))
+                continue
+            elif keyword == 'end step':
+                step = None
+
+            if material is not None and keyword in ('elastic', 'density'):
+                block = _Block(keyword, material, line)
+            elif step is not None and keyword == 'static':
+                block = _Block('static', step, line)
+            elif step is not None and keyword in ('dsload', 'cload'):
+                block = _Block('load', load, line)
+
+            if block is not None:
+                flush()
+                self.segments.append(block)
+            else:
+                verbatim.append(line)
+        flush()
+
+    @classmethod
+    def from_file(cls, path: str) -> "DeckTemplate":
+        with open(path, 'r') as file:
+            return cls(file)
+
+    def _render_block(self, block: _Block, edits: Edits, applied: set) -> str:
+        if block.kind in ('elastic', 'density'):
+            key = ('material', block.name, block.kind)
+            if key not in edits:
+                return block.keyword + ''.join(block.data)
+            applied.add(key)
+            return block.keyword + ''.join(_data_lines(edits[key]))
+
+        if block.kind == 'step':
+            key = ('step', block.name, 'inc')
+            if key not in edits:
+                return block.keyword
+            applied.add(key)
+            keyword, options = _parse_keyword(block.keyword)
+            options['inc'] = str(int(edits[key]))
+            name = block.keyword[1:].split(',')[0].strip()
+            parameters = [f"{parameter}={value}" if value else parameter for parameter, value in options.items()]
+            return '*' + ', '.join([name] + parameters) + '\n'
+
+        data = list(block.data)
+        if block.kind == 'static':
+            for entry, position in STATIC_FIELDS.items():
+                key = ('step', block.name, entry)
+                if key in edits and data:
+                    applied.add(key)
+                    data[0] = _replace_field(data[0], position, edits[key])
+        elif block.kind == 'load':
+            key = ('load', block.name, 'magnitude')
+            if key in edits:
+                applied.add(key)
+                data = [_replace_field(line, -1, edits[key]) for line in data]
+        return block.keyword + ''.join(data)
+
+    def render(self, edits: Edits) -> str:
+        """
+        :return: the text of the patched deck
+        """
+        applied = set()
+        text = ''.join(segment if isinstance(segment, str) else self._render_block(segment, edits, applied)
+                       for segment in self.segments)
+        missing = set(edits) - applied
+        if missing:
+            raise ValueError(f"not found in the base deck: {sorted(missing)}")
+        return text
+
+    def write(self, path: str, edits: Edits) -> str:
+        text = self.render(edits)
+        with open(path + '.tmp', 'w') as file:
+            file.write(text)
+        os.replace(path + '.tmp', path)
+        return path
+
+
+def patch_deck(base: str, output: str, **constants) -> str:
+    """
+    Writes a variant of the input deck :base:
+    :param constants: new values of routine_constants. See PATCHABLE_CONSTANTS
+    :return: path of the new deck
+    """
+    return DeckTemplate.from_file(base).write(output, edits_from_constants(**constants))
+
+
+def write_variants(base: str, variants: Iterable[Tuple[str, Dict]], directory: str = '.') -> List[str]:
+    """
+    :param variants: pairs of (job name, dict of new values of routine_constants)
+    :return: paths of the input decks, named after the jobs
+    """
+    template = DeckTemplate.from_file(base)
+    os.makedirs(directory, exist_ok=True)
+    return [template.write(os.path.join(directory, f"{job_name}.inp"), edits_from_constants(**constants))
+            for job_name, constants in variants]
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # Throughput benchmark: python ./src/variants.py base.inp [number of variants] [output directory]
+    base = sys.argv[1]
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    directory = sys.argv[3] if len(sys.argv) > 3 else os.path.join('.', 'temp', 'variants')
+
+    start = time.perf_counter()
+    variants = [(f"variant_{i:04d}", dict(LOAD_MAG=rc.LOAD_MAG * (0.8 + 0.4 * i / n),
+                                          LAYUP_MATERIAL_PROPS=tuple(value * (0.95 + 0.1 * i / n)
+                                                                     for value in rc.LAYUP_MATERIAL_PROPS)))
+                for i in range(n)]
+    files = write_variants(base, variants, directory)
+    elapsed = time.perf_counter() - start
+    print(f"{len(files)} variants of {base} in {elapsed:.2f} s ({len(files) / elapsed:.0f} decks/s)")
@@ -1,11 +1,127 @@
+from typing import Callable, Dict, List, Sequence
+
 from model import CurvesBunch
 
 import tkinter as tk
 
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
 
 
 class GUI(tk.Tk):
-    def __init__(self, model: CurvesBunch) -> None:
+    """
+    Layup editor. Shows the stacked layers and lets the user edit the stacking sequence and the design constants.
+    The liner and the axes are drawn once and cached as background; the layer lines are animated artists which are
+    reused between edits and blitted on top of the background.
+    """
+
+    def __init__(self, model: CurvesBunch, constants: Dict[str, float] = None) -> None:
         super().__init__()
         self.model = model
-        
\ No newline at end of file
+        self.title('OpenHydroTank - layup editor')
+
+        # ----- Controls -----
+        controls = tk.Frame(self)
+        controls.pack(side=tk.LEFT, fill=tk.Y, padx=5, pady=5)
+
+        tk.Label(controls, text='Stacking sequence (°)').pack(anchor=tk.W)
+        self.angles_text = tk.Text(controls, width=30, height=12)
+        self.angles_text.pack(anchor=tk.W)
+
+        self.constant_entries: Dict[str, tk.Entry] = {}
+        for name, value in (constants or {}).items():
+            row = tk.Frame(controls)
+            row.pack(anchor=tk.W, fill=tk.X)
+            tk.Label(row, text=name, width=12, anchor=tk.W).pack(side=tk.LEFT)
+            entry = tk.Entry(row, width=10)
+            entry.insert(0, str(value))
+            entry.pack(side=tk.LEFT)
+            self.constant_entries[name] = entry
+
+        self.apply_button = tk.Button(controls, text='Apply')
+        self.apply_button.pack(anchor=tk.W, pady=5)
+        self.status = tk.Label(controls, text='', anchor=tk.W, justify=tk.LEFT)
+        self.status.pack(anchor=tk.W)
+
+        # ----- Plot -----
+        self.figure = Figure(figsize=(7, 7))
+        self.ax = self.figure.add_subplot()
+        self.ax.set_title('Plot of the stacked layers')
+        self.ax.set_xlabel('radial coordinate -- x (mm)')
+        self.ax.set_ylabel('axial coordinate -- y (mm)')
+        liner = model.curves[0]
+        self.ax.plot(liner.x, liner.y, c="k", label='Liner outer shape')
+
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.get_tk_widget().pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
+
+        self.layer_lines: List = []
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+        self.set_layers(model, 0)
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.canvas.draw()
+
+    # ----- Input -----
+    def bind_apply(self, callback: Callable[[], None]) -> None:
+        self.apply_button.configure(command=callback)
+        self.bind('<Control-Return>', lambda event: callback())
+
+    def get_angles_text(self) -> str:
+        return self.angles_text.get('1.0', tk.END)
+
+    def set_angles(self, angles: Sequence[float]) -> None:
+        self.angles_text.delete('1.0', tk.END)
+        self.angles_text.insert('1.0', ', '.join(f"{angle:g}" for angle in angles))
+
+    def get_constants_text(self) -> Dict[str, str]:
+        return {name: entry.get() for name, entry in self.constant_entries.items()}
+
+    def show_status(self, text: str) -> None:
+        self.status.configure(text=text)
+
+    # ----- Drawing -----
+    def _on_draw(self, event) -> None:
+        # the background is everything but the layers. It is captured again after every full redraw, e.g., resizing
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self._draw_layers()
+
+    def _draw_layers(self) -> None:
+        for line in self.layer_lines:
+            self.ax.draw_artist(line)
+
+    def set_layers(self, model: CurvesBunch, first: int) -> None:
+        """
+        Updates the artists of the layers from index :first: (0-based, liner excluded) upward
+        """
+        self.model = model
+        curves = model.curves[1:]
+        # drop the artists of layers that no longer exist, create the missing ones
+        for line in self.layer_lines[len(curves):]:
+            line.remove()
+        del self.layer_lines[len(curves):]
+        while len(self.layer_lines) < len(curves):
+            line, = self.ax.plot([], [], '-', lw=1, animated=True)
+            self.layer_lines.append(line)
+
+        for line, curve in zip(self.layer_lines[first:], curves[first:]):
+            line.set_data(*curve.get_layer_unpacked_xy())
+
+    def redraw(self) -> None:
+        """
+        Blits the layers on top of the cached background. A full redraw only happens when the layers leave the view.
+        """
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        topmost = self.model.curves[-1]
+        outside = topmost.x.max() > x_max or topmost.y.max() > y_max or topmost.x.min() < x_min
+        if self.background is None or outside:
+            self.ax.relim()
+            self.ax.autoscale_view()
+            self.canvas.draw()  # recaptures the background and draws the layers through _on_draw
+            return
+        self.canvas.restore_region(self.background)
+        self._draw_layers()
+        self.canvas.blit(self.ax.bbox)
@@ -0,0 +1,161 @@
+# coding=utf-8
+"""
+CAE workers on CPython
+Runs the worker mode of build_model.py without Abaqus: a stand-in model database and stand-in routine modules record
+what the worker does with them. The queue handling, the reset of the model database, the update mode and the recovery
+of the claims of dead workers can then be checked on the host, as well as build_model_with_worker of pipeline.py.
+Run from  root '/' directory
+"""
+import os
+import threading
+from types import SimpleNamespace
+from typing import Callable, List, Optional, Tuple
+
+from src import build_model
+
+ROUTINES = ('create_part', 'cut_face', 'assemble_parts', 'create_sets_surfs', 'mesher', 'orient_elements',
+            'assign_property', 'trivial')
+
+
+class StandInMdb:
+    """ model database: a new one for every full build, see build_model.reset_model """
+    count = 0
+
+    def __init__(self):
+        StandInMdb.count += 1
+        self.number = StandInMdb.count
+        self.models = {}
+
+    def __repr__(self) -> str:
+        return f"Mdb-{self.number}"
+
+
+class StandInRoutine:
+    """ routine module whose functions record their calls, with the model database the module sees """
+
+    def __init__(self, name: str, calls: List[tuple], fail: Optional[str] = None):
+        self.name, self.calls, self.fail = name, calls, fail
+        self.mdb = None
+
+    def __getattr__(self, function: str) -> Callable:
+        def record(*args, **kwargs):
+            self.calls.append((self.name, function, self.mdb, args + tuple(kwargs.items())))
+            if self.fail is not None and self.fail in args:
+                raise RuntimeError(f"{self.name}.{function} failed on {self.fail}")
+        return record
+
+
+def stand_in_routines(fail: Optional[str] = None) -> Tuple[SimpleNamespace, List[tuple]]:
+    """
+    :param fail: job name whose build raises, in trivial, to check the failed designs
+    :return: namespace with the routine modules, as src.routines, and the list of their calls
+    """
+    calls = []
+    return SimpleNamespace(**{name: StandInRoutine(name, calls, fail if name == 'trivial' else None)
+                              for name in ROUTINES}), calls
+
+
+def start_worker(queue_dir: str, update_mode: bool = False, fail: Optional[str] = None,
+                 **kwargs) -> Tuple[threading.Thread, List[tuple]]:
+    """
+    Serves the queue in a thread, as `abaqus cae noGUI=../src/build_model.py -- --worker queue_dir --no-submit`
+    :param kwargs: see build_model.serve
+    :return: thread, stopped by a STOP file or after max_designs, and the calls of the routines
+    """
+    routines, calls = stand_in_routines(fail)
+    modules = [getattr(routines, name) for name in ROUTINES]
+    handle = build_model.make_handler(routines, modules, StandInMdb, False, update_mode)
+    thread = threading.Thread(target=build_model.serve, args=(queue_dir, handle), kwargs=kwargs, daemon=True)
+    thread.start()
+    return thread, calls
+
+
+def drop(queue_dir: str, job_name: str, data) -> str:
+    """
+    :param data: content of the intermediate file, see build_model.unpack_interchange
+    :return: path of the file in the queue
+    """
+    path = os.path.join(queue_dir, job_name + build_model.QUEUE_EXTENSION)
+    with open(path + '.tmp', 'w') as file:
+        file.write(str(data))
+    os.replace(path + '.tmp', path)
+    return path
+
+
+if __name__ == "__main__":
+    import asyncio
+    import tempfile
+    import time
+    from src.pipeline import Design, build_model_with_worker, compute_geometry
+
+    def lines(heights):
+        return {'lines': [[(0., 0.), (10., float(height))] for height in heights],
+                'angles': [15.] * (len(heights) - 1)}
+
+    with tempfile.TemporaryDirectory() as queue:
+        # update mode: full build, then an update from the first changed line
+        drop(queue, 'a', lines([0, 1, 2, 3, 4]))
+        drop(queue, 'b', lines([0, 1, 2, 5, 6]))
+        drop(queue, 'c', lines([0, 1, 2, 5, 6]))
+        thread, calls = start_worker(queue, update_mode=True, max_designs=3)
+        thread.join()
+        builds = [call for call in calls if call[:2] == ('create_part', 'main')]
+        updates = [call[3][1] for call in calls if call[:2] == ('cut_face', 'update')]
+        # every routine works on the model database of the last full build
+        rebound = all(call[2] is build[2] for build, following in zip(builds, builds[1:] + [None])
+                      for call in calls[calls.index(build):calls.index(following) if following else None])
+        print(f"update mode: {len(builds)} full build, updates from lines {updates}, "
+              f"{len([call for call in calls if call[:2] == ('trivial', 'write_job')])} jobs written, "
+              f"mdb rebound in every routine: {rebound}, done: {sorted(n for n in os.listdir(queue) if 'done' in n)}")
+
+        # failed build
+        drop(queue, 'd', lines([0, 1]))
+        thread, _ = start_worker(queue, fail='d', max_designs=1)
+        thread.join()
+        with open(os.path.join(queue, 'd.err')) as file:
+            print(f"failed build: d.txt.failed {os.path.exists(os.path.join(queue, 'd.txt.failed'))}, "
+                  f"d.err ends with '{file.read().strip().splitlines()[-1]}'")
+
+        # claims of dead workers: retried, then failed after MAX_ATTEMPTS
+        stale = time.time() - 2 * build_model.LEASE
+        for name in ('e', 'f'):
+            claimed = drop(queue, name, lines([0, 1])) + build_model.CLAIM_EXTENSION
+            os.rename(claimed[:-len(build_model.CLAIM_EXTENSION)], claimed)
+            os.utime(claimed, (stale, stale))
+        with open(os.path.join(queue, 'f.recovered'), 'w') as file:
+            file.write('0\n' * (build_model.MAX_ATTEMPTS - 1))
+        thread, calls = start_worker(queue, max_designs=1)
+        thread.join()
+        print(f"dead workers: e rebuilt {os.path.exists(os.path.join(queue, 'e.txt.done'))}, "
+              f"f failed {os.path.exists(os.path.join(queue, 'f.txt.failed'))} after {build_model.MAX_ATTEMPTS} "
+              f"attempts")
+
+        # heartbeat: a claim touched by its worker is not recovered while the build is longer than the lease
+        drop(queue, 'g', lines([0, 1]))
+        routines, _ = stand_in_routines()
+        slow = SimpleNamespace(**vars(routines))
+        slow.mesher = SimpleNamespace(main=lambda *args: time.sleep(1.), mdb=None)
+        handle = build_model.make_handler(slow, [], StandInMdb, False, False)
+        thread = threading.Thread(target=build_model.serve, args=(queue, handle),
+                                  kwargs={'max_designs': 1, 'heartbeat': 0.1}, daemon=True)
+        thread.start()
+        time.sleep(0.5)
+        recovered = build_model.recover(queue, lease=0.3)
+        thread.join()
+        print(f"heartbeat: recovered while building {recovered}, "
+              f"g done {os.path.exists(os.path.join(queue, 'g.txt.done'))}")
+
+        # pipeline stage against a worker, and without any
+        design = compute_geometry(Design('h', [15., 30., 90.]))
+        thread, _ = start_worker(queue, max_designs=1)
+        design = asyncio.run(build_model_with_worker(design, queue))
+        thread.join()
+        # the intermediate file holds plain floats, which the worker reads back with eval
+        read = build_model.read_interchange(design.artifacts['interchange']) == design.curves.to_abaqus_format()
+        print(f"build_model_with_worker: {design.artifacts['interchange']}, read back {read}")
+        design = compute_geometry(Design('i', [15., 30., 90.]))
+        try:
+            asyncio.run(build_model_with_worker(design, queue, timeout=1.))
+        except TimeoutError as error:
+            print(f"without workers: {error!r}, withdrawn from the queue "
+                  f"{not os.path.exists(os.path.join(queue, design.job_name + '.txt'))}")